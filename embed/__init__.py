@@ -1,8 +1,25 @@
 """Embed functions for OpenAI API experimentation."""
 
 __all__ = [
+    'allpairs',
+    'binary',
     'cached',
+    'hnsw',
+    'ivf',
+    'microbatch',
+    'pq',
+    'reduce',
+    'search',
+    'sharded',
     'DIMENSION',
+    'DEFAULT_MAX_BATCH_SIZE',
+    'DEFAULT_MAX_BATCH_TOKENS',
+    'DEFAULT_MAX_WORKERS',
+    'DEFAULT_ENCODING_FORMAT',
+    'requests_session',
+    'dedup_stats',
+    'rate_limiter',
+    'concurrency_controller',
     'embed_one',
     'embed_many',
     'embed_one_eu',
@@ -11,16 +28,34 @@ __all__ = [
     'embed_many_req',
 ]
 
+import base64
 import datetime
+import functools
 import http
 
-import backoff
 import numpy as np
 import openai
 import openai.embeddings_utils
 import requests
 
-from . import _keys, cached
+from . import (
+    _batching,
+    _concurrency,
+    _http,
+    _keys,
+    _ratelimit,
+    _retry,
+    allpairs,
+    binary,
+    cached,
+    hnsw,
+    ivf,
+    microbatch,
+    pq,
+    reduce,
+    search,
+    sharded,
+)
 
 # Give this module an api_key property to be accessed from the outside.
 _keys.initialize(__name__)
@@ -28,16 +63,139 @@ _keys.initialize(__name__)
 DIMENSION = 1536
 """Dimension of the vector space text-embedding-ada-002 embeds texts in."""
 
+DEFAULT_MAX_BATCH_SIZE = 2048
+"""Default maximum number of texts ``embed_many*`` send in each request."""
+
+DEFAULT_MAX_BATCH_TOKENS = 300_000
+"""
+Default maximum of estimated tokens ``embed_many*`` send in each request.
+
+Tokens are estimated conservatively, without tokenizing. A text estimated to
+be over this limit is still sent, in a request by itself.
+"""
+
+DEFAULT_MAX_WORKERS = 1
+"""
+Default maximum number of requests ``embed_many*`` make at once.
+
+When a call's texts are split into multiple requests, up to this many are in
+flight at the same time. The default of 1 sends them one after another.
+"""
+
+DEFAULT_ENCODING_FORMAT = 'float'
+"""
+Default format ``embed_one_req`` and ``embed_many_req`` get embeddings in.
+
+With ``float``, each embedding is sent as a JSON list of numbers. With
+``base64``, each is sent as its little-endian float32 bytes, base64-encoded.
+That makes responses about 3 times smaller, and decoding them is much faster.
+"""
+
+_ENCODING_FORMATS = frozenset({'float', 'base64'})
+"""Values of ``encoding_format`` that ``embed_*_req`` functions support."""
+
+_EMBEDDINGS_URL = 'https://api.openai.com/v1/embeddings'
+"""URL of the API endpoint that ``requests``-based functions post to."""
+
 _REQUESTS_TIMEOUT = datetime.timedelta(seconds=60)
-"""Connection timeout for ``embed_one_req`` and ``embed_many_req``."""
+"""Default timeout for connecting, and for reading, in HTTP requests."""
+
+requests_session = _http.PooledSession(
+    pool_size=10,
+    connect_timeout=_REQUESTS_TIMEOUT,
+    read_timeout=_REQUESTS_TIMEOUT,
+)
+"""
+Session that ``embed_one_req`` and ``embed_many_req`` make requests with.
+
+Its connections are kept alive and reused, by later calls and by other
+threads, to avoid a new TCP and TLS handshake on every request. Its
+``pool_size``, ``connect_timeout``, and ``read_timeout`` can be set. When
+``embed_many_req`` is called with ``max_workers`` above the pool size, the
+extra connections are not reused. ``requests_session.close()`` closes its
+connections.
+"""
+
+dedup_stats = _batching.DedupStats()
+"""
+Counts of texts passed to ``embed_many*`` and of duplicates not sent.
 
+Each call sends each distinct text it is given only once, and copies the
+embedding to every row where that text appears. ``dedup_stats.texts`` is the
+number of texts passed in, and ``dedup_stats.collapsed`` the number that were
+not sent because they repeated an earlier text in the same call. This includes
+calls from ``embed.aio``. ``dedup_stats.clear()`` resets them.
+"""
 
-@backoff.on_exception(backoff.expo, openai.error.RateLimitError)
+rate_limiter = _ratelimit.RateLimiter()
+"""
+Pacer that all requests for embeddings wait on, to stay under rate limits.
+
+Set ``rate_limiter.requests_per_minute`` and ``rate_limiter.tokens_per_minute``
+to the API key's limits to send requests about as fast as they allow, rather
+than bursting and backing off after HTTP 429 errors. Both are ``None`` by
+default, which does no pacing. Calls from all threads, and from ``embed.aio``,
+share the limits. Tokens are estimated before each request, then corrected by
+the usage the API reports. The ``requests``- and ``aiohttp``-based functions
+also calibrate the limiter from the API's ``x-ratelimit-*`` response headers.
+"""
+
+concurrency_controller = _concurrency.ConcurrencyController()
+"""
+Adaptive limit on how many requests for embeddings are in flight at once.
+
+Set ``concurrency_controller.enabled`` to have requests from all threads, and
+from ``embed.aio``, wait for its limit. It raises the limit while responses
+are healthy, and cuts it when a request is throttled with HTTP 429 or latency
+rises. It never goes above ``max_workers`` or ``max_concurrency``, so pass a
+high value to ``embed_many*`` to let it find the best level. Whether or not
+it is enabled, ``concurrency``, ``in_flight``, ``latency``, and
+``throughput`` (requests per second) can be read at any time.
+"""
+
+
+@_retry.on_exception(_retry.OPENAI_ERRORS, giveup=_retry.gives_up_openai)
 def _create_embedding(text_or_texts):
-    """Use the OpenAI library to get one or more embeddings, with backoff."""
-    return openai.Embedding.create(
-        input=text_or_texts,
-        model='text-embedding-ada-002',
+    """Use the OpenAI library to get one or more embeddings, with retries."""
+    tokens = _ratelimit.request_tokens(text_or_texts)
+    rate_limiter.acquire(tokens)
+    with concurrency_controller.slot() as slot:
+        try:
+            openai_response = openai.Embedding.create(
+                input=text_or_texts,
+                model='text-embedding-ada-002',
+            )
+        except openai.error.RateLimitError:
+            slot.throttle()
+            raise
+    rate_limiter.settle(tokens, openai_response.usage.total_tokens)
+    return openai_response
+
+
+def _embed_batched(embed_batch, texts,
+                   max_batch_size, max_batch_tokens, max_workers):
+    """
+    Embed texts, calling ``embed_batch`` on as many batches as needed.
+
+    Duplicate texts are sent once and counted in ``dedup_stats``. Each batch
+    is under the given limits, up to ``max_workers`` batches are embedded
+    concurrently, and the results are stitched into a single matrix.
+    Arguments passed as ``None`` are replaced by the defaults.
+    """
+    if max_batch_size is None:
+        max_batch_size = DEFAULT_MAX_BATCH_SIZE
+    if max_batch_tokens is None:
+        max_batch_tokens = DEFAULT_MAX_BATCH_TOKENS
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+
+    return _batching.embed_batched(
+        embed_batch, texts,
+        max_size=max_batch_size,
+        max_tokens=max_batch_tokens,
+        max_workers=max_workers,
+        dimension=DIMENSION,
+        stats=dedup_stats,
     )
 
 
@@ -47,63 +205,158 @@ def embed_one(text):
     return np.array(openai_response.data[0].embedding, dtype=np.float32)
 
 
-def embed_many(texts):
-    """Embed multiple pieces of text."""
+def _embed_many_batch(texts):
+    """Embed multiple pieces of text in a single request."""
     openai_response = _create_embedding(texts)
     embeddings = [datum.embedding for datum in openai_response.data]
     return np.array(embeddings, dtype=np.float32)
 
 
+def embed_many(texts, *, max_batch_size=None, max_batch_tokens=None,
+               max_workers=None):
+    """Embed multiple pieces of text. Splits them into requests as needed."""
+    return _embed_batched(_embed_many_batch, texts,
+                          max_batch_size, max_batch_tokens, max_workers)
+
+
 def embed_one_eu(text):
     """Embed a single piece of text. Uses ``embeddings_utils``."""
-    embedding = openai.embeddings_utils.get_embedding(
-        text=text,
-        engine='text-embedding-ada-002',
-    )
+    rate_limiter.acquire(_ratelimit.request_tokens(text))
+    with concurrency_controller.slot():
+        embedding = openai.embeddings_utils.get_embedding(
+            text=text,
+            engine='text-embedding-ada-002',
+        )
     return np.array(embedding, dtype=np.float32)
 
 
-def embed_many_eu(texts):
-    """Embed multiple pieces of text. Uses ``embeddings_utils``."""
-    embeddings = openai.embeddings_utils.get_embeddings(
-        list_of_text=texts,
-        engine='text-embedding-ada-002',
-    )
+def _embed_many_eu_batch(texts):
+    """Embed multiple pieces of text in a single ``embeddings_utils`` call."""
+    rate_limiter.acquire(_ratelimit.request_tokens(texts))
+    with concurrency_controller.slot():
+        embeddings = openai.embeddings_utils.get_embeddings(
+            list_of_text=texts,
+            engine='text-embedding-ada-002',
+        )
     return np.array(embeddings, dtype=np.float32)
 
 
+def embed_many_eu(texts, *, max_batch_size=None, max_batch_tokens=None,
+                  max_workers=None):
+    """
+    Embed multiple pieces of text. Uses ``embeddings_utils``. Splits them into
+    requests as needed.
+    """
+    return _embed_batched(_embed_many_eu_batch, texts,
+                          max_batch_size, max_batch_tokens, max_workers)
+
+
 def _needs_backoff(response):
     """Check if a response has given an HTTP 429 Too Many Requests error."""
     return response.status_code == http.HTTPStatus.TOO_MANY_REQUESTS
 
 
-@backoff.on_predicate(backoff.expo, _needs_backoff)
-def _post_request(text_or_texts):
-    """Make a POST request to the API endpoint, with backoff."""
-    return requests.post(
-        url='https://api.openai.com/v1/embeddings',
-        headers={
-            'Authorization': f'Bearer {_keys.api_key}',
-            'Content-Type': 'application/json',
-        },
-        json={
-            'input': text_or_texts,
-            'model': 'text-embedding-ada-002',
-        },
-        timeout=_REQUESTS_TIMEOUT.total_seconds(),
-    )
+def _needs_retry(response):
+    """Check if a response has given an error that may pass if retried."""
+    return _retry.is_retryable_status(response.status_code)
 
 
-def embed_one_req(text):
-    """Embed a single piece of text. Uses ``requests``."""
-    response = _post_request(text)
-    response.raise_for_status()
-    return np.array(response.json()['data'][0]['embedding'], dtype=np.float32)
+def _resolve_encoding_format(encoding_format):
+    """Check an ``encoding_format`` argument, replacing ``None`` by default."""
+    if encoding_format is None:
+        encoding_format = DEFAULT_ENCODING_FORMAT
+    if encoding_format not in _ENCODING_FORMATS:
+        raise ValueError(f'unsupported encoding_format {encoding_format!r}')
+    return encoding_format
+
+
+def _decode_embeddings(data, encoding_format):
+    """
+    Decode the ``data`` list of an API response into a float32 matrix.
+
+    For ``base64``, each embedding's bytes are decoded straight into its row
+    of a preallocated matrix, without ever being converted to Python floats.
+    """
+    if encoding_format == 'float':
+        return np.array([datum['embedding'] for datum in data],
+                        dtype=np.float32)
+
+    embeddings = np.empty((len(data), DIMENSION), dtype=np.float32)
+    for datum in data:
+        raw = base64.b64decode(datum['embedding'])
+        embeddings[datum['index']] = np.frombuffer(raw, dtype='<f4')
+    return embeddings
+
+
+@_retry.on_exception((requests.ConnectionError, requests.Timeout,
+                      requests.HTTPError))
+def _post_request(text_or_texts, encoding_format, tokens):
+    """
+    Make a POST request to the API endpoint, retrying as needed.
 
+    Each attempt waits on ``rate_limiter`` for a request of ``tokens`` tokens,
+    then for a slot from ``concurrency_controller``. Responses with statuses
+    worth retrying are raised as ``requests.HTTPError``, so that all failures
+    share one retry budget. Other responses are returned.
+    """
+    rate_limiter.acquire(tokens)
+    with concurrency_controller.slot() as slot:
+        response = requests_session.post(
+            url=_EMBEDDINGS_URL,
+            headers={
+                'Authorization': f'Bearer {_keys.api_key}',
+                'Content-Type': 'application/json',
+            },
+            json={
+                'input': text_or_texts,
+                'model': 'text-embedding-ada-002',
+                'encoding_format': encoding_format,
+            },
+        )
+        if _needs_backoff(response):
+            slot.throttle()
+    rate_limiter.calibrate(response.headers)
+    if _needs_retry(response):
+        response.raise_for_status()
+    return response
 
-def embed_many_req(texts):
-    """Embed multiple pieces of text. Uses ``requests``."""
-    response = _post_request(texts)
+
+def _request_embeddings(text_or_texts, encoding_format):
+    """Get one or more embeddings, as a matrix. Uses ``requests``."""
+    tokens = _ratelimit.request_tokens(text_or_texts)
+    response = _post_request(text_or_texts, encoding_format, tokens)
     response.raise_for_status()
-    embeddings = [datum['embedding'] for datum in response.json()['data']]
-    return np.array(embeddings, dtype=np.float32)
+    response_json = response.json()
+    rate_limiter.settle(tokens, response_json['usage']['total_tokens'])
+    return _decode_embeddings(response_json['data'], encoding_format)
+
+
+def embed_one_req(text, *, encoding_format=None):
+    """
+    Embed a single piece of text. Uses ``requests``.
+
+    ``encoding_format`` defaults to ``DEFAULT_ENCODING_FORMAT``.
+    """
+    encoding_format = _resolve_encoding_format(encoding_format)
+    return _request_embeddings(text, encoding_format)[0]
+
+
+def _embed_many_req_batch(texts, encoding_format):
+    """Embed multiple pieces of text in a single request. Uses ``requests``."""
+    return _request_embeddings(texts, encoding_format)
+
+
+def embed_many_req(texts, *, max_batch_size=None, max_batch_tokens=None,
+                   max_workers=None, encoding_format=None):
+    """
+    Embed multiple pieces of text. Uses ``requests``. Splits them into requests
+    as needed.
+
+    ``encoding_format`` defaults to ``DEFAULT_ENCODING_FORMAT``.
+    """
+    encoding_format = _resolve_encoding_format(encoding_format)
+    return _embed_batched(
+        functools.partial(_embed_many_req_batch,
+                          encoding_format=encoding_format),
+        texts, max_batch_size, max_batch_tokens, max_workers,
+    )
@@ -0,0 +1,276 @@
+"""
+Splitting of large ``embed_many*`` inputs into requests the API accepts.
+
+The embeddings endpoint limits how many inputs, and how many tokens in total,
+may be sent in one request. This splits a list of texts into consecutive
+batches under configured limits, embeds each batch, and stitches the results
+into a single matrix with the rows in input order. Batches may be embedded
+concurrently, on a bounded pool of worker threads or, for ``embed.aio``, as
+a bounded number of tasks on the running event loop.
+
+Repeated texts are only sent once: the input is deduplicated before it is
+split, and each distinct text's embedding is copied to all the rows where it
+appeared. A ``DedupStats`` object counts how many texts this collapsed.
+"""
+
+__all__ = [
+    'DedupStats',
+    'estimate_tokens',
+    'split',
+    'dedupe',
+    'embed_batched',
+    'embed_batched_async',
+]
+
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+
+import numpy as np
+
+_BYTES_PER_TOKEN = 3
+"""Conservative divisor to estimate tokens from UTF-8 length, without BPE."""
+
+
+class DedupStats:
+    """
+    Thread-safe counts of texts given to ``embed_many*`` and of duplicates.
+
+    ``texts`` is how many texts were passed in, and ``collapsed`` is how many
+    of them were not sent because an equal text in the same call was.
+    """
+
+    def __init__(self):
+        """Create a stats object with both counts zero."""
+        self._lock = threading.Lock()
+        self._texts = 0
+        self._collapsed = 0
+
+    def __repr__(self):
+        """Representation for debugging."""
+        with self._lock:
+            return (f'<{type(self).__name__}:'
+                    f' texts={self._texts} collapsed={self._collapsed}>')
+
+    @property
+    def texts(self):
+        """Number of texts passed in."""
+        return self._texts
+
+    @property
+    def collapsed(self):
+        """Number of texts passed in that were duplicates, so not sent."""
+        return self._collapsed
+
+    def record(self, texts, collapsed):
+        """Add to the counts."""
+        with self._lock:
+            self._texts += texts
+            self._collapsed += collapsed
+
+    def clear(self):
+        """Reset both counts to zero."""
+        with self._lock:
+            self._texts = 0
+            self._collapsed = 0
+
+
+def estimate_tokens(text):
+    """
+    Estimate, conservatively, how many tokens a text will be encoded as.
+
+    This does not tokenize. English text averages about 4 bytes per token,
+    and most other text is at least 3 bytes per token, so this divides the
+    UTF-8 length by 3, rounding up. It slightly overestimates for most text,
+    which is what we want when the estimate is used to stay under a limit.
+    """
+    return -(-len(text.encode('utf-8')) // _BYTES_PER_TOKEN)
+
+
+def split(texts, max_size, max_tokens):
+    """
+    Split texts into consecutive batches under the given size and token limits.
+
+    Each batch has at most ``max_size`` texts and, by ``estimate_tokens``, at
+    most ``max_tokens`` tokens. A single text estimated to exceed
+    ``max_tokens`` is put in a batch by itself (and may be rejected by the
+    API). Empty input gives no batches.
+    """
+    if max_size < 1:
+        raise ValueError(f'max_size must be positive, got {max_size!r}')
+
+    batches = []
+    start = 0
+    tokens = 0
+
+    for stop, text in enumerate(texts):
+        text_tokens = estimate_tokens(text)
+        if stop > start and (stop - start == max_size
+                             or tokens + text_tokens > max_tokens):
+            batches.append(texts[start:stop])
+            start = stop
+            tokens = 0
+        tokens += text_tokens
+
+    if start < len(texts):
+        batches.append(texts[start:])
+
+    return batches
+
+
+def dedupe(texts):
+    """
+    Find the distinct texts, in order of first appearance.
+
+    This returns the list of distinct texts and a ``numpy`` index array that
+    maps each position in ``texts`` to its text's position in that list. If
+    there are no duplicates, it returns ``texts`` itself and ``None``.
+    """
+    positions = {}
+    inverse = np.fromiter((positions.setdefault(text, len(positions))
+                           for text in texts),
+                          dtype=np.intp, count=len(texts))
+    if len(positions) == len(texts):
+        return texts, None
+    return list(positions), inverse
+
+
+# pylint: disable-next=too-many-arguments
+def embed_batched(embed_batch, texts, *,
+                  max_size, max_tokens, max_workers, dimension, stats):
+    """
+    Embed texts with ``embed_batch``, called on batches under the limits.
+
+    Duplicate texts are sent only once, and are counted in the ``DedupStats``
+    object ``stats``. If everything fits in one batch, ``embed_batch``'s
+    result is used as is. Otherwise the batches' results are written into one
+    preallocated float32 matrix. Either way, the rows of the result are in the
+    same order as ``texts``. Up to ``max_workers`` batches are embedded at a
+    time, each on its own thread.
+    """
+    if max_workers < 1:
+        raise ValueError(f'max_workers must be positive, got {max_workers!r}')
+
+    texts, inverse = _dedupe_counted(texts, stats)
+    embeddings = _embed_unique(embed_batch, texts,
+                               max_size=max_size, max_tokens=max_tokens,
+                               max_workers=max_workers, dimension=dimension)
+    return embeddings if inverse is None else embeddings[inverse]
+
+
+# pylint: disable-next=too-many-arguments
+def _embed_unique(embed_batch, texts, *,
+                  max_size, max_tokens, max_workers, dimension):
+    """Helper for ``embed_batched``, after duplicates have been removed."""
+    batches = split(texts, max_size, max_tokens)
+
+    if not batches:
+        return np.empty((0, dimension), dtype=np.float32)
+    if len(batches) == 1:
+        return embed_batch(batches[0])
+
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+
+    def embed_into(start, batch):
+        embeddings[start:start + len(batch)] = embed_batch(batch)
+
+    if max_workers == 1:
+        for start, batch in zip(_starts(batches), batches):
+            embed_into(start, batch)
+    else:
+        _run_concurrently(embed_into, zip(_starts(batches), batches),
+                          min(max_workers, len(batches)))
+
+    return embeddings
+
+
+# pylint: disable-next=too-many-arguments
+async def embed_batched_async(embed_batch, texts, *,
+                              max_size, max_tokens, max_concurrency,
+                              dimension, stats):
+    """
+    Embed texts with the coroutine function ``embed_batch``, called on batches.
+
+    This is like ``embed_batched``, but up to ``max_concurrency`` batches are
+    awaited at a time, as tasks on the running event loop rather than threads.
+    """
+    if max_concurrency < 1:
+        raise ValueError(
+            f'max_concurrency must be positive, got {max_concurrency!r}')
+
+    texts, inverse = _dedupe_counted(texts, stats)
+    embeddings = await _embed_unique_async(
+        embed_batch, texts,
+        max_size=max_size,
+        max_tokens=max_tokens,
+        max_concurrency=max_concurrency,
+        dimension=dimension,
+    )
+    return embeddings if inverse is None else embeddings[inverse]
+
+
+# pylint: disable-next=too-many-arguments
+async def _embed_unique_async(embed_batch, texts, *,
+                              max_size, max_tokens, max_concurrency,
+                              dimension):
+    """Helper for ``embed_batched_async``, after removing duplicates."""
+    batches = split(texts, max_size, max_tokens)
+
+    if not batches:
+        return np.empty((0, dimension), dtype=np.float32)
+    if len(batches) == 1:
+        return await embed_batch(batches[0])
+
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def embed_into(start, batch):
+        async with semaphore:
+            embeddings[start:start + len(batch)] = await embed_batch(batch)
+
+    tasks = [asyncio.ensure_future(embed_into(start, batch))
+             for start, batch in zip(_starts(batches), batches)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return embeddings
+
+
+def _dedupe_counted(texts, stats):
+    """Call ``dedupe`` and record how many texts it collapsed in ``stats``."""
+    unique, inverse = dedupe(texts)
+    stats.record(len(texts), len(texts) - len(unique))
+    return unique, inverse
+
+
+def _starts(batches):
+    """Give the index, in the concatenated input, where each batch starts."""
+    return itertools.accumulate((len(batch) for batch in batches[:-1]),
+                                initial=0)
+
+
+def _run_concurrently(func, arguments, max_workers):
+    """
+    Call ``func`` on each tuple of arguments, using a pool of worker threads.
+
+    If any call raises an exception, calls that have not started are canceled
+    and the exception is reraised once the calls already running are done.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix='embed_batched',
+    ) as executor:
+        futures = [executor.submit(func, *args) for args in arguments]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
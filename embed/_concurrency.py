@@ -0,0 +1,283 @@
+"""
+Adaptive limit on how many requests are in flight at once.
+
+How much concurrency the API rewards varies as its load does. Too little
+leaves throughput unused, and too much gets requests throttled or slowed
+down. A ``ConcurrencyController`` adjusts its limit by AIMD (additive
+increase, multiplicative decrease), as TCP congestion control does: healthy
+responses raise the limit by about one per round of requests, while an HTTP
+429 response halves it, and a short-term average latency well above the
+long-term average cuts it by a smaller factor. Only requests that started
+after the last cut can cause another, so a burst of bad responses to one
+round counts once. Until the first cut, each healthy response raises the limit
+by one, so it doubles each round.
+
+Requests take slots from the controller and return them when done. Waiting
+threads and tasks are given slots in the order they asked for them, by
+handing off each slot as it is freed, so nothing polls.
+"""
+
+__all__ = ['ConcurrencyController']
+
+import asyncio
+import collections
+import contextlib
+import threading
+import time
+
+_THROTTLE_FACTOR = 0.5
+"""Factor the limit is multiplied by when a request is throttled."""
+
+_LATENCY_FACTOR = 0.9
+"""Factor the limit is multiplied by when latency rises too high."""
+
+_LATENCY_TOLERANCE = 2.0
+"""How many times the baseline the average latency may be, to be healthy."""
+
+_LATENCY_SLACK = 0.005
+"""Seconds the average latency may exceed the baseline by, however small."""
+
+_LATENCY_SMOOTHING = 0.2
+"""Weight of each new sample in the short-term average of latency."""
+
+_BASELINE_SMOOTHING = 0.02
+"""Weight of each new sample in the long-term average of latency."""
+
+_THROUGHPUT_WINDOW = 10.0
+"""Seconds of completed requests that ``throughput`` is averaged over."""
+
+
+class _Slot:
+    """A request's hold on a slot. Records when it started and how it went."""
+
+    __slots__ = ('start', 'is_throttled')
+
+    def __init__(self):
+        """Start timing a request."""
+        self.start = time.monotonic()
+        self.is_throttled = False
+
+    def throttle(self):
+        """Record that the request was throttled, such as by HTTP 429."""
+        self.is_throttled = True
+
+
+class _AsyncWaiter:
+    """Waiter for a slot in a coroutine, woken from any thread."""
+
+    __slots__ = ('_loop', 'future')
+
+    def __init__(self):
+        """Create a waiter for the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self.future = self._loop.create_future()
+
+    def set(self):
+        """Wake the coroutine that is waiting."""
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        """Complete the future, unless waiting was canceled."""
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyController:  # pylint: disable=too-many-instance-attributes
+    """
+    Thread-safe AIMD limit on requests in flight, with runtime statistics.
+
+    When not ``enabled`` (the default), slots are given out without waiting,
+    and the limit does not change, but statistics are still kept. The limit
+    stays between ``min_limit`` and ``max_limit``. Slots may be taken from
+    any number of threads and event loops at once.
+    """
+
+    def __init__(self, *, enabled=False, min_limit=1, max_limit=64):
+        """Create a controller, starting at ``min_limit``."""
+        if min_limit < 1:
+            raise ValueError(f'min_limit must be positive, got {min_limit!r}')
+        if max_limit < min_limit:
+            raise ValueError(
+                f'max_limit must be at least min_limit, got {max_limit!r}')
+
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self._completions = collections.deque()
+        self._enabled = enabled
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._limit = float(min_limit)
+        self._slow_start = True
+        self._in_flight = 0
+        self._latency = None
+        self._baseline = None
+        self._last_cut = time.monotonic()
+
+    def __repr__(self):
+        """Representation for debugging, showing statistics."""
+        with self._lock:
+            return (f'<{type(self).__name__}'
+                    f' enabled={self._enabled}'
+                    f' concurrency={int(self._limit)}'
+                    f' in_flight={self._in_flight}>')
+
+    @property
+    def enabled(self):
+        """Whether requests wait for the limit. Changing it is thread-safe."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        with self._lock:
+            self._enabled = value
+            self._wake()
+
+    @property
+    def min_limit(self):
+        """Lowest the limit is cut to."""
+        return self._min_limit
+
+    @property
+    def max_limit(self):
+        """Highest the limit is raised to."""
+        return self._max_limit
+
+    @property
+    def concurrency(self):
+        """Current limit on requests in flight (applied only when enabled)."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """Number of requests holding slots now."""
+        return self._in_flight
+
+    @property
+    def latency(self):
+        """Moving average of latency in seconds, or ``None`` if no samples."""
+        return self._latency
+
+    @property
+    def throughput(self):
+        """Requests completed per second, over the last several seconds."""
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._completions) / _THROUGHPUT_WINDOW
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Context manager to wait for and hold a slot while making a request.
+
+        It gives a slot object whose ``throttle`` method should be called if
+        the request is throttled. Exiting by an exception frees the slot
+        without affecting the limit, unless the request was throttled.
+        """
+        waiter = None
+        with self._lock:
+            if not self._take():
+                waiter = threading.Event()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            waiter.wait()
+
+        held = _Slot()
+        try:
+            yield held
+        except BaseException:
+            self._release(held if held.is_throttled else None)
+            raise
+        self._release(held)
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self):
+        """Like ``slot``, but awaits a slot, not blocking the event loop."""
+        waiter = None
+        with self._lock:
+            if not self._take():
+                waiter = _AsyncWaiter()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                        raise
+                self._release()  # A slot was handed off to us.
+                raise
+
+        held = _Slot()
+        try:
+            yield held
+        except BaseException:
+            self._release(held if held.is_throttled else None)
+            raise
+        self._release(held)
+
+    def _allowed(self):
+        """Give how many slots may be held now. Call under lock."""
+        return int(self._limit) if self._enabled else float('inf')
+
+    def _take(self):
+        """Take a slot if one is free and none are awaited. Call under lock."""
+        if self._waiters or self._in_flight >= self._allowed():
+            return False
+        self._in_flight += 1
+        return True
+
+    def _wake(self):
+        """Hand off free slots to waiters, in order. Call under lock."""
+        while self._waiters and self._in_flight < self._allowed():
+            self._in_flight += 1
+            self._waiters.popleft().set()
+
+    def _release(self, held=None):
+        """Free a slot. Adjust the limit for how a request went, if given."""
+        with self._lock:
+            self._in_flight -= 1
+            if held is not None:
+                self._record(held, time.monotonic())
+            self._wake()
+
+    def _record(self, held, now):
+        """Update statistics and the limit for a request. Call under lock."""
+        self._completions.append(now)
+        self._trim(now)
+
+        latency = now - held.start
+        if self._latency is None:
+            self._latency = self._baseline = latency
+        else:
+            self._latency += _LATENCY_SMOOTHING * (latency - self._latency)
+            self._baseline += _BASELINE_SMOOTHING * (latency - self._baseline)
+
+        if not self._enabled:
+            return
+
+        if held.is_throttled:
+            self._cut(_THROTTLE_FACTOR, held.start, now)
+        elif self._is_slow():
+            self._cut(_LATENCY_FACTOR, held.start, now)
+        else:
+            step = 1 if self._slow_start else 1 / self._limit
+            self._limit = min(self._max_limit, self._limit + step)
+
+    def _is_slow(self):
+        """Check if latency has risen too far above normal. Call under lock."""
+        return (self._latency > _LATENCY_TOLERANCE * self._baseline
+                and self._latency > self._baseline + _LATENCY_SLACK)
+
+    def _cut(self, factor, start, now):
+        """Cut the limit, unless already cut since the request started."""
+        if start >= self._last_cut:
+            self._limit = max(self._min_limit, self._limit * factor)
+            self._last_cut = now
+            self._slow_start = False
+
+    def _trim(self, now):
+        """Forget completions too old to count toward throughput."""
+        while (self._completions
+               and self._completions[0] <= now - _THROUGHPUT_WINDOW):
+            self._completions.popleft()
@@ -0,0 +1,129 @@
+"""
+A shared ``requests`` session, with a pool of connections kept alive.
+
+Making a new connection for each request costs a TCP handshake and a TLS
+handshake, which for small requests can take longer than the request itself.
+This keeps connections open and reuses them, across calls and across threads.
+"""
+
+__all__ = ['PooledSession']
+
+import datetime
+import threading
+
+import requests
+import requests.adapters
+
+
+class PooledSession:
+    """
+    Thread-safe, lazily created ``requests`` session with a connection pool.
+
+    Up to ``pool_size`` connections to each host are kept alive for reuse.
+    More requests than that may be in flight at once, but connections beyond
+    the pool size are closed after use. Changing the pool size replaces the
+    session the next time it is used. Connections of the old session are not
+    closed early, so requests in flight on other threads are not disrupted.
+    """
+
+    __slots__ = (
+        '_connect_timeout',
+        '_lock',
+        '_pool_size',
+        '_read_timeout',
+        '_session',
+    )
+
+    def __init__(self, *, pool_size, connect_timeout, read_timeout):
+        """Create a pooled session. Nothing is connected until it is used."""
+        self._lock = threading.Lock()
+        self._session = None
+        self._pool_size = _check_pool_size(pool_size)
+        self._connect_timeout = _check_timeout(connect_timeout)
+        self._read_timeout = _check_timeout(read_timeout)
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'{type(self).__name__}(pool_size={self._pool_size!r}, '
+                f'connect_timeout={self._connect_timeout!r}, '
+                f'read_timeout={self._read_timeout!r})')
+
+    @property
+    def pool_size(self):
+        """Maximum number of connections to a host that are kept alive."""
+        return self._pool_size
+
+    @pool_size.setter
+    def pool_size(self, value):
+        with self._lock:
+            self._pool_size = _check_pool_size(value)
+            self._session = None
+
+    @property
+    def connect_timeout(self):
+        """How long to wait to connect, as a ``datetime.timedelta``."""
+        return self._connect_timeout
+
+    @connect_timeout.setter
+    def connect_timeout(self, value):
+        self._connect_timeout = _check_timeout(value)
+
+    @property
+    def read_timeout(self):
+        """How long to wait between bytes of the response, as a timedelta."""
+        return self._read_timeout
+
+    @read_timeout.setter
+    def read_timeout(self, value):
+        self._read_timeout = _check_timeout(value)
+
+    def post(self, url, **kwargs):
+        """Make a POST request on a pooled connection, with the timeouts."""
+        return self._get_session().post(
+            url,
+            timeout=(self._connect_timeout.total_seconds(),
+                     self._read_timeout.total_seconds()),
+            **kwargs,
+        )
+
+    def close(self):
+        """Close the session's pooled connections. Later use reconnects."""
+        with self._lock:
+            session = self._session
+            self._session = None
+        if session is not None:
+            session.close()
+
+    def _get_session(self):
+        """Get the session, creating it if necessary."""
+        with self._lock:
+            if self._session is None:
+                self._session = _create_session(self._pool_size)
+            return self._session
+
+
+def _create_session(pool_size):
+    """Create a ``requests`` session that pools connections to each host."""
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _check_pool_size(pool_size):
+    """Check that a pool size is a positive integer, and return it."""
+    if pool_size < 1:
+        raise ValueError(f'pool_size must be positive, got {pool_size!r}')
+    return pool_size
+
+
+def _check_timeout(timeout):
+    """Check that a timeout is a positive ``timedelta``, and return it."""
+    if not isinstance(timeout, datetime.timedelta):
+        raise TypeError(
+            f'timeout must be a timedelta, got {type(timeout).__name__!r}')
+    if timeout <= datetime.timedelta(0):
+        raise ValueError(f'timeout must be positive, got {timeout!r}')
+    return timeout
@@ -0,0 +1,101 @@
+"""
+k-means clustering, for training approximate nearest-neighbor indexes.
+
+Points are assigned to centroids a block at a time, so only a block of
+distances is ever held in memory, and each centroid is recomputed as the mean
+of its points by a sparse matrix product. With ``spherical=True``, centroids
+are normalized to length 1 after each update, which suits embeddings that are
+themselves normalized: the nearest centroid is then the one with the highest
+dot product. A centroid left with no points is moved to a point far from its
+own centroid, so all of them stay in use.
+"""
+
+__all__ = ['DEFAULT_ITERATIONS', 'kmeans', 'assign']
+
+import numpy as np
+import scipy.sparse
+
+DEFAULT_ITERATIONS = 20
+"""Default most rounds of assignment and update ``kmeans`` performs."""
+
+_BLOCK_SIZE = 4096
+"""Number of points assigned to centroids at a time."""
+
+
+def kmeans(data, count, *, iterations=DEFAULT_ITERATIONS, spherical=False,
+           seed=None):
+    """
+    Find ``count`` centroids of the rows of ``data`` by Lloyd's algorithm.
+
+    Centroids start as distinct rows chosen at random, by a generator seeded
+    with ``seed``. This stops early if no point changes cluster.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if not 1 <= count <= data.shape[0]:
+        raise ValueError(
+            f'count must be from 1 to {data.shape[0]} (the number of points),'
+            f' got {count!r}')
+
+    rng = np.random.default_rng(seed)
+    chosen = np.sort(rng.choice(data.shape[0], size=count, replace=False))
+    centroids = data[chosen].copy()
+    labels = None
+
+    for _ in range(iterations):
+        new_labels, distances = assign(data, centroids)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        centroids = _update(data, labels, distances, count, spherical)
+
+    return centroids
+
+
+def assign(data, centroids):
+    """
+    Find the nearest centroid to each point, by Euclidean distance.
+
+    This returns ``(labels, distances)``: each point's centroid's index, and
+    the squared distance to it.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 is the same for all c, so
+    # it is only added to each point's distance to its nearest centroid.
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(data.shape[0], dtype=np.intp)
+    distances = np.empty(data.shape[0], dtype=np.float32)
+
+    for start in range(0, data.shape[0], _BLOCK_SIZE):
+        stop = start + _BLOCK_SIZE
+        block = data[start:stop]
+        scores = block @ centroids.T - half_norms
+        labels[start:stop] = scores.argmax(axis=1)
+        distances[start:stop] = (np.einsum('ij,ij->i', block, block)
+                                 - 2 * scores.max(axis=1))
+
+    np.maximum(distances, 0, out=distances)  # Rounding can go below 0.
+    return labels, distances
+
+
+def _update(data, labels, distances, count, spherical):
+    """Recompute centroids as means of their points, reseeding empty ones."""
+    membership = scipy.sparse.csr_matrix(
+        (np.ones(labels.shape[0], dtype=np.float32),
+         (labels, np.arange(labels.shape[0]))),
+        shape=(count, labels.shape[0]),
+    )
+    sizes = np.bincount(labels, minlength=count)
+    centroids = np.asarray(membership @ data, dtype=np.float32)
+
+    empty = np.flatnonzero(sizes == 0)
+    if empty.size:
+        # The farthest points are the worst represented by their centroids.
+        farthest = np.argsort(-distances, kind='stable')[:empty.size]
+        centroids[empty] = data[farthest]
+        sizes[empty] = 1
+
+    centroids /= sizes[:, np.newaxis]
+    if spherical:
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+    return centroids
@@ -0,0 +1,167 @@
+"""
+Advisory locks shared between processes, with many locks in one file.
+
+A ``FileLocks`` object refers to a lock file. Each lock is a single byte of
+that file, so a process can hold locks on any number of keys with just one
+open file. Locks are advisory: they only exclude other code that locks them.
+
+These locks exclude other processes, and other threads of the same process.
+A process opens each lock file once, however many ``FileLocks`` objects refer
+to it, and it takes each byte's lock at most once at a time. On POSIX systems,
+locks are held by the process, not by the file descriptor or thread, so a
+second open file, or a thread that unlocked a byte another thread had also
+locked, would release locks that are still in use.
+"""
+
+__all__ = ['FileLocks']
+
+import contextlib
+import os
+import sys
+import threading
+import time
+import weakref
+
+_POLL_INTERVAL = 0.01
+"""Seconds between attempts to take a lock, where blocking isn't supported."""
+
+_seek_lock = threading.Lock()
+"""Lock held while seeking to lock or unlock, for ``msvcrt``, on Windows."""
+
+_lock_files = weakref.WeakValueDictionary()
+"""Open lock files, by absolute path, while any ``FileLocks`` uses them."""
+
+_lock_files_lock = threading.Lock()
+"""Lock to be held while opening a lock file and adding it to the table."""
+
+
+class FileLocks:
+    """Byte-range locks in a lock file, which is created if it is absent."""
+
+    def __init__(self, path):
+        """Open (or create) the lock file at ``path``, unless already open."""
+        self._path = path
+        key = os.path.abspath(path)
+        with _lock_files_lock:
+            self._file = _lock_files.get(key)
+            if self._file is None:
+                self._file = _lock_files[key] = _LockFile(path)
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return f'{type(self).__name__}({self._path!r})'
+
+    @contextlib.contextmanager
+    def hold(self, offsets):
+        """
+        Context manager to hold the locks at the given offsets.
+
+        They are taken in increasing order, so that threads and processes
+        taking several locks at once cannot deadlock, and released when the
+        block exits.
+        """
+        held = []
+        try:
+            for offset in sorted(set(offsets)):
+                self._file.lock(offset)
+                held.append(offset)
+            yield
+        finally:
+            for offset in reversed(held):
+                self._file.unlock(offset)
+
+
+class _LockFile:
+    """An open lock file, and which of its bytes this process has locked."""
+
+    def __init__(self, path):
+        """Open (or create) the lock file at ``path``."""
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        self._held = set()
+        self._released = threading.Condition()
+
+    def __del__(self):
+        """Close the lock file, releasing any locks still held."""
+        fd = getattr(self, '_fd', None)
+        if fd is not None:
+            os.close(fd)
+
+    def lock(self, offset):
+        """Wait for and take the lock on a byte, from threads and processes."""
+        with self._released:
+            while offset in self._held:
+                self._released.wait()
+            self._held.add(offset)
+
+        try:
+            _lock_byte(self._fd, offset)
+        except BaseException:
+            self._release(offset)
+            raise
+
+    def unlock(self, offset):
+        """Release the lock on a byte."""
+        try:
+            _unlock_byte(self._fd, offset)
+        finally:
+            self._release(offset)
+
+    def forget_held(self):
+        """In a forked child, forget the locks the parent's threads held."""
+        self._held = set()
+        self._released = threading.Condition()
+
+    def _release(self, offset):
+        """Let another thread of this process take the lock on a byte."""
+        with self._released:
+            self._held.discard(offset)
+            self._released.notify_all()
+
+
+def _forget_held_after_fork():
+    """
+    Reset lock state in a forked child.
+
+    The child doesn't inherit the parent's locks, nor the threads that took
+    them, so it must not wait for them to be released.
+    """
+    # pylint: disable-next=global-statement
+    global _lock_files_lock
+    _lock_files_lock = threading.Lock()
+    for lock_file in list(_lock_files.values()):
+        lock_file.forget_held()
+
+
+if hasattr(os, 'register_at_fork'):  # Not on Windows.
+    os.register_at_fork(after_in_child=_forget_held_after_fork)
+
+if sys.platform == 'win32':
+    import msvcrt  # pylint: disable=import-error  # Windows only.
+
+    def _lock_byte(fd, offset):
+        """Wait for and take the lock on a byte of an open file."""
+        while True:
+            with _seek_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    return
+                except OSError:
+                    pass
+            time.sleep(_POLL_INTERVAL)
+
+    def _unlock_byte(fd, offset):
+        """Release the lock on a byte of an open file."""
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_byte(fd, offset):
+        """Wait for and take the lock on a byte of an open file."""
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset)
+
+    def _unlock_byte(fd, offset):
+        """Release the lock on a byte of an open file."""
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
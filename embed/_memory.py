@@ -0,0 +1,126 @@
+"""
+Bounded in-memory cache of embeddings, for use in front of the disk cache.
+
+This is a thread-safe least-recently-used cache whose budget is in bytes, since
+the sizes of cached arrays vary greatly: a single embedding is 6 KiB, but one
+result of ``embed_many`` can be many megabytes.
+"""
+
+__all__ = ['MemoryCache']
+
+import collections
+import threading
+
+
+class MemoryCache:
+    """
+    Thread-safe LRU cache of read-only NumPy arrays, bounded by total size.
+
+    Cached arrays are read-only, since they are shared by all callers that get
+    them. A ``max_bytes`` of 0 disables the cache: nothing is stored, and no
+    hits or misses are counted.
+    """
+
+    def __init__(self, max_bytes=0):
+        """Create a cache that holds up to ``max_bytes`` of array data."""
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._max_bytes = max_bytes
+        self._current_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __repr__(self):
+        """Representation for debugging, showing size and statistics."""
+        with self._lock:
+            return (f'<{type(self).__name__}'
+                    f' entries={len(self._entries)}'
+                    f' bytes={self._current_bytes}/{self._max_bytes}'
+                    f' hits={self._hits} misses={self._misses}>')
+
+    def __len__(self):
+        """Number of arrays currently cached."""
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def max_bytes(self):
+        """Budget, in bytes of array data. Lowering it evicts entries."""
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        if value < 0:
+            raise ValueError(f'max_bytes must be nonnegative, got {value!r}')
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    @property
+    def current_bytes(self):
+        """Total bytes of array data currently cached."""
+        return self._current_bytes
+
+    @property
+    def hits(self):
+        """Number of times ``get`` found an array."""
+        return self._hits
+
+    @property
+    def misses(self):
+        """Number of times ``get`` did not find an array (when enabled)."""
+        return self._misses
+
+    def get(self, key):
+        """Get the array cached under ``key``, or ``None`` if there is none."""
+        if self._max_bytes == 0:
+            return None
+
+        with self._lock:
+            try:
+                array = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return array
+
+    def put(self, key, array):
+        """
+        Cache an array under ``key``, evicting old entries to make room.
+
+        Return the array callers should use: the cached read-only array if it
+        was stored, or ``array`` itself if the cache is disabled or the array
+        is larger than the whole budget.
+        """
+        if self._max_bytes == 0 or array.nbytes > self._max_bytes:
+            return array
+
+        if array.flags.writeable:
+            array = array.copy()  # So the caller's array can't alter ours.
+            array.flags.writeable = False
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._current_bytes -= old.nbytes
+            self._entries[key] = array
+            self._current_bytes += array.nbytes
+            self._evict()
+
+        return array
+
+    def clear(self):
+        """Remove all cached arrays and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self._hits = 0
+            self._misses = 0
+
+    def _evict(self):
+        """Evict least recently used entries until within budget. Hold lock."""
+        while self._current_bytes > self._max_bytes:
+            _, array = self._entries.popitem(last=False)
+            self._current_bytes -= array.nbytes
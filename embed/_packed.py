@@ -0,0 +1,271 @@
+"""
+Packed append-only embedding store.
+
+A store is a directory holding a few large segment files of contiguous
+little-endian float32 rows, and one index file mapping each cache key (the raw
+bytes of a blake3 digest) to where its rows are. New embeddings are appended to
+the newest segment, and a fixed-size record is then appended to the index. The
+index record is written last, so an entry is never visible before its rows are.
+Appends hold a lock on a lock file in the directory, so processes sharing a
+store take turns appending.
+
+In memory, the index is kept as a sorted NumPy structured array, searched with
+``np.searchsorted``, plus a small dict of entries appended since it was last
+sorted. Each process using a store holds the whole index this way, at 56 bytes
+per entry: 10 million entries take about 560 MB in each process. Merging
+recent entries into the sorted array briefly takes about three times that, for
+the concatenated and reordered copies. The index file is only reread when it
+has grown. Reads slice a memory-mapped segment, which is mapped once and then
+reused until it has grown past the mapped length.
+"""
+
+__all__ = ['PackedStore']
+
+import os
+import threading
+
+import numpy as np
+
+from embed._locking import FileLocks
+
+_INDEX_NAME = 'index.bin'
+"""Filename of the index, within the store directory."""
+
+_LOCK_NAME = 'append.lock'
+"""Filename of the lock file held while appending, in the store directory."""
+
+_SEGMENT_FORMAT = 'segment-{:05d}.f32'
+"""Format for filenames of segments, within the store directory."""
+
+_SEGMENT_ROWS = 1 << 17
+"""Rows after which to start a new segment (805 MB for 1536-wide rows)."""
+
+_MERGE_THRESHOLD = 1 << 16
+"""Number of unsorted recent entries that triggers a merge into the index."""
+
+_RECORD = np.dtype([
+    ('key', 'S32'),
+    ('segment', '<u4'),
+    ('count', '<u4'),
+    ('row', '<u8'),
+    ('ndim', 'u1'),
+    ('padding', 'V7'),
+])
+"""Layout of each entry in the index file (56 bytes)."""
+
+
+class PackedStore:  # pylint: disable=too-many-instance-attributes
+    """
+    Embeddings appended to a few large segment files, with a compact index.
+
+    This is safe to use from multiple threads and processes. Entries other
+    processes append are seen when the index is reread, which happens on a
+    miss.
+    """
+
+    def __init__(self, directory, dimension):
+        """Create a store in ``directory`` for ``dimension``-wide rows."""
+        self._directory = directory
+        self._dimension = dimension
+        self._lock = threading.Lock()
+        self._sorted = np.empty(0, dtype=_RECORD)
+        self._recent = {}
+        self._index_offset = 0
+        self._index_size = 0
+        self._maps = {}
+
+        directory.mkdir(parents=True, exist_ok=True)
+        self._append_lock = FileLocks(directory / _LOCK_NAME)
+        with self._append_lock.hold([0]):
+            self._drop_torn_record()
+
+    @property
+    def directory(self):
+        """Directory that holds the segments and index."""
+        return self._directory
+
+    def close(self):
+        """Release memory maps. The store reopens them if used again."""
+        with self._lock:
+            self._maps.clear()
+
+    def get(self, key, *, copy=True):
+        """
+        Get the embeddings stored under ``key``, or ``None`` if absent.
+
+        If ``copy`` is false, a read-only view of the memory-mapped segment is
+        returned instead of a copy.
+        """
+        key = _normalize(key)
+        with self._lock:
+            record = self._find(key)
+            if record is None:
+                self._read_index()
+                record = self._find(key)
+            if record is None:
+                return None
+            return self._read_rows(record, copy)
+
+    def put(self, key, embeddings):
+        """Append embeddings (a vector or matrix) to store under ``key``."""
+        embeddings = np.asarray(embeddings, dtype='<f4')
+        matrix = embeddings.reshape(-1, self._dimension)
+
+        with self._lock, self._append_lock.hold([0]):
+            self._drop_torn_record()
+            segment, row = self._append_rows(matrix)
+
+            record = np.zeros(1, dtype=_RECORD)
+            record['key'] = _normalize(key)
+            record['segment'] = segment
+            record['count'] = len(matrix)
+            record['row'] = row
+            record['ndim'] = embeddings.ndim
+
+            with open(self._index_path, mode='ab') as file:
+                file.write(record.tobytes())
+
+            self._read_index()
+
+    @property
+    def _row_bytes(self):
+        """Size of each row in a segment file."""
+        return self._dimension * np.dtype('<f4').itemsize
+
+    @property
+    def _index_path(self):
+        """Path of the index file."""
+        return self._directory / _INDEX_NAME
+
+    def _segment_path(self, segment):
+        """Path of a segment file."""
+        return self._directory / _SEGMENT_FORMAT.format(segment)
+
+    def _find(self, key):
+        """Look up the index record for ``key``. Caller must hold the lock."""
+        try:
+            return self._recent[key]
+        except KeyError:
+            pass
+
+        position = np.searchsorted(self._sorted['key'], key)
+        if (position < len(self._sorted)
+                and self._sorted['key'][position] == key):
+            return self._sorted[position]
+
+        return None
+
+    def _read_index(self):
+        """Read index records appended since the last read. Hold the lock."""
+        try:
+            if self._index_path.stat().st_size == self._index_size:
+                return  # Nothing was appended.
+            with open(self._index_path, mode='rb') as file:
+                file.seek(self._index_offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        self._index_size = self._index_offset + len(data)
+        usable = len(data) - len(data) % _RECORD.itemsize  # Skip torn writes.
+        records = np.frombuffer(data[:usable], dtype=_RECORD)
+        self._index_offset += usable
+
+        if len(self._recent) + len(records) < _MERGE_THRESHOLD:
+            for record in records:
+                self._recent[record['key']] = record
+        else:
+            self._merge(records)
+
+    def _merge(self, records):
+        """Merge recent and new entries into the sorted index. Hold lock."""
+        recent = np.array(list(self._recent.values()), dtype=_RECORD)
+        merged = np.concatenate([self._sorted, recent, records])
+        # Stable sort, then keep the last of any duplicates.
+        merged = merged[np.argsort(merged['key'], kind='stable')]
+        keep = np.ones(len(merged), dtype=bool)
+        keep[:-1] = merged['key'][1:] != merged['key'][:-1]
+        self._sorted = merged[keep]
+        self._recent.clear()
+
+    def _read_rows(self, record, copy):
+        """Read the rows an index record refers to. Caller must hold lock."""
+        segment = int(record['segment'])
+        row = int(record['row'])
+        count = int(record['count'])
+        if count == 0:
+            return np.empty((0, self._dimension), dtype=np.float32)
+
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < row + count:
+            mapped = self._map_segment(segment)
+
+        rows = mapped[row:row + count]
+        rows = np.array(rows) if copy else np.asarray(rows)
+        return rows[0] if record['ndim'] == 1 else rows
+
+    def _map_segment(self, segment):
+        """Memory-map a whole segment, replacing any older, shorter map."""
+        path = self._segment_path(segment)
+        rows = path.stat().st_size // self._row_bytes
+        mapped = np.memmap(path, dtype='<f4', mode='r',
+                           shape=(rows, self._dimension))
+        self._maps[segment] = mapped
+        return mapped
+
+    def _drop_torn_record(self):
+        """
+        Truncate the index to whole records. Hold the append lock.
+
+        An interrupted append can leave part of a record at the end. Records
+        appended after it would then be misaligned, and unreadable.
+        """
+        try:
+            size = self._index_path.stat().st_size
+        except FileNotFoundError:
+            return
+
+        torn = size % _RECORD.itemsize
+        if torn:
+            os.truncate(self._index_path, size - torn)
+
+    def _append_rows(self, matrix):
+        """Append rows to the newest segment. Return segment and start row."""
+        segment = self._newest_segment()
+        path = self._segment_path(segment)
+
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+
+        row, torn = divmod(size, self._row_bytes)
+        if torn:  # Drop a partial row left by an interrupted append.
+            os.truncate(path, row * self._row_bytes)
+
+        if row != 0 and row + len(matrix) > _SEGMENT_ROWS:
+            segment += 1
+            path = self._segment_path(segment)
+            row = 0
+
+        with open(path, mode='ab') as file:
+            file.write(matrix.tobytes())
+
+        return segment, row
+
+    def _newest_segment(self):
+        """Find the number of the newest segment, or 0 if there are none."""
+        segment = 0
+        while self._segment_path(segment + 1).exists():
+            segment += 1
+        return segment
+
+
+def _normalize(key):
+    """
+    Strip trailing null bytes from a key, as NumPy does for ``S32`` elements.
+
+    Without this, a digest that happens to end in a zero byte would compare
+    unequal to the same key after it has round-tripped through the index.
+    """
+    return bytes(key).rstrip(b'\0')
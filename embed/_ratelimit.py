@@ -0,0 +1,205 @@
+"""
+Client-side pacing of requests, to stay under the API's rate limits.
+
+The API limits both requests per minute and tokens per minute. Reacting to
+HTTP 429 errors with exponential backoff alone lets clients burst, get
+throttled, and then wait longer than needed. A ``RateLimiter`` instead paces
+requests, with a token bucket for each limit, so they are sent about as fast
+as the limits allow but no faster.
+
+Each bucket holds up to a minute's worth of capacity and refills continuously.
+A request takes what it needs right away, even if that leaves a bucket in
+debt, and then waits until the debt would be repaid. So waiting requests are
+served in the order they arrive, and none of them polls.
+
+The API reports its view of the limits in ``x-ratelimit-*`` response headers.
+``calibrate`` uses them to lower the limits and current levels, which keeps
+the buckets accurate when other processes or machines share the same API key.
+"""
+
+__all__ = ['RateLimiter', 'request_tokens']
+
+import asyncio
+import threading
+import time
+
+from . import _batching
+
+_SECONDS_PER_MINUTE = 60
+"""Seconds over which the API's limits are given, and buckets refill."""
+
+
+def request_tokens(text_or_texts):
+    """Estimate, conservatively, how many tokens a request will count as."""
+    if isinstance(text_or_texts, str):
+        return _batching.estimate_tokens(text_or_texts)
+    return sum(map(_batching.estimate_tokens, text_or_texts))
+
+
+class _Bucket:
+    """Token bucket for one rate limit. Not thread-safe on its own."""
+
+    def __init__(self, name):
+        """Create a bucket with no limit, for the headers named by ``name``."""
+        self.name = name
+        self.configured = None
+        self.reported = None
+        self.level = 0.0
+        self.updated = time.monotonic()
+
+    @property
+    def limit(self):
+        """Limit in effect: the lower of the configured and reported limits."""
+        if self.configured is None:
+            return None
+        if self.reported is None:
+            return self.configured
+        return min(self.configured, self.reported)
+
+    def refill(self, now):
+        """Add the capacity that has accrued since the last update."""
+        limit = self.limit
+        if limit is not None:
+            accrued = (now - self.updated) * limit / _SECONDS_PER_MINUTE
+            self.level = min(limit, self.level + accrued)
+        self.updated = now
+
+    def configure(self, limit):
+        """Set the configured limit, starting full if there was none."""
+        was_limited = self.configured is not None
+        self.configured = limit
+        if limit is None:
+            self.level = 0.0
+        elif was_limited:
+            self.level = min(self.level, self.limit)
+        else:
+            self.level = self.limit
+
+    def take(self, amount):
+        """Take capacity. Return how many seconds to wait before using it."""
+        limit = self.limit
+        if limit is None:
+            return 0.0
+        self.level -= min(amount, limit)
+        return max(0.0, -self.level * _SECONDS_PER_MINUTE / limit)
+
+    def give(self, amount):
+        """Return capacity that was taken but turned out not to be used."""
+        limit = self.limit
+        if limit is not None:
+            self.level = min(limit, self.level + amount)
+
+    def calibrate(self, headers):
+        """Lower the limit and level to what the API reported, if it did."""
+        reported = _get_int(headers, f'x-ratelimit-limit-{self.name}')
+        if reported is not None:
+            self.reported = reported
+        remaining = _get_int(headers, f'x-ratelimit-remaining-{self.name}')
+        if remaining is not None and self.limit is not None:
+            self.level = min(self.level, self.limit, remaining)
+
+
+def _get_int(headers, name):
+    """Get an integer header's value, or ``None`` if it's absent or invalid."""
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Thread-safe pacer of requests, under requests and tokens per minute limits.
+
+    A limit of ``None`` (the default for both) means requests are not paced
+    for it. One ``RateLimiter`` may be used from any number of threads and
+    event loops at once, and they share its capacity.
+    """
+
+    def __init__(self, *, requests_per_minute=None, tokens_per_minute=None):
+        """Create a rate limiter with the given limits."""
+        self._lock = threading.Lock()
+        self._requests = _Bucket('requests')
+        self._tokens = _Bucket('tokens')
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def __repr__(self):
+        """Representation for debugging, showing limits in effect."""
+        with self._lock:
+            return (f'<{type(self).__name__}'
+                    f' requests_per_minute={self._requests.limit}'
+                    f' tokens_per_minute={self._tokens.limit}>')
+
+    @property
+    def requests_per_minute(self):
+        """Configured limit on requests per minute, or ``None``."""
+        return self._requests.configured
+
+    @requests_per_minute.setter
+    def requests_per_minute(self, value):
+        self._configure(self._requests, 'requests_per_minute', value)
+
+    @property
+    def tokens_per_minute(self):
+        """Configured limit on tokens per minute, or ``None``."""
+        return self._tokens.configured
+
+    @tokens_per_minute.setter
+    def tokens_per_minute(self, value):
+        self._configure(self._tokens, 'tokens_per_minute', value)
+
+    def acquire(self, tokens):
+        """Wait until a request of ``tokens`` tokens may be sent."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens):
+        """Like ``acquire``, but awaits, not blocking the event loop."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated, actual):
+        """
+        Correct for a request having used ``actual`` tokens, not ``estimated``.
+
+        Estimates are conservative, so this usually gives capacity back.
+        """
+        with self._lock:
+            self._tokens.refill(time.monotonic())
+            self._tokens.give(estimated - actual)
+
+    def calibrate(self, headers):
+        """
+        Update from a response's ``x-ratelimit-*`` headers, where present.
+
+        A reported limit below the configured one is used instead of it, and
+        a reported remaining capacity below the bucket's level lowers it.
+        A limit that is not configured still does no pacing.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._requests, self._tokens:
+                bucket.refill(now)
+                bucket.calibrate(headers)
+
+    def _configure(self, bucket, name, value):
+        """Validate and set a configured limit."""
+        if value is not None and value <= 0:
+            raise ValueError(f'{name} must be positive, got {value!r}')
+        with self._lock:
+            bucket.refill(time.monotonic())
+            bucket.configure(value)
+
+    def _reserve(self, tokens):
+        """Take capacity for one request. Give the seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            return max(self._requests.take(1), self._tokens.take(tokens))
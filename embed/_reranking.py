@@ -0,0 +1,82 @@
+"""
+Search, with optional exact reranking, shared by indexes of compressed rows.
+
+``embed.binary.BinaryIndex`` and ``embed.pq.PQIndex`` store codes that only
+approximate the rows of a corpus, and score queries against them roughly.
+Both search the same way, by subclassing ``RerankingIndex``: they find
+candidates by their rough scores, then may rescore them exactly against the
+float32 rows the index was built from. Each implements only ``_scan``.
+"""
+
+__all__ = ['DEFAULT_BLOCK_SIZE', 'RerankingIndex']
+
+from abc import ABC, abstractmethod
+
+from embed import _topk, search
+
+DEFAULT_BLOCK_SIZE = 65536
+"""Default number of stored vectors scored at a time."""
+
+
+class RerankingIndex(ABC):
+    """
+    Base class for indexes of codes, searched by rough scores of the codes.
+
+    Subclasses implement ``__len__``, ``dimension``, and ``_scan``.
+    """
+
+    @abstractmethod
+    def __len__(self):
+        """Number of rows in the index."""
+
+    @property
+    @abstractmethod
+    def dimension(self):
+        """Number of components in each row."""
+
+    def search(self, queries, k, *, rerank=0, corpus=None,
+               block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Find approximately the ``k`` rows with the highest dot products with
+        each query.
+
+        This takes and returns the same forms as ``embed.search.topk``. If
+        ``rerank`` is positive, that many candidates (or ``k``, if more) are
+        found by rough score, then rescored exactly against ``corpus``, the
+        matrix of embeddings the index was built from, and returned scores
+        are exact. Otherwise, returned scores are the rough ones.
+        """
+        queries, single = _topk.as_queries(queries, self.dimension, k)
+        if rerank and corpus is None:
+            raise ValueError('reranking requires the corpus')
+        if block_size < 1:
+            raise ValueError(
+                f'block_size must be positive, got {block_size!r}')
+
+        indices, scores = self._scan(queries, max(k, rerank), block_size)
+        if rerank:
+            indices, scores = _topk.rescore(corpus, queries, indices, k)
+
+        if single:
+            return indices[0], scores[0]
+        return indices, scores
+
+    def recall(self, queries, k, *, corpus, rerank=0):
+        """
+        Measure the recall of ``search`` for queries, against exact search.
+
+        This is the mean fraction of each query's exact ``k`` nearest rows,
+        in ``corpus``, that ``search`` finds, as given by
+        ``embed.search.recall``.
+        """
+        found, _ = self.search(queries, k, rerank=rerank, corpus=corpus)
+        exact, _ = search.topk(corpus, queries, k)
+        return search.recall(found, exact)
+
+    @abstractmethod
+    def _scan(self, queries, k, block_size):
+        """
+        Find top-``k`` rows by rough score, in order, for a matrix of queries.
+
+        Stored vectors are scored ``block_size`` at a time.
+        """
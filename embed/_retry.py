@@ -0,0 +1,176 @@
+"""
+Retry policy shared by all the functions that make requests for embeddings.
+
+Requests are retried when they are throttled (HTTP 429), when the server
+fails (HTTP 5xx), and when the connection fails or times out. How long to
+wait before each retry is chosen by ``wait_gen``, a ``backoff`` wait
+generator that is sent each failed response or exception:
+
+- If the server said how long to wait, in a ``Retry-After`` or
+  ``retry-after-ms`` header, or in the ``x-ratelimit-reset-*`` header of an
+  exhausted limit, it waits that long, plus a little jitter. It never retries
+  sooner than it was told to: if that wait would end past the time limit, it
+  gives up instead.
+
+- Otherwise it waits with "decorrelated jitter": each wait is drawn uniformly
+  between the base wait and three times the previous wait, up to a cap. This
+  keeps many clients that failed together from retrying together, as they
+  would with plain exponential backoff.
+
+Jitter is applied here, so decorators must not apply more of it. Retrying is
+limited both by number of tries and by total time.
+"""
+
+__all__ = [
+    'OPENAI_ERRORS',
+    'is_retryable_status',
+    'gives_up_openai',
+    'retry_after',
+    'wait_gen',
+    'on_exception',
+]
+
+import datetime
+import email.utils
+import http
+import random
+import re
+import time
+
+import backoff
+import openai
+
+_BASE_WAIT = 0.5
+"""Shortest wait, in seconds, and most jitter added to a server's wait."""
+
+_MAX_WAIT = 60.0
+"""Longest wait, in seconds, when the server didn't say how long to wait."""
+
+_MAX_TRIES = 10
+"""Most attempts to make of a request, including the first."""
+
+_MAX_TIME = 600.0
+"""Most seconds to spend on a request, after which it is not retried."""
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+"""Regex for a part of a duration like ``6m0s`` or ``20ms``."""
+
+_SECONDS_PER_UNIT = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+"""Conversions of duration units to seconds."""
+
+
+OPENAI_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+"""Errors from the OpenAI library that may pass if the request is retried."""
+
+
+def is_retryable_status(status):
+    """Check if a request that got an HTTP status should be retried."""
+    return (status == http.HTTPStatus.TOO_MANY_REQUESTS
+            or status >= http.HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+def gives_up_openai(error):
+    """Check if an error in ``OPENAI_ERRORS`` should not be retried."""
+    return (isinstance(error, openai.error.APIError)
+            and error.http_status is not None
+            and not is_retryable_status(error.http_status))
+
+
+def retry_after(headers):
+    """
+    Find how many seconds response headers say to wait, or ``None``.
+
+    This checks ``retry-after-ms`` and ``Retry-After`` (in seconds or as a
+    date). Failing that, it checks ``x-ratelimit-reset-requests`` and
+    ``x-ratelimit-reset-tokens`` for limits that have no capacity remaining.
+    """
+    headers = {name.lower(): value for name, value in headers.items()}
+
+    try:
+        return max(0.0, float(headers['retry-after-ms']) / 1000)
+    except (KeyError, ValueError):
+        pass
+
+    value = headers.get('retry-after')
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            return max(0.0, (date - now).total_seconds())
+
+    resets = [_parse_duration(headers.get(f'x-ratelimit-reset-{name}'))
+              for name in ('requests', 'tokens')
+              if headers.get(f'x-ratelimit-remaining-{name}') == '0']
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets, default=None)
+
+
+def _parse_duration(text):
+    """Parse a duration like ``1m30s`` to seconds. Give ``None`` if invalid."""
+    if not text or _DURATION_PART.sub('', text):
+        return None
+    return sum(float(number) * _SECONDS_PER_UNIT[unit]
+               for number, unit in _DURATION_PART.findall(text))
+
+
+def wait_gen(*, time_limit=None):
+    """
+    Generate waits for ``backoff``, given failed responses or exceptions.
+
+    Headers are looked for in the ``headers`` attribute of what is sent, or
+    of its ``response`` attribute, as for a ``requests.HTTPError``. If the
+    server says to wait past ``time_limit`` seconds from when the generator
+    was made, the generator stops, so ``backoff`` gives up, rather than
+    cutting the wait short.
+    """
+    start = time.monotonic()
+    response_or_error = yield
+    previous = _BASE_WAIT
+
+    while True:
+        headers = _headers(response_or_error)
+        seconds = retry_after(headers)
+        if seconds is not None:
+            seconds += random.uniform(0, _BASE_WAIT)
+            if (time_limit is not None
+                    and time.monotonic() - start + seconds > time_limit):
+                return
+        else:
+            previous = min(_MAX_WAIT, random.uniform(_BASE_WAIT, previous * 3))
+            seconds = previous
+        response_or_error = yield seconds
+
+
+def _headers(response_or_error):
+    """Get the headers of a response, or of the response an error is from."""
+    headers = getattr(response_or_error, 'headers', None)
+    if headers is None:
+        response = getattr(response_or_error, 'response', None)
+        headers = getattr(response, 'headers', None)
+    return headers or {}
+
+
+def on_exception(exceptions, *, giveup=lambda _: False):
+    """Decorator to retry on ``exceptions``, except when ``giveup`` is true."""
+    return backoff.on_exception(
+        wait_gen, exceptions,
+        giveup=giveup,
+        max_tries=lambda: _MAX_TRIES,
+        max_time=lambda: _MAX_TIME,
+        jitter=None,
+        time_limit=lambda: _MAX_TIME,
+    )
@@ -0,0 +1,110 @@
+"""
+In-process coordination so concurrent calls for the same key run only once.
+
+When several threads need the same value at the same time, and none has it,
+the first to claim the key computes it (it leads). The others wait and get the
+leader's result, or its exception, rather than repeating the work.
+"""
+
+__all__ = ['SingleFlight']
+
+import threading
+
+
+class _Flight:
+    """A computation in progress, that other callers may wait on."""
+
+    __slots__ = ('_done', '_error', '_key', '_result', '_table')
+
+    def __init__(self, table, key):
+        """Create a record of a computation for a key in a ``SingleFlight``."""
+        self._table = table
+        self._key = key
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def succeed(self, result):
+        """
+        Give the computed value to all waiters. Only for the leader.
+
+        This does nothing if the flight has already finished.
+        """
+        if self._done.is_set():
+            return
+        self._result = result
+        self._finish()
+
+    def fail(self, error):
+        """
+        Give an exception to all waiters. Only for the leader.
+
+        This does nothing if the flight has already finished, so a leader can
+        fail all its flights when some of them have already succeeded.
+        """
+        if self._done.is_set():
+            return
+        self._error = error
+        self._finish()
+
+    def wait(self):
+        """Wait for the leader, and return its value or raise its exception."""
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _finish(self):
+        """Remove this flight from its table and wake waiters."""
+        self._table._remove(self._key)  # pylint: disable=protected-access
+        self._done.set()
+
+
+class SingleFlight:
+    """Table of computations in progress, by key, that callers can join."""
+
+    __slots__ = ('_flights', '_lock')
+
+    def __init__(self):
+        """Create a table with no computations in progress."""
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of keys currently being computed."""
+        with self._lock:
+            return len(self._flights)
+
+    def claim(self, key):
+        """
+        Join the computation for a key, or start one if there is none.
+
+        This returns a flight and whether the caller leads it. A leader must
+        compute the value and call ``succeed`` or ``fail`` on the flight. Other
+        callers can ``wait`` on it. A caller that leads some flights and waits
+        on others should finish those it leads first, so no callers deadlock.
+        """
+        with self._lock:
+            try:
+                return self._flights[key], False
+            except KeyError:
+                flight = self._flights[key] = _Flight(self, key)
+                return flight, True
+
+    def run(self, key, func):
+        """Call ``func`` unless another thread is, and give its result."""
+        flight, leader = self.claim(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = func()
+        except BaseException as error:
+            flight.fail(error)
+            raise
+        flight.succeed(result)
+        return result
+
+    def _remove(self, key):
+        """Remove a finished flight, so later claims start a new one."""
+        with self._lock:
+            del self._flights[key]
@@ -0,0 +1,71 @@
+"""
+Saving and loading named arrays, with metadata, as safetensors files.
+
+Indexes are saved this way, so they can be loaded without unpickling, and so
+their large arrays can be memory-mapped rather than read into memory. Loading
+reads the small JSON header, then each array's range of the file.
+"""
+
+__all__ = ['save', 'load']
+
+import struct
+
+import numpy as np
+import orjson
+import safetensors.numpy
+
+_DTYPES = {
+    'F64': '<f8',
+    'F32': '<f4',
+    'F16': '<f2',
+    'I64': '<i8',
+    'I32': '<i4',
+    'I16': '<i2',
+    'I8': 'i1',
+    'U64': '<u8',
+    'U32': '<u4',
+    'U16': '<u2',
+    'U8': 'u1',
+}
+"""NumPy dtypes for safetensors dtype names."""
+
+
+def save(path, arrays, metadata):
+    """Save a dict of arrays and a dict of string metadata to ``path``."""
+    arrays = {name: np.ascontiguousarray(array)
+              for name, array in arrays.items()}
+    safetensors.numpy.save_file(arrays, path, metadata=metadata)
+
+
+def load(path, *, mmap=False):
+    """
+    Load ``(arrays, metadata)`` from ``path``.
+
+    If ``mmap`` is true, the arrays are read-only views of the file's pages,
+    which are read as they are used, and shared among processes.
+    """
+    with open(path, mode='rb') as file:
+        (header_size,) = struct.unpack('<Q', file.read(8))
+        header = orjson.loads(file.read(header_size))
+        metadata = header.pop('__metadata__', None) or {}
+        arrays = {name: _load_array(file, path, 8 + header_size, info, mmap)
+                  for name, info in header.items()}
+    return arrays, metadata
+
+
+def _load_array(file, path, base, info, mmap):
+    """Load one array, described by its header entry, from an open file."""
+    begin, end = info['data_offsets']
+    shape = tuple(info['shape'])
+    dtype = np.dtype(_DTYPES[info['dtype']])
+
+    if begin == end:  # Empty ranges can't be mapped.
+        return np.empty(shape, dtype=dtype)
+    if mmap:
+        return np.asarray(np.memmap(path, dtype=dtype, mode='r',
+                                    offset=base + begin, shape=shape))
+
+    file.seek(base + begin)
+    array = np.empty(shape, dtype=dtype)
+    file.readinto(memoryview(array).cast('B'))
+    return array
@@ -0,0 +1,107 @@
+"""
+Partial selection of the highest scores, for nearest-neighbor searches.
+
+Searches score candidates a group at a time and keep, for each query, the
+best ``k`` seen so far. These helpers do that with ``np.argpartition``, which
+takes linear time, leaving only the final ``k`` per query to be sorted.
+
+Rows of scores are per query. Where a query has fewer than ``k`` candidates,
+its row is padded with the index ``-1`` and the score ``-inf``.
+"""
+
+__all__ = [
+    'MISSING',
+    'as_queries',
+    'empty',
+    'select',
+    'merge',
+    'merge_block',
+    'finish',
+    'rescore',
+]
+
+import numpy as np
+
+MISSING = -1
+"""Index that pads results for queries with fewer than ``k`` candidates."""
+
+
+def as_queries(queries, dimension, k):
+    """
+    Check and convert queries, given as a vector or matrix, to a matrix.
+
+    This returns the matrix, of float32, and whether there was just one query.
+    It checks that the queries have ``dimension`` components and ``k >= 1``.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if queries.ndim not in (1, 2) or queries.shape[-1] != dimension:
+        raise ValueError(f'queries of shape {queries.shape} do not match'
+                         f' dimension {dimension}')
+    if k < 1:
+        raise ValueError(f'k must be positive, got {k!r}')
+    return np.atleast_2d(queries), queries.ndim == 1
+
+
+def empty(count, k):
+    """Make results for ``count`` queries with no candidates yet."""
+    return (np.full((count, k), MISSING, dtype=np.intp),
+            np.full((count, k), -np.inf, dtype=np.float32))
+
+
+def select(scores, k):
+    """Give the column indices of the ``k`` highest scores in each row."""
+    if scores.shape[1] <= k:
+        return np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    return np.argpartition(scores, -k, axis=1)[:, -k:]
+
+
+def merge(best, candidates, k):
+    """
+    Merge scored candidates into the best ``k`` per query so far.
+
+    ``best`` and ``candidates`` are each a pair of matrices ``(indices,
+    scores)``, with a row per query. This gives the merged pair, unsorted.
+    """
+    indices = np.concatenate((best[0], candidates[0]), axis=1)
+    scores = np.concatenate((best[1], candidates[1]), axis=1)
+    keep = select(scores, k)
+    return (np.take_along_axis(indices, keep, axis=1),
+            np.take_along_axis(scores, keep, axis=1))
+
+
+def merge_block(best, scores, start, k):
+    """
+    Merge a block of scores into the best ``k`` per query so far.
+
+    ``scores`` has a row per query and a column per row of the block, which
+    starts at row ``start``. This gives the merged pair, unsorted.
+    """
+    columns = select(scores, k)
+    candidates = (columns + start,
+                  np.take_along_axis(scores, columns, axis=1))
+    return merge(best, candidates, k)
+
+
+def finish(best):
+    """Sort the best candidates per query by score, from highest to lowest."""
+    indices, scores = best
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return (np.take_along_axis(indices, order, axis=1),
+            np.take_along_axis(scores, order, axis=1))
+
+
+def rescore(corpus, queries, candidates, k):
+    """
+    Rescore candidate rows exactly and give the top ``k`` per query, in order.
+
+    ``candidates`` has a row of indices into ``corpus`` per query, as found by
+    an approximate search. Only those rows of ``corpus`` are read.
+    """
+    rows = np.unique(candidates)  # Sorted, for locality in a memory map.
+    vectors = np.asarray(corpus[rows], dtype=np.float32)
+    positions = np.searchsorted(rows, candidates)
+    scores = np.stack([vectors[row_positions] @ query
+                       for query, row_positions in zip(queries, positions)])
+    columns = select(scores, min(k, candidates.shape[1]))
+    return finish((np.take_along_axis(candidates, columns, axis=1),
+                   np.take_along_axis(scores, columns, axis=1)))
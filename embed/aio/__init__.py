@@ -0,0 +1,263 @@
+"""
+Asynchronous versions of the embed functions, for use with ``asyncio``.
+
+These are coroutine functions that do not block the event loop: the
+``requests``-based functions' counterparts use ``aiohttp``, the others use the
+OpenAI library's asynchronous API, and waits before retrying are awaited.
+So a single event loop can have many embedding requests in flight.
+
+By default, each call makes its own HTTP connections. To share a pool of
+connections kept alive across calls, do them inside ``async with session():``.
+"""
+
+__all__ = [
+    'cached',
+    'DEFAULT_MAX_CONCURRENCY',
+    'session',
+    'embed_one',
+    'embed_many',
+    'embed_one_eu',
+    'embed_many_eu',
+    'embed_one_req',
+    'embed_many_req',
+]
+
+import contextlib
+import contextvars
+import functools
+import http
+
+import aiohttp
+import numpy as np
+import openai
+import openai.embeddings_utils
+
+import embed
+
+from . import cached
+from .. import _batching, _keys, _ratelimit, _retry
+
+# pylint: disable=protected-access  # This shares embed's internals.
+
+DEFAULT_MAX_CONCURRENCY = 1
+"""
+Default maximum number of requests an ``embed_many*`` call awaits at once.
+
+When a call's texts are split into multiple requests, up to this many are in
+flight at the same time. The default of 1 sends them one after another.
+"""
+
+_session = contextvars.ContextVar('_session', default=None)
+"""Shared ``aiohttp`` session, when in a ``session()`` context."""
+
+
+@contextlib.asynccontextmanager
+async def session(*, limit=100):
+    """
+    Async context manager to share an HTTP session across calls inside it.
+
+    Up to ``limit`` connections are kept open and reused. This applies to
+    all the functions in this module, including those that use ``openai``.
+    """
+    connector = aiohttp.TCPConnector(limit=limit)
+    async with aiohttp.ClientSession(connector=connector) as client_session:
+        session_token = _session.set(client_session)
+        openai_token = openai.aiosession.set(client_session)
+        try:
+            yield client_session
+        finally:
+            openai.aiosession.reset(openai_token)
+            _session.reset(session_token)
+
+
+@contextlib.asynccontextmanager
+async def _get_session():
+    """Async context manager for the shared session, or a temporary one."""
+    client_session = _session.get()
+    if client_session is not None:
+        yield client_session
+    else:
+        async with aiohttp.ClientSession() as client_session:
+            yield client_session
+
+
+async def _embed_batched(embed_batch, texts,
+                         max_batch_size, max_batch_tokens, max_concurrency):
+    """
+    Embed texts, awaiting ``embed_batch`` on as many batches as needed.
+
+    This is like ``embed._embed_batched``, but for coroutine functions. The
+    batch limits default to ``embed.DEFAULT_MAX_BATCH_SIZE`` and
+    ``embed.DEFAULT_MAX_BATCH_TOKENS``.
+    """
+    if max_batch_size is None:
+        max_batch_size = embed.DEFAULT_MAX_BATCH_SIZE
+    if max_batch_tokens is None:
+        max_batch_tokens = embed.DEFAULT_MAX_BATCH_TOKENS
+    if max_concurrency is None:
+        max_concurrency = DEFAULT_MAX_CONCURRENCY
+
+    return await _batching.embed_batched_async(
+        embed_batch, texts,
+        max_size=max_batch_size,
+        max_tokens=max_batch_tokens,
+        max_concurrency=max_concurrency,
+        dimension=embed.DIMENSION,
+        stats=embed.dedup_stats,
+    )
+
+
+@_retry.on_exception(_retry.OPENAI_ERRORS, giveup=_retry.gives_up_openai)
+async def _create_embedding(text_or_texts):
+    """Use the OpenAI library to get one or more embeddings, with retries."""
+    tokens = _ratelimit.request_tokens(text_or_texts)
+    await embed.rate_limiter.acquire_async(tokens)
+    async with embed.concurrency_controller.slot_async() as slot:
+        try:
+            openai_response = await openai.Embedding.acreate(
+                input=text_or_texts,
+                model='text-embedding-ada-002',
+            )
+        except openai.error.RateLimitError:
+            slot.throttle()
+            raise
+    embed.rate_limiter.settle(tokens, openai_response.usage.total_tokens)
+    return openai_response
+
+
+async def embed_one(text):
+    """Embed a single piece of text."""
+    openai_response = await _create_embedding(text)
+    return np.array(openai_response.data[0].embedding, dtype=np.float32)
+
+
+async def _embed_many_batch(texts):
+    """Embed multiple pieces of text in a single request."""
+    openai_response = await _create_embedding(texts)
+    embeddings = [datum.embedding for datum in openai_response.data]
+    return np.array(embeddings, dtype=np.float32)
+
+
+async def embed_many(texts, *, max_batch_size=None, max_batch_tokens=None,
+                     max_concurrency=None):
+    """Embed multiple pieces of text. Splits them into requests as needed."""
+    return await _embed_batched(_embed_many_batch, texts,
+                                max_batch_size, max_batch_tokens,
+                                max_concurrency)
+
+
+async def embed_one_eu(text):
+    """Embed a single piece of text. Uses ``embeddings_utils``."""
+    await embed.rate_limiter.acquire_async(_ratelimit.request_tokens(text))
+    async with embed.concurrency_controller.slot_async():
+        embedding = await openai.embeddings_utils.aget_embedding(
+            text=text,
+            engine='text-embedding-ada-002',
+        )
+    return np.array(embedding, dtype=np.float32)
+
+
+async def _embed_many_eu_batch(texts):
+    """Embed multiple pieces of text in a single ``embeddings_utils`` call."""
+    await embed.rate_limiter.acquire_async(_ratelimit.request_tokens(texts))
+    async with embed.concurrency_controller.slot_async():
+        embeddings = await openai.embeddings_utils.aget_embeddings(
+            list_of_text=texts,
+            engine='text-embedding-ada-002',
+        )
+    return np.array(embeddings, dtype=np.float32)
+
+
+async def embed_many_eu(texts, *, max_batch_size=None, max_batch_tokens=None,
+                        max_concurrency=None):
+    """
+    Embed multiple pieces of text. Uses ``embeddings_utils``. Splits them into
+    requests as needed.
+    """
+    return await _embed_batched(_embed_many_eu_batch, texts,
+                                max_batch_size, max_batch_tokens,
+                                max_concurrency)
+
+
+def _needs_backoff(error_or_response):
+    """Check if an error or response is HTTP 429 Too Many Requests."""
+    return error_or_response.status == http.HTTPStatus.TOO_MANY_REQUESTS
+
+
+def _gives_up(error):
+    """Check if an ``aiohttp`` error is from a response not worth retrying."""
+    return (isinstance(error, aiohttp.ClientResponseError)
+            and not _retry.is_retryable_status(error.status))
+
+
+@_retry.on_exception((aiohttp.ClientResponseError,
+                      aiohttp.ClientConnectionError),
+                     giveup=_gives_up)
+async def _post_request(text_or_texts, encoding_format):
+    """
+    Make a POST request to the API endpoint, retrying as needed. Give the JSON.
+
+    Each attempt waits on ``embed.rate_limiter``, and calibrates it from the
+    response's headers, then waits for a slot from
+    ``embed.concurrency_controller``.
+    """
+    timeout = embed._REQUESTS_TIMEOUT.total_seconds()
+    tokens = _ratelimit.request_tokens(text_or_texts)
+    await embed.rate_limiter.acquire_async(tokens)
+
+    async with embed.concurrency_controller.slot_async() as slot:
+        async with _get_session() as client_session, client_session.post(
+            url=embed._EMBEDDINGS_URL,
+            headers={
+                'Authorization': f'Bearer {_keys.api_key}',
+                'Content-Type': 'application/json',
+            },
+            json={
+                'input': text_or_texts,
+                'model': 'text-embedding-ada-002',
+                'encoding_format': encoding_format,
+            },
+            timeout=aiohttp.ClientTimeout(sock_connect=timeout,
+                                          sock_read=timeout),
+        ) as response:
+            embed.rate_limiter.calibrate(response.headers)
+            if _needs_backoff(response):
+                slot.throttle()
+            response.raise_for_status()
+            response_json = await response.json()
+
+    embed.rate_limiter.settle(tokens, response_json['usage']['total_tokens'])
+    return response_json
+
+
+async def embed_one_req(text, *, encoding_format=None):
+    """
+    Embed a single piece of text. Uses ``aiohttp``.
+
+    ``encoding_format`` defaults to ``embed.DEFAULT_ENCODING_FORMAT``.
+    """
+    encoding_format = embed._resolve_encoding_format(encoding_format)
+    response_json = await _post_request(text, encoding_format)
+    return embed._decode_embeddings(response_json['data'], encoding_format)[0]
+
+
+async def _embed_many_req_batch(texts, encoding_format):
+    """Embed multiple pieces of text in a single request. Uses ``aiohttp``."""
+    response_json = await _post_request(texts, encoding_format)
+    return embed._decode_embeddings(response_json['data'], encoding_format)
+
+
+async def embed_many_req(texts, *, max_batch_size=None, max_batch_tokens=None,
+                         max_concurrency=None, encoding_format=None):
+    """
+    Embed multiple pieces of text. Uses ``aiohttp``. Splits them into requests
+    as needed.
+
+    ``encoding_format`` defaults to ``embed.DEFAULT_ENCODING_FORMAT``.
+    """
+    encoding_format = embed._resolve_encoding_format(encoding_format)
+    return await _embed_batched(
+        functools.partial(_embed_many_req_batch,
+                          encoding_format=encoding_format),
+        texts, max_batch_size, max_batch_tokens, max_concurrency,
+    )
@@ -0,0 +1,115 @@
+"""
+Asynchronous versions of embedding functions that cache to disk.
+
+These take the same keyword-only arguments as their ``embed.cached``
+counterparts and share the same cache, including ``embed.cached``'s memory
+tier and defaults. Loading and saving are done in a worker thread, so the
+event loop is not blocked on disk access.
+"""
+
+__all__ = [
+    'embed_one',
+    'embed_many',
+    'embed_one_eu',
+    'embed_many_eu',
+    'embed_one_req',
+    'embed_many_req',
+]
+
+import asyncio
+
+from embed import aio
+from embed import cached as _cached
+
+# pylint: disable=protected-access  # This shares embed.cached's internals.
+
+
+async def _embed_cache(func, text_or_texts, data_dir, file_type, mmap):
+    """Load embeddings from disk, or compute (asynchronously) and save them."""
+    if file_type is None:
+        file_type = _cached.DEFAULT_FILE_TYPE
+
+    load = _cached._get_loader(file_type, mmap)
+    path = _cached._build_path(text_or_texts, data_dir, file_type)
+
+    embeddings = await asyncio.to_thread(_cached._lookup,
+                                         func.__name__, path, load)
+    if embeddings is None:
+        embeddings = await asyncio.to_thread(_cached._store,
+                                             func.__name__, path, file_type,
+                                             await func(text_or_texts))
+
+    return embeddings
+
+
+async def _embed_cache_per_text(func, texts, data_dir, file_type, mmap):
+    """
+    Load embeddings for each text separately, computing only the misses.
+
+    This is like ``embed.cached._embed_cache_per_text``, but awaits ``func``.
+    """
+    if file_type is None:
+        file_type = _cached.DEFAULT_FILE_TYPE
+
+    load = _cached._get_loader(file_type, mmap)
+    lookup = await asyncio.to_thread(_cached._PerTextLookup, func.__name__,
+                                     texts, data_dir, file_type, load)
+    if lookup.miss_texts:
+        embeddings = await func(lookup.miss_texts)
+        await asyncio.to_thread(lookup.store, embeddings)
+    return lookup.stack()
+
+
+async def embed_one(text, *, data_dir=None, file_type=None, mmap=False):
+    """Embed a single piece of text. Caches to disk."""
+    return await _embed_cache(aio.embed_one, text, data_dir, file_type, mmap)
+
+
+async def embed_many(texts, *, data_dir=None, file_type=None, per_text=False,
+                     mmap=False):
+    """
+    Embed multiple pieces of text. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately, and only texts
+    not already cached are sent.
+    """
+    cache = _embed_cache_per_text if per_text else _embed_cache
+    return await cache(aio.embed_many, texts, data_dir, file_type, mmap)
+
+
+async def embed_one_eu(text, *, data_dir=None, file_type=None, mmap=False):
+    """
+    Embed a single piece of text. Uses ``embeddings_utils``. Caches to disk.
+    """
+    return await _embed_cache(aio.embed_one_eu, text, data_dir, file_type,
+                              mmap)
+
+
+async def embed_many_eu(texts, *, data_dir=None, file_type=None,
+                        per_text=False, mmap=False):
+    """
+    Embed multiple pieces of text. Uses ``embeddings_utils``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately, and only texts
+    not already cached are sent.
+    """
+    cache = _embed_cache_per_text if per_text else _embed_cache
+    return await cache(aio.embed_many_eu, texts, data_dir, file_type, mmap)
+
+
+async def embed_one_req(text, *, data_dir=None, file_type=None, mmap=False):
+    """Embed a single piece of text. Uses ``aiohttp``. Caches to disk."""
+    return await _embed_cache(aio.embed_one_req, text, data_dir, file_type,
+                              mmap)
+
+
+async def embed_many_req(texts, *, data_dir=None, file_type=None,
+                         per_text=False, mmap=False):
+    """
+    Embed multiple pieces of text. Uses ``aiohttp``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately, and only texts
+    not already cached are sent.
+    """
+    cache = _embed_cache_per_text if per_text else _embed_cache
+    return await cache(aio.embed_many_req, texts, data_dir, file_type, mmap)
@@ -0,0 +1,208 @@
+"""
+Similarities between all pairs of rows of a matrix of embeddings, in tiles.
+
+Computing ``many @ many.T`` all at once takes memory quadratic in the number
+of rows: 40 GB of float32 for 100,000 embeddings. The functions here compute
+it a square tile at a time, keeping only what is asked for from each tile
+before computing the next: each row's ``k`` most similar other rows
+(``topk``), or the pairs of rows at least as similar as a threshold
+(``above``, or ``sparse`` for a ``scipy.sparse`` matrix of them).
+
+Tiles are as large as ``memory_limit`` allows, when split among
+``max_workers`` threads that each work on one tile at a time. Matrix products
+release the GIL, so the threads run on separate cores. NumPy's BLAS library
+may also use multiple threads for each product; if it does, passing
+``max_workers=1`` leaves all the parallelism to it.
+
+The input can be any float32 matrix, including a memory-mapped one, such as
+the cached results of ``embed.cached.embed_many`` with ``mmap=True``. The
+memory limit covers working memory, not results: ``above`` and ``sparse``
+return every pair they find, which, for a low threshold, can be most of them.
+"""
+
+__all__ = ['DEFAULT_MEMORY_LIMIT', 'topk', 'above', 'sparse']
+
+import concurrent.futures
+import math
+import os
+
+import numpy as np
+import scipy.sparse
+
+from embed import _topk
+
+DEFAULT_MEMORY_LIMIT = 256 * 2**20
+"""Default most bytes of tiles, and their temporaries, held at once."""
+
+_BYTES_PER_ENTRY = 16
+"""
+Bytes of working memory per entry of a tile.
+
+This is 4 for the float32 score, plus room for temporaries, such as the
+indices ``np.argpartition`` gives, which may each be as large as the tile.
+"""
+
+
+def topk(embeddings, k, *, memory_limit=DEFAULT_MEMORY_LIMIT,
+         max_workers=None):
+    """
+    Find, for each row, the ``k`` other rows with the highest dot products.
+
+    This returns ``(indices, scores)``, each a matrix with a row per row of
+    ``embeddings``, in order from best to worst, as ``embed.search.topk``
+    gives. A row is never its own neighbor. If there are ``k`` or fewer rows,
+    each row gets all the others.
+
+    ``max_workers`` defaults to the number of CPUs.
+    """
+    embeddings = _as_matrix(embeddings)
+    if k < 1:
+        raise ValueError(f'k must be positive, got {k!r}')
+    count = embeddings.shape[0]
+    tile_size, max_workers = _plan(count, memory_limit, max_workers)
+    k = min(k, count - 1)
+    if k < 1:
+        return _topk.empty(count, 0)
+
+    indices = np.empty((count, k), dtype=np.intp)
+    scores = np.empty((count, k), dtype=np.float32)
+
+    def run(start):
+        stop = start + tile_size
+        indices[start:stop], scores[start:stop] = _topk_rows(
+            embeddings, start, stop, k, tile_size,
+        )
+
+    _run_concurrently(run, range(0, count, tile_size), max_workers)
+    return indices, scores
+
+
+def above(embeddings, threshold, *, memory_limit=DEFAULT_MEMORY_LIMIT,
+          max_workers=None):
+    """
+    Find all pairs of distinct rows whose dot product is at least
+    ``threshold``.
+
+    This returns ``(rows, columns, scores)``: vectors of the indices of the
+    first and second row of each pair, and their dot products. Each pair is
+    given once, with ``row < column``, in order by ``row`` and then
+    ``column``. Only tiles on and above the diagonal are computed.
+
+    ``max_workers`` defaults to the number of CPUs.
+    """
+    embeddings = _as_matrix(embeddings)
+    count = embeddings.shape[0]
+    tile_size, max_workers = _plan(count, memory_limit, max_workers)
+
+    starts = range(0, count, tile_size)
+    results = [None] * len(starts)
+
+    def run(position):
+        results[position] = _pairs_above(embeddings, starts[position],
+                                         threshold, tile_size)
+
+    _run_concurrently(run, range(len(starts)), max_workers)
+    if not results:
+        return (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp),
+                np.empty(0, dtype=np.float32))
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+def sparse(embeddings, threshold, *, memory_limit=DEFAULT_MEMORY_LIMIT,
+           max_workers=None):
+    """
+    Make a sparse matrix of dot products of rows at least ``threshold``.
+
+    This returns a symmetric float32 ``scipy.sparse.csr_matrix`` with a row
+    and column per row of ``embeddings``, holding the dot products of pairs
+    of distinct rows that ``above`` finds. Other entries, including the
+    diagonal, are not stored. Arguments are as for ``above``.
+    """
+    count = np.shape(embeddings)[0]
+    rows, columns, scores = above(embeddings, threshold,
+                                  memory_limit=memory_limit,
+                                  max_workers=max_workers)
+    return scipy.sparse.csr_matrix(
+        (np.concatenate((scores, scores)),
+         (np.concatenate((rows, columns)), np.concatenate((columns, rows)))),
+        shape=(count, count),
+    )
+
+
+def _as_matrix(embeddings):
+    """Check that embeddings are a matrix, converting them to float32."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2:
+        raise ValueError(
+            f'embeddings must be a matrix, got shape {embeddings.shape}')
+    return embeddings
+
+
+def _plan(count, memory_limit, max_workers):
+    """Choose the tile size and number of threads, within the memory limit."""
+    if memory_limit < 1:
+        raise ValueError(
+            f'memory_limit must be positive, got {memory_limit!r}')
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    elif max_workers < 1:
+        raise ValueError(
+            f'max_workers must be positive, got {max_workers!r}')
+
+    tile_size = max(math.isqrt(memory_limit
+                               // (_BYTES_PER_ENTRY * max_workers)), 1)
+    tile_size = min(tile_size, max(count, 1))
+    return tile_size, min(max_workers, -(-count // tile_size))
+
+
+def _run_concurrently(func, arguments, max_workers):
+    """Call ``func`` on each argument, using a pool of worker threads."""
+    if max_workers <= 1:
+        for argument in arguments:
+            func(argument)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix='allpairs',
+    ) as executor:
+        for _ in executor.map(func, arguments):
+            pass
+
+
+def _topk_rows(embeddings, start, stop, k, tile_size):
+    """Find top-``k`` other rows, in order, for rows ``start:stop``."""
+    rows = embeddings[start:stop]
+    best = _topk.empty(rows.shape[0], 0)
+
+    for column_start in range(0, embeddings.shape[0], tile_size):
+        scores = rows @ embeddings[column_start:column_start + tile_size].T
+        if column_start == start:
+            np.fill_diagonal(scores, -np.inf)
+        columns = _topk.select(scores, k)
+        candidates = (columns + column_start,
+                      np.take_along_axis(scores, columns, axis=1))
+        best = _topk.merge(best, candidates, k)
+
+    return _topk.finish(best)
+
+
+def _pairs_above(embeddings, start, threshold, tile_size):
+    """Find pairs at least ``threshold`` whose rows are in a tile, in order."""
+    rows = embeddings[start:start + tile_size]
+    found = []
+
+    for column_start in range(start, embeddings.shape[0], tile_size):
+        scores = rows @ embeddings[column_start:column_start + tile_size].T
+        matches = scores >= threshold
+        if column_start == start:
+            matches &= ~np.tri(*scores.shape, dtype=bool)  # Above diagonal.
+        row_positions, column_positions = np.nonzero(matches)
+        found.append((row_positions + start,
+                      column_positions + column_start,
+                      scores[row_positions, column_positions]))
+
+    pair_rows, pair_columns, pair_scores = (np.concatenate(parts)
+                                            for parts in zip(*found))
+    order = np.argsort(pair_rows, kind='stable')
+    return pair_rows[order], pair_columns[order], pair_scores[order]
@@ -1,8 +1,54 @@
-"""Versions of embedding functions that cache to disk."""
+"""
+Versions of embedding functions that cache to disk.
+
+Besides what they embed, these functions take some keyword-only arguments:
+
+- ``data_dir`` is where to cache. It defaults to ``DEFAULT_DATA_DIR``.
+
+- ``file_type`` is how to cache: ``json`` or ``safetensors`` for a file per
+  call, or ``packed`` for a store of large segment files that grow as entries
+  are appended. It defaults to ``DEFAULT_FILE_TYPE``. These store float32
+  values exactly. ``float16`` and ``int8`` store smaller files, of a half and
+  a quarter the size, by rounding values (see below).
+
+- ``mmap``, if true, makes cache hits return read-only arrays backed by memory
+  maps of the cache, rather than copies. For large embedding matrices, this
+  avoids an allocation and copy on every hit, and processes that load the same
+  embeddings share the OS page cache rather than each having a private copy.
+  This requires a binary file type (not ``json``).
+
+The ``float16`` and ``int8`` file types are decoded to float32 when loaded.
+Results computed on a miss are rounded the same way before they are returned,
+so hits and misses agree exactly. Rounding changes dot products by at most:
+
+- ``float16``: ``2**-11 * |q| + 2**-25 * sqrt(d) * |q|``, for the dot product
+  of a loaded length-1 embedding with a float32 vector ``q`` of dimension
+  ``d``, since each component is rounded to within a relative ``2**-11`` (or
+  absolute ``2**-25``, when tiny). For length-1 ``q`` and ``d = 1536`` this is
+  under ``4.9e-4``, or ``9.8e-4`` between two loaded embeddings.
+
+- ``int8``: ``s / 2 * sqrt(d) * |q|``, where each embedding has its own scale
+  ``s``, its largest absolute component divided by 127, and each component is
+  rounded to within ``s / 2``. If the largest component is 0.1, this is
+  ``0.015`` for length-1 ``q`` and ``d = 1536``. That requires every rounding
+  error to line up with ``q``. Errors are independent in practice, typically
+  giving a far smaller error, about ``s / sqrt(12) * |q|`` (``2.3e-4`` here).
+
+Files of these types can't be memory-mapped, since values must be decoded.
+
+When threads in the same process embed the same uncached input at the same
+time, only one of them calls the API. The others wait, and are given the same
+array, which they should not modify. Processes sharing a data directory also
+take turns: each cache entry has an advisory lock, in the directory's
+``.lock`` file, held while it is computed and saved. A process that waits for
+the lock then loads the entry the other process saved. Files are written under
+temporary names and renamed into place, so readers never see partial files.
+"""
 
 __all__ = [
     'DEFAULT_DATA_DIR',
     'DEFAULT_FILE_TYPE',
+    'memory_cache',
     'embed_one',
     'embed_many',
     'embed_one_eu',
@@ -11,8 +57,13 @@ __all__ = [
     'embed_many_req',
 ]
 
+import errno
+import functools
 import logging
+import os
 from pathlib import Path
+import secrets
+import threading
 
 import blake3
 import numpy as np
@@ -20,6 +71,11 @@ import orjson
 import safetensors.numpy
 
 import embed
+from embed import _tensorfile
+from embed._locking import FileLocks
+from embed._memory import MemoryCache
+from embed._packed import PackedStore
+from embed._singleflight import SingleFlight
 
 DEFAULT_DATA_DIR = Path('data')
 """Default directory to cache embeddings."""
@@ -34,9 +90,47 @@ _ORJSON_SAVE_OPTIONS = (
 )
 """Options for ``orjson.dumps`` when it is called to serialize embeddings."""
 
+_INT8_MAX = 127
+"""Largest magnitude of an ``int8`` value, to which each scale maps."""
+
+_PACKED_SUBDIR = 'packed'
+"""Subdirectory of a data directory that holds its packed store."""
+
+_LOCK_NAME = '.lock'
+"""Filename, in a data directory, of the file its entries' locks are in."""
+
+_LOCK_OFFSET_DIGITS = 7
+"""Hex digits of an entry's hash used as its lock's offset in the lock file."""
+
 _logger = logging.getLogger(__name__)
 """Logger for messages from this submodule (``embed.cached``)."""
 
+memory_cache = MemoryCache()
+"""
+In-memory tier, checked before the disk cache. Disabled until given a budget.
+
+To enable it, set ``memory_cache.max_bytes``. Entries are evicted, least
+recently used first, to keep the total size of cached arrays within that many
+bytes. ``memory_cache.hits`` and ``memory_cache.misses`` count lookups. Arrays
+returned from this tier, or stored in it, are read-only, since callers that
+embed the same input share them.
+"""
+
+_flights = SingleFlight()
+"""Cache misses being computed, by absolute path, so they are not repeated."""
+
+_packed_stores = {}
+"""Packed stores that have been opened, by their directory's absolute path."""
+
+_packed_stores_lock = threading.Lock()
+"""Lock to be held while opening a packed store and adding it to the table."""
+
+_file_locks = {}
+"""Lock files that have been opened, by their absolute path."""
+
+_file_locks_lock = threading.Lock()
+"""Lock to be held while opening a lock file and adding it to the table."""
+
 
 def _compute_input_hash(text_or_texts):
     """Compute a blake3-based hash of input. Used for building a filename."""
@@ -46,87 +140,494 @@ def _compute_input_hash(text_or_texts):
 
 
 def _build_path(text_or_texts, data_dir, file_type):
-    """Build a path for ``_disk_cache``'s wrapper to save/load embeddings."""
+    """
+    Build a path for ``_disk_cache``'s wrapper to save/load embeddings.
+
+    For the ``packed`` file type, this is not the path of a file, but it still
+    identifies the entry: the store is in the directory's ``packed``
+    subdirectory, and the filename stem is the entry's key.
+    """
     data_dir = Path(DEFAULT_DATA_DIR if data_dir is None else data_dir)
     basename = _compute_input_hash(text_or_texts)
     return data_dir / f'{basename}.{file_type}'
 
 
-def _embed_cache_json(func, text_or_texts, data_dir):
-    """Load embeddings as JSON from disk, or compute and save them."""
-    path = _build_path(text_or_texts, data_dir, 'json')
+def _load_json(path):
+    """Load embeddings from a JSON file."""
+    return np.array(orjson.loads(path.read_bytes()), dtype=np.float32)
+
+
+def _save_json(path, embeddings):
+    """Save embeddings to a JSON file."""
+    data = orjson.dumps(embeddings, option=_ORJSON_SAVE_OPTIONS)
+    _publish(path, lambda temporary_path: temporary_path.write_bytes(data))
+
+
+def _load_safetensors(path):
+    """Load embeddings from a safetensors file."""
+    return safetensors.numpy.load_file(path)['embeddings']
+
+
+def _map_safetensors(path):
+    """
+    Memory-map embeddings from a safetensors file, as a read-only array.
+
+    This reads only the small JSON header. The returned array is a view of the
+    file's pages in the OS page cache, so repeated loads of the same file (even
+    by different processes) neither allocate nor copy the embeddings.
+    """
+    arrays, _ = _tensorfile.load(path, mmap=True)
+    return arrays['embeddings']
+
+
+def _save_safetensors(path, embeddings):
+    """Save embeddings to a safetensors file."""
+    _publish(path, lambda temporary_path: safetensors.numpy.save_file(
+        {'embeddings': embeddings},
+        temporary_path,
+    ))
+
+
+def _publish(path, write):
+    """
+    Call ``write`` on a temporary path, then rename the file into place.
+
+    The temporary file is in the same directory, so the rename is atomic:
+    readers, in any process, see either no file or the whole file.
+    """
+    temporary_path = path.with_name(f'.{path.name}.{secrets.token_hex(8)}.tmp')
     try:
-        json_bytes = path.read_bytes()
-    except FileNotFoundError:
-        embeddings = func(text_or_texts)
-        path.write_bytes(orjson.dumps(embeddings, option=_ORJSON_SAVE_OPTIONS))
-        _logger.info('%s: saved: %s', func.__name__, path)
-    else:
-        embeddings = np.array(orjson.loads(json_bytes), dtype=np.float32)
-        _logger.info('%s: loaded: %s', func.__name__, path)
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+
+
+def _encode_float16(embeddings):
+    """Encode embeddings as half-precision tensors."""
+    return {'embeddings': embeddings.astype(np.float16)}
+
+
+def _decode_float16(tensors):
+    """Decode embeddings from half-precision tensors."""
+    return tensors['embeddings'].astype(np.float32)
+
+
+def _encode_int8(embeddings):
+    """Encode embeddings as ``int8`` values with per-vector scales."""
+    scales = np.abs(embeddings).max(axis=-1, keepdims=True,
+                                    initial=0) / _INT8_MAX
+    scales[scales == 0] = 1  # All components are zero. Any scale is exact.
+    values = np.rint(embeddings / scales).astype(np.int8)
+    return {'embeddings': values, 'scales': scales.astype(np.float32)}
+
+
+def _decode_int8(tensors):
+    """Decode embeddings from ``int8`` values and per-vector scales."""
+    return tensors['embeddings'] * tensors['scales']
+
+
+def _load_encoded(path, decode):
+    """Load embeddings from a safetensors file of encoded tensors."""
+    return decode(safetensors.numpy.load_file(path))
+
+
+def _save_encoded(path, tensors):
+    """Save encoded tensors to a safetensors file."""
+    _publish(path, lambda temporary_path: safetensors.numpy.save_file(
+        tensors,
+        temporary_path,
+    ))
+
+
+def _get_packed_store(data_dir):
+    """Get the packed store for a data directory, opening it if necessary."""
+    directory = (data_dir / _PACKED_SUBDIR).absolute()
+    with _packed_stores_lock:
+        try:
+            return _packed_stores[directory]
+        except KeyError:
+            store = _packed_stores[directory] = PackedStore(
+                directory=directory,
+                dimension=embed.DIMENSION,
+            )
+            return store
 
+
+def _load_packed(path):
+    """Load embeddings from a packed store entry."""
+    embeddings = _get_packed_store(path.parent).get(bytes.fromhex(path.stem))
+    if embeddings is None:
+        raise FileNotFoundError(errno.ENOENT, 'No packed store entry', path)
     return embeddings
 
 
-def _embed_cache_safetensors(func, text_or_texts, data_dir):
-    """Load embeddings as safetensors from disk, or compute and save them."""
-    path = _build_path(text_or_texts, data_dir, 'safetensors')
+def _map_packed(path):
+    """Load embeddings from a packed store entry, as a read-only mapping."""
+    store = _get_packed_store(path.parent)
+    embeddings = store.get(bytes.fromhex(path.stem), copy=False)
+    if embeddings is None:
+        raise FileNotFoundError(errno.ENOENT, 'No packed store entry', path)
+    return embeddings
+
+
+def _save_packed(path, embeddings):
+    """Save embeddings to a packed store entry."""
+    _get_packed_store(path.parent).put(bytes.fromhex(path.stem), embeddings)
+
+
+_CODECS = {
+    'float16': (_encode_float16, _decode_float16),
+    'int8': (_encode_int8, _decode_int8),
+}
+"""Functions to encode and decode embeddings, by rounding file type."""
+
+_LOADERS = {
+    'json': _load_json,
+    'safetensors': _load_safetensors,
+    'packed': _load_packed,
+    **{file_type: functools.partial(_load_encoded, decode=decode)
+       for file_type, (_, decode) in _CODECS.items()},
+}
+"""Functions to load embeddings from a cache file, by file type."""
+
+_MAPPERS = {
+    'safetensors': _map_safetensors,
+    'packed': _map_packed,
+}
+"""Functions to load embeddings as read-only memory maps, by file type."""
+
+_SAVERS = {
+    'json': _save_json,
+    'safetensors': _save_safetensors,
+    'packed': _save_packed,
+}
+"""Functions to save embeddings to a cache file, by file type that is exact."""
+
+
+def _hold_locks(paths):
+    """
+    Context manager to hold the cross-process locks of cache entries.
+
+    The entries must all be in the same data directory. Their locks are all
+    bytes of the same lock file, taken in order so processes can't deadlock.
+    """
+    data_dir = paths[0].parent
+    lock_path = (data_dir / _LOCK_NAME).absolute()
+    with _file_locks_lock:
+        try:
+            file_locks = _file_locks[lock_path]
+        except KeyError:
+            file_locks = _file_locks[lock_path] = FileLocks(lock_path)
+
+    return file_locks.hold(int(path.stem[:_LOCK_OFFSET_DIGITS], 16)
+                           for path in paths)
+
+
+def _get_loader(file_type, mmap):
+    """Get the function to load embeddings of a file type, as requested."""
+    if not mmap:
+        return _LOADERS[file_type]
+    try:
+        return _MAPPERS[file_type]
+    except KeyError:
+        raise ValueError(f"can't memory-map {file_type!r} files") from None
+
+
+def _lookup(name, path, load):
+    """
+    Look for cached embeddings in memory, then on disk, logging as ``name``.
+
+    Embeddings found on disk are added to the memory tier. If the embeddings
+    are not cached, ``None`` is returned.
+    """
+    embeddings = memory_cache.get(path.absolute())
+    if embeddings is not None:
+        _logger.debug('%s: in memory: %s', name, path)
+        return embeddings
+
     try:
-        tensor_dict = safetensors.numpy.load_file(path)
+        embeddings = load(path)
     except FileNotFoundError:
-        embeddings = func(text_or_texts)
-        safetensors.numpy.save_file({'embeddings': embeddings}, path)
-        _logger.info('%s: saved: %s', func.__name__, path)
+        return None
+
+    _logger.info('%s: loaded: %s', name, path)
+    return memory_cache.put(path.absolute(), embeddings)
+
+
+def _store(name, path, file_type, embeddings):
+    """
+    Cache computed embeddings on disk and in memory, logging as ``name``.
+
+    For file types that round, this returns the embeddings as they would be
+    loaded, so they are the same as later cache hits.
+    """
+    try:
+        encode, decode = _CODECS[file_type]
+    except KeyError:
+        _SAVERS[file_type](path, embeddings)
     else:
-        embeddings = tensor_dict['embeddings']
-        _logger.info('%s: loaded: %s', func.__name__, path)
+        tensors = encode(embeddings)
+        _save_encoded(path, tensors)
+        embeddings = decode(tensors)
+
+    _logger.info('%s: saved: %s', name, path)
+    return memory_cache.put(path.absolute(), embeddings)
+
+
+def _embed_cache(func, text_or_texts, data_dir, file_type, mmap):
+    """
+    Load embeddings from disk, or compute and save them.
+
+    If another thread is already computing the same embeddings, this waits
+    for its result instead. If another process is, this waits for it to save
+    them, then loads them.
+    """
+    name = func.__name__
+    load = _get_loader(file_type, mmap)
+    path = _build_path(text_or_texts, data_dir, file_type)
+
+    def compute():
+        with _hold_locks([path]):
+            # Another thread or process may have cached them since we looked.
+            embeddings = _lookup(name, path, load)
+            if embeddings is None:
+                embeddings = _store(name, path, file_type,
+                                    func(text_or_texts))
+        return embeddings
+
+    embeddings = _lookup(name, path, load)
+    if embeddings is None:
+        embeddings = _flights.run(path.absolute(), compute)
 
     return embeddings
 
 
-def _embed_cache_default(func, text_or_texts, data_dir):
+def _embed_cache_json(func, text_or_texts, data_dir, mmap):
+    """Load embeddings as JSON from disk, or compute and save them."""
+    return _embed_cache(func, text_or_texts, data_dir, 'json', mmap)
+
+
+def _embed_cache_safetensors(func, text_or_texts, data_dir, mmap):
+    """Load embeddings as safetensors from disk, or compute and save them."""
+    return _embed_cache(func, text_or_texts, data_dir, 'safetensors', mmap)
+
+
+def _embed_cache_packed(func, text_or_texts, data_dir, mmap):
+    """Load embeddings from a packed store, or compute and store them."""
+    return _embed_cache(func, text_or_texts, data_dir, 'packed', mmap)
+
+
+def _embed_cache_float16(func, text_or_texts, data_dir, mmap):
+    """Load embeddings as float16 from disk, or compute and save them."""
+    return _embed_cache(func, text_or_texts, data_dir, 'float16', mmap)
+
+
+def _embed_cache_int8(func, text_or_texts, data_dir, mmap):
+    """Load embeddings as scaled int8 from disk, or compute and save them."""
+    return _embed_cache(func, text_or_texts, data_dir, 'int8', mmap)
+
+
+def _embed_cache_default(func, text_or_texts, data_dir, mmap):
     """
     Load embeddings in the default format from disk, or compute and save them.
     """
-    return _CACHERS[DEFAULT_FILE_TYPE](func, text_or_texts, data_dir)
+    return _CACHERS[DEFAULT_FILE_TYPE](func, text_or_texts, data_dir, mmap)
 
 
 _CACHERS = {
     'json': _embed_cache_json,
     'safetensors': _embed_cache_safetensors,
+    'packed': _embed_cache_packed,
+    'float16': _embed_cache_float16,
+    'int8': _embed_cache_int8,
     None: _embed_cache_default,
 }
 
 
-def embed_one(text, *, data_dir=None, file_type=None):
+def _embed_cache_per_text(func, texts, data_dir, file_type, mmap):
+    """
+    Load embeddings for each text separately, computing only the misses.
+
+    Each text is cached in its own file, exactly as ``embed_one*`` would cache
+    it, so per-text entries are shared with single-text calls and with other
+    batches that contain the same text. All texts not found in memory or on
+    disk are passed to ``func`` in a single batch, each distinct text once. The
+    rows are then saved and reassembled in input order.
+
+    Texts that another thread is already computing are not sent. Instead,
+    this waits for that thread's results, after computing its own misses.
+    """
+    if file_type is None:
+        file_type = DEFAULT_FILE_TYPE
+
+    load = _get_loader(file_type, mmap)
+    lookup = _PerTextLookup(func.__name__, texts, data_dir, file_type, load)
+    if not lookup.miss_texts:
+        return lookup.stack()
+
+    led_flights = {}
+    followed_flights = {}
+    for text in lookup.miss_texts:
+        flight, leader = _flights.claim(lookup.path(text).absolute())
+        (led_flights if leader else followed_flights)[text] = flight
+
+    try:
+        _compute_led(func, lookup, load, led_flights)
+    except BaseException as error:
+        for flight in led_flights.values():
+            flight.fail(error)  # Does nothing if it already finished.
+        raise
+
+    for text, flight in followed_flights.items():
+        lookup.fill(text, flight.wait())
+
+    return lookup.stack()
+
+
+def _compute_led(func, lookup, load, led_flights):
+    """
+    Compute per-text misses this thread leads, and finish their flights.
+
+    This holds the cross-process locks of all the texts' entries while it
+    computes and saves them.
+    """
+    if not led_flights:
+        return
+
+    with _hold_locks([lookup.path(text) for text in led_flights]):
+        # Another thread or process may have cached some since we looked.
+        compute_texts = []
+        for text, flight in led_flights.items():
+            embedding = _lookup(func.__name__, lookup.path(text), load)
+            if embedding is None:
+                compute_texts.append(text)
+            else:
+                lookup.fill(text, embedding)
+                flight.succeed(embedding)
+
+        if compute_texts:
+            stored = lookup.store(func(compute_texts), compute_texts)
+            for text, embedding in zip(compute_texts, stored):
+                led_flights[text].succeed(embedding)
+
+
+class _PerTextLookup:
+    """
+    Per-text lookup of cached embeddings, to be completed by storing misses.
+
+    This separates the steps of ``_embed_cache_per_text`` so they can also be
+    used when the misses are embedded asynchronously.
+    """
+
+    def __init__(self, name, texts, data_dir, file_type, load):
+        """Look up each distinct text, and record which ones were missed."""
+        self._name = name
+        self._data_dir = data_dir
+        self._file_type = file_type
+        self._positions = {}  # Maps each distinct text to its indices.
+        for index, text in enumerate(texts):
+            self._positions.setdefault(text, []).append(index)
+
+        self._rows = [None] * len(texts)
+        self.miss_texts = []
+        """Distinct texts that were not cached, in order of appearance."""
+
+        for text in self._positions:
+            embedding = _lookup(name, self.path(text), load)
+            if embedding is None:
+                self.miss_texts.append(text)
+            else:
+                self.fill(text, embedding)
+
+    def path(self, text):
+        """Get the path where a text's embedding is cached."""
+        return _build_path(text, self._data_dir, self._file_type)
+
+    def store(self, embeddings, texts=None):
+        """
+        Cache and use embeddings computed for ``texts``, in order.
+
+        ``texts`` defaults to ``miss_texts``. The stored rows are returned.
+        """
+        if texts is None:
+            texts = self.miss_texts
+
+        stored = []
+        for text, embedding in zip(texts, embeddings):
+            embedding = _store(self._name, self.path(text), self._file_type,
+                               embedding)
+            self.fill(text, embedding)
+            stored.append(embedding)
+        return stored
+
+    def stack(self):
+        """Stack the rows, in input order, into a matrix."""
+        if not self._rows:
+            return np.empty((0, embed.DIMENSION), dtype=np.float32)
+        return np.stack(self._rows)
+
+    def fill(self, text, embedding):
+        """Use an embedding for every position where its text appears."""
+        for index in self._positions[text]:
+            self._rows[index] = embedding
+
+
+def embed_one(text, *, data_dir=None, file_type=None, mmap=False):
     """Embed a single piece of text. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_one, text, data_dir)
+    return _CACHERS[file_type](embed.embed_one, text, data_dir, mmap)
 
 
-def embed_many(texts, *, data_dir=None, file_type=None):
-    """Embed multiple pieces of text. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_many, texts, data_dir)
+def embed_many(texts, *, data_dir=None, file_type=None, per_text=False,
+               mmap=False):
+    """
+    Embed multiple pieces of text. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (see
+    ``_embed_cache_per_text``), and only texts not already cached are sent.
+    """
+    if per_text:
+        return _embed_cache_per_text(embed.embed_many, texts, data_dir,
+                                     file_type, mmap)
+    return _CACHERS[file_type](embed.embed_many, texts, data_dir, mmap)
 
 
-def embed_one_eu(text, *, data_dir=None, file_type=None):
+def embed_one_eu(text, *, data_dir=None, file_type=None, mmap=False):
     """
     Embed a single piece of text. Uses ``embeddings_utils``. Caches to disk.
     """
-    return _CACHERS[file_type](embed.embed_one_eu, text, data_dir)
+    return _CACHERS[file_type](embed.embed_one_eu, text, data_dir, mmap)
 
 
-def embed_many_eu(texts, *, data_dir=None, file_type=None):
+def embed_many_eu(texts, *, data_dir=None, file_type=None, per_text=False,
+                  mmap=False):
     """
     Embed multiple pieces of text. Uses ``embeddings_utils``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (see
+    ``_embed_cache_per_text``), and only texts not already cached are sent.
     """
-    return _CACHERS[file_type](embed.embed_many_eu, texts, data_dir)
+    if per_text:
+        return _embed_cache_per_text(embed.embed_many_eu, texts, data_dir,
+                                     file_type, mmap)
+    return _CACHERS[file_type](embed.embed_many_eu, texts, data_dir, mmap)
 
 
-def embed_one_req(text, *, data_dir=None, file_type=None):
+def embed_one_req(text, *, data_dir=None, file_type=None, mmap=False):
     """Embed a single piece of text. Uses ``requests``. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_one_req, text, data_dir)
+    return _CACHERS[file_type](embed.embed_one_req, text, data_dir, mmap)
 
 
-def embed_many_req(texts, *, data_dir=None, file_type=None):
-    """Embed multiple pieces of text. Uses ``requests``. Caches to disk."""
-    return _CACHERS[file_type](embed.embed_many_req, texts, data_dir)
+def embed_many_req(texts, *, data_dir=None, file_type=None, per_text=False,
+                   mmap=False):
+    """
+    Embed multiple pieces of text. Uses ``requests``. Caches to disk.
+
+    If ``per_text`` is true, each text is cached separately (see
+    ``_embed_cache_per_text``), and only texts not already cached are sent.
+    """
+    if per_text:
+        return _embed_cache_per_text(embed.embed_many_req, texts, data_dir,
+                                     file_type, mmap)
+    return _CACHERS[file_type](embed.embed_many_req, texts, data_dir, mmap)
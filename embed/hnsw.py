@@ -0,0 +1,419 @@
+"""
+HNSW graph index for low-latency approximate nearest-neighbor search.
+
+A hierarchical navigable small world (HNSW) index links each row to nearby
+rows in a graph with several layers. Every row is in the bottom layer, and
+each layer above holds a random fraction, about ``1 / m``, of the rows in the
+layer below. A search starts at the single row in the top layer, walks
+greedily toward the query through each sparser layer, and then, in the bottom
+layer, explores outward from there, keeping the best ``ef_search`` rows found.
+This scores a small part of the corpus, usually in a few milliseconds.
+
+Each row is linked to up to ``m`` others in each upper layer, and ``2 * m`` in
+the bottom layer, chosen by the heuristic of Malkov and Yashunin: candidates
+are taken from nearest to farthest, skipping any nearer to an already-chosen
+neighbor than to the row itself, so links reach out in diverse directions.
+``ef_construction`` is how many candidates are considered. Larger ``m``,
+``ef_construction``, and ``ef_search`` give better recall but are slower.
+
+Similarity is the dot product, which suits OpenAI embeddings, since they are
+normalized to length 1. Rows are added one at a time, in order, so the index
+of each row is its position among all rows added. Passing the matrix returned
+by ``embed_many`` to ``add`` makes search results its row indices.
+
+This is written in Python and NumPy: searching scores each row's neighbors
+with one matrix product, but adding rows is far slower than in compiled HNSW
+libraries. Adding is not thread-safe, but searches may run concurrently.
+"""
+
+__all__ = [
+    'DEFAULT_M',
+    'DEFAULT_EF_CONSTRUCTION',
+    'DEFAULT_EF_SEARCH',
+    'HNSWIndex',
+]
+
+import heapq
+import math
+
+import numpy as np
+
+from embed import _tensorfile, _topk, search
+
+DEFAULT_M = 16
+"""Default number of links per row in each layer above the bottom layer."""
+
+DEFAULT_EF_CONSTRUCTION = 200
+"""Default number of candidate neighbors considered when adding each row."""
+
+DEFAULT_EF_SEARCH = 64
+"""Default number of rows kept while searching the bottom layer."""
+
+_KIND = 'hnsw'
+"""Kind of index recorded in the metadata of saved files."""
+
+
+class HNSWIndex:  # pylint: disable=too-many-instance-attributes
+    """
+    Hierarchical navigable small world graph over rows of embeddings.
+
+    The dimension is set by the first rows added. Rows are added by ``add``,
+    and can be added at any time, including after the index is loaded.
+    ``seed`` seeds the choice of each row's top layer.
+    """
+
+    def __init__(self, *, m=DEFAULT_M,
+                 ef_construction=DEFAULT_EF_CONSTRUCTION,
+                 ef_search=DEFAULT_EF_SEARCH, seed=None):
+        """Create an empty index."""
+        if m < 2:
+            raise ValueError(f'm must be at least 2, got {m!r}')
+        if ef_construction < 1:
+            raise ValueError(
+                f'ef_construction must be positive, got {ef_construction!r}')
+
+        self._m = m
+        self._ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_scale = 1 / math.log(m)
+        self._rng = np.random.default_rng(seed)
+
+        self._size = 0
+        self._entry = _topk.MISSING
+        self._vectors = None
+        self._levels = np.empty(0, dtype=np.int32)
+        self._base_links = np.empty((0, 2 * m), dtype=np.int32)
+        self._base_counts = np.empty(0, dtype=np.int32)
+        self._upper_links = []  # A dict for each layer above the bottom.
+
+    @classmethod
+    def load(cls, path, *, mmap=False):
+        """
+        Load an index saved by ``save``.
+
+        If ``mmap`` is true, the rows are memory-mapped, not read. Rows added
+        later are held in memory, along with a copy of the mapped rows.
+        """
+        arrays, metadata = _tensorfile.load(path, mmap=mmap)
+        if metadata.get('kind') != _KIND:
+            raise ValueError(f'{path} is not a saved HNSW index')
+
+        index = cls(m=int(metadata['m']),
+                    ef_construction=int(metadata['ef_construction']),
+                    ef_search=int(metadata['ef_search']))
+        index._restore(arrays, int(metadata['entry']))
+        return index
+
+    def save(self, path):
+        """Save the index to a safetensors file."""
+        if not self._size:
+            raise ValueError('cannot save an empty index')
+        nodes, levels, offsets, neighbors = self._flatten_upper_links()
+        _tensorfile.save(
+            path,
+            {
+                'vectors': self._vectors[:self._size],
+                'levels': self._levels[:self._size],
+                'base_links': self._base_links[:self._size],
+                'upper_nodes': nodes,
+                'upper_levels': levels,
+                'upper_offsets': offsets,
+                'upper_neighbors': neighbors,
+            },
+            {
+                'kind': _KIND,
+                'm': str(self._m),
+                'ef_construction': str(self._ef_construction),
+                'ef_search': str(self.ef_search),
+                'entry': str(self._entry),
+            },
+        )
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes and settings."""
+        return (f'<{type(self).__name__} size={len(self)}'
+                f' dimension={self.dimension} m={self._m}'
+                f' ef_construction={self._ef_construction}'
+                f' ef_search={self.ef_search}>')
+
+    def __len__(self):
+        """Number of rows in the index."""
+        return self._size
+
+    @property
+    def dimension(self):
+        """Number of components in each row, or ``None`` if no rows yet."""
+        return None if self._vectors is None else self._vectors.shape[1]
+
+    @property
+    def m(self):
+        """Number of links per row in each layer above the bottom layer."""
+        return self._m
+
+    @property
+    def ef_construction(self):
+        """Number of candidate neighbors considered when adding each row."""
+        return self._ef_construction
+
+    @property
+    def ef_search(self):
+        """Default number of rows kept while searching the bottom layer."""
+        return self._ef_search
+
+    @ef_search.setter
+    def ef_search(self, value):
+        if value < 1:
+            raise ValueError(f'ef_search must be positive, got {value!r}')
+        self._ef_search = value
+
+    def add(self, vectors):
+        """
+        Add a row, given as a vector, or rows, given as a matrix.
+
+        This returns the index of the row, or a vector of indices of the rows.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim not in (1, 2):
+            raise ValueError(
+                f'vectors must be a vector or matrix,'
+                f' got shape {vectors.shape}')
+        rows = np.atleast_2d(vectors)
+        if self._vectors is None:
+            self._vectors = np.empty((0, rows.shape[1]), dtype=np.float32)
+        elif rows.shape[1] != self.dimension:
+            raise ValueError(f'vectors of shape {vectors.shape} do not match'
+                             f' dimension {self.dimension}')
+
+        start = self._size
+        self._reserve(start + rows.shape[0])
+        self._vectors[start:start + rows.shape[0]] = rows
+        for node in range(start, start + rows.shape[0]):
+            self._insert(node)
+
+        ids = np.arange(start, start + rows.shape[0])
+        return ids[0] if vectors.ndim == 1 else ids
+
+    def search(self, queries, k, *, ef_search=None):
+        """
+        Find approximately the ``k`` rows with the highest dot products with
+        each query.
+
+        This takes and returns the same forms as ``embed.search.topk``.
+        ``ef_search`` is raised to ``k`` if lower. If fewer than ``k`` rows
+        are found, results are padded with the index ``-1`` and the score
+        ``-inf``.
+        """
+        if not self._size:
+            raise ValueError('cannot search an empty index')
+        queries, single = _topk.as_queries(queries, self.dimension, k)
+        if ef_search is None:
+            ef_search = self.ef_search
+        elif ef_search < 1:
+            raise ValueError(f'ef_search must be positive, got {ef_search!r}')
+        k = min(k, self._size)
+
+        indices, scores = _topk.empty(queries.shape[0], k)
+        for number, query in enumerate(queries):
+            found = self._search(query, max(ef_search, k))[:k]
+            scores[number, :len(found)] = [score for score, _ in found]
+            indices[number, :len(found)] = [node for _, node in found]
+
+        if single:
+            return indices[0], scores[0]
+        return indices, scores
+
+    def recall(self, queries, k, *, ef_search=None):
+        """
+        Measure the recall of ``search`` for queries, against exact search.
+
+        This is the mean fraction of each query's exact ``k`` nearest rows
+        that ``search`` finds, as given by ``embed.search.recall``.
+        """
+        found, _ = self.search(queries, k, ef_search=ef_search)
+        exact, _ = search.topk(self._vectors[:self._size], queries, k)
+        return search.recall(found, exact)
+
+    def _reserve(self, capacity):
+        """Make room for at least ``capacity`` rows, growing geometrically."""
+        if capacity <= self._vectors.shape[0]:
+            return
+        capacity = max(capacity, 2 * self._vectors.shape[0])
+        self._vectors = _grown(self._vectors, capacity, 0)
+        self._levels = _grown(self._levels, capacity, 0)
+        self._base_links = _grown(self._base_links, capacity, _topk.MISSING)
+        self._base_counts = _grown(self._base_counts, capacity, 0)
+
+    def _insert(self, node):
+        """Link a row, already stored at position ``node``, into the graph."""
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_scale)
+        self._levels[node] = level
+        while len(self._upper_links) < level:
+            self._upper_links.append({})
+        self._size = node + 1
+
+        if self._entry == _topk.MISSING:
+            self._entry = node
+            for layer in self._upper_links[:level]:
+                layer[node] = np.empty(0, dtype=np.int32)
+            return
+
+        query = self._vectors[node]
+        top = int(self._levels[self._entry])
+        found = self._descend(query, top, level)
+
+        for layer in range(min(top, level), -1, -1):
+            found = self._search_layer(query, found, self._ef_construction,
+                                       layer)
+            neighbors = self._select(found, self._m)
+            self._set_links(node, layer, neighbors)
+            for neighbor in neighbors:
+                self._link(neighbor, node, layer)
+
+        for layer in range(top + 1, level + 1):
+            self._upper_links[layer - 1][node] = np.empty(0, dtype=np.int32)
+        if level > top:
+            self._entry = node
+
+    def _search(self, query, ef):
+        """Search all layers for a query, giving ``(score, row)`` pairs."""
+        found = self._descend(query, int(self._levels[self._entry]), 0)
+        return self._search_layer(query, found, ef, 0)
+
+    def _descend(self, query, top, bottom):
+        """Walk greedily from the entry row through layers above ``bottom``."""
+        entry = self._entry
+        found = [(float(self._vectors[entry] @ query), entry)]
+        for layer in range(top, bottom, -1):
+            found = self._search_layer(query, found, 1, layer)
+        return found
+
+    def _search_layer(self, query, entries, ef, layer):
+        """
+        Search a layer, starting from ``(score, row)`` pairs in ``entries``.
+
+        This gives the best ``ef`` pairs found, from highest to lowest score.
+        """
+        visited = {node for _, node in entries}
+        candidates = [(-score, node) for score, node in entries]
+        heapq.heapify(candidates)
+        results = list(entries)
+        heapq.heapify(results)  # The lowest score is first.
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negated, node = heapq.heappop(candidates)
+            if -negated < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [neighbor
+                         for neighbor in self._neighbors(node, layer).tolist()
+                         if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            scores = self._vectors[neighbors] @ query
+            for score, neighbor in zip(scores.tolist(), neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _select(self, found, count):
+        """
+        Choose up to ``count`` diverse neighbors by the HNSW heuristic.
+
+        ``found`` holds ``(score, row)`` pairs from highest to lowest score.
+        A row is skipped if it is more similar to a chosen neighbor than to
+        the row whose neighbors are being chosen.
+        """
+        chosen = []
+        for score, node in found:
+            if len(chosen) == count:
+                break
+            if (not chosen
+                    or (self._vectors[chosen] @ self._vectors[node]).max()
+                    < score):
+                chosen.append(node)
+        return chosen
+
+    def _link(self, source, target, layer):
+        """Link ``source`` to ``target``, pruning its links if too many."""
+        links = np.append(self._neighbors(source, layer), target)
+        if links.size > self._max_links(layer):
+            scores = self._vectors[links] @ self._vectors[source]
+            order = np.argsort(-scores, kind='stable')
+            links = self._select(zip(scores[order].tolist(),
+                                     links[order].tolist()),
+                                 self._max_links(layer))
+        self._set_links(source, layer, links)
+
+    def _max_links(self, layer):
+        """Give the most links a row may have in a layer."""
+        return 2 * self._m if layer == 0 else self._m
+
+    def _neighbors(self, node, layer):
+        """Give a row's linked rows in a layer."""
+        if layer == 0:
+            return self._base_links[node, :self._base_counts[node]]
+        return self._upper_links[layer - 1][node]
+
+    def _set_links(self, node, layer, links):
+        """Replace a row's links in a layer."""
+        links = np.asarray(links, dtype=np.int32)
+        if layer == 0:
+            self._base_links[node, :links.size] = links
+            self._base_links[node, links.size:] = _topk.MISSING
+            self._base_counts[node] = links.size
+        else:
+            self._upper_links[layer - 1][node] = links
+
+    def _flatten_upper_links(self):
+        """Give upper-layer links as arrays, for saving."""
+        nodes = []
+        levels = []
+        lists = []
+        for level, layer in enumerate(self._upper_links, start=1):
+            for node, links in sorted(layer.items()):
+                nodes.append(node)
+                levels.append(level)
+                lists.append(links)
+
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([links.size for links in lists], out=offsets[1:])
+        neighbors = (np.concatenate(lists) if lists
+                     else np.empty(0, dtype=np.int32))
+        return (np.array(nodes, dtype=np.int64),
+                np.array(levels, dtype=np.int32),
+                offsets,
+                neighbors.astype(np.int32))
+
+    def _restore(self, arrays, entry):
+        """Restore the rows and graph from arrays loaded from a file."""
+        self._vectors = arrays['vectors']
+        self._size = self._vectors.shape[0]
+        self._entry = entry
+        self._levels = np.array(arrays['levels'])
+        self._base_links = np.array(arrays['base_links'])
+        self._base_counts = np.count_nonzero(
+            self._base_links != _topk.MISSING, axis=1).astype(np.int32)
+
+        top = int(self._levels.max(initial=0))
+        self._upper_links = [{} for _ in range(top)]
+        offsets = arrays['upper_offsets']
+        neighbors = np.array(arrays['upper_neighbors'])
+        for number, (node, level) in enumerate(zip(
+                arrays['upper_nodes'].tolist(),
+                arrays['upper_levels'].tolist())):
+            self._upper_links[level - 1][node] = (
+                neighbors[offsets[number]:offsets[number + 1]])
+
+
+def _grown(array, capacity, fill):
+    """Copy an array into a new one with ``capacity`` rows, filling in."""
+    grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
@@ -0,0 +1,247 @@
+"""
+Inverted-file (IVF) index for approximate nearest-neighbor search.
+
+Exact search, as by ``embed.search.topk``, scores every row of the corpus for
+every query. An IVF index instead clusters the corpus by k-means into
+``nlist`` lists, each with a centroid, and scores a query only against the
+rows in the ``nprobe`` lists whose centroids are nearest to it. This scores
+about ``nprobe / nlist`` of the corpus, at the cost of missing neighbors that
+fall in other lists. Raising ``nprobe`` trades speed for recall, which
+``IVFIndex.recall`` measures against exact search.
+
+Clustering is spherical k-means, suited to OpenAI embeddings, which are
+normalized to length 1: centroids are normalized too, and the nearest are
+those with the highest dot products. Rows are stored grouped by list, so each
+probed list is scored by one matrix product.
+
+Indexes are saved as safetensors files. Loading with ``mmap=True`` maps the
+stored rows rather than reading them, so only the lists that are probed are
+read into memory, and processes can share them.
+"""
+
+__all__ = ['DEFAULT_NPROBE', 'IVFIndex']
+
+import math
+
+import numpy as np
+
+from embed import _kmeans, _tensorfile, _topk, search
+
+DEFAULT_NPROBE = 8
+"""Default number of lists an ``IVFIndex`` searches for each query."""
+
+_TRAINING_POINTS_PER_LIST = 256
+"""Most rows per list ``IVFIndex.build`` samples for k-means, by default."""
+
+_COPY_BLOCK_SIZE = 65536
+"""Number of rows copied at a time when ``IVFIndex.build`` groups them."""
+
+_KIND = 'ivf'
+"""Kind of index recorded in the metadata of saved files."""
+
+
+class IVFIndex:
+    """
+    Inverted-file index over the rows of a corpus of embeddings.
+
+    Indexes are made by ``build`` or ``load``. Searches return indices of
+    rows in the original corpus. An index holds its own copy of the rows.
+    """
+
+    def __init__(self, centroids, vectors, ids, offsets, *,
+                 nprobe=DEFAULT_NPROBE):
+        """
+        Create an index from its arrays. Usually ``build`` or ``load`` is used.
+
+        ``vectors`` holds the rows of list ``i`` at ``offsets[i]`` up to
+        ``offsets[i + 1]``. ``ids`` holds the corpus indices of those rows.
+        """
+        self._centroids = centroids
+        self._vectors = vectors
+        self._ids = ids
+        self._offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    # pylint: disable-next=too-many-arguments
+    def build(cls, corpus, *, nlist=None, nprobe=DEFAULT_NPROBE,
+              training_size=None, iterations=_kmeans.DEFAULT_ITERATIONS,
+              seed=None):
+        """
+        Build an index over the rows of a matrix of embeddings.
+
+        ``nlist`` defaults to about ``4 * sqrt(len(corpus))``. Centroids are
+        found by k-means on a random sample of ``training_size`` rows, which
+        defaults to 256 per list (or all rows, if fewer). ``seed`` seeds the
+        sampling and k-means.
+        """
+        corpus = np.asarray(corpus, dtype=np.float32)
+        if corpus.ndim != 2 or corpus.shape[0] == 0:
+            raise ValueError(
+                f'corpus must be a nonempty matrix, got shape {corpus.shape}')
+        if nlist is None:
+            nlist = min(corpus.shape[0], max(1, round(4 * math.sqrt(
+                corpus.shape[0]))))
+        if training_size is None:
+            training_size = nlist * _TRAINING_POINTS_PER_LIST
+
+        rng = np.random.default_rng(seed)
+        if training_size < corpus.shape[0]:
+            sample = np.sort(rng.choice(corpus.shape[0], size=training_size,
+                                        replace=False))
+            training = corpus[sample]
+        else:
+            training = corpus
+        centroids = _kmeans.kmeans(training, nlist, iterations=iterations,
+                                   spherical=True, seed=rng)
+
+        labels, _ = _kmeans.assign(corpus, centroids)
+        ids = np.argsort(labels, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.intp)
+        np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+        return cls(centroids, _take_rows(corpus, ids), ids, offsets,
+                   nprobe=nprobe)
+
+    @classmethod
+    def load(cls, path, *, mmap=False):
+        """
+        Load an index saved by ``save``.
+
+        If ``mmap`` is true, the stored rows are memory-mapped, not read.
+        """
+        arrays, metadata = _tensorfile.load(path, mmap=mmap)
+        if metadata.get('kind') != _KIND:
+            raise ValueError(f'{path} is not a saved IVF index')
+        return cls(arrays['centroids'], arrays['vectors'], arrays['ids'],
+                   arrays['offsets'], nprobe=int(metadata['nprobe']))
+
+    def save(self, path):
+        """Save the index to a safetensors file."""
+        _tensorfile.save(
+            path,
+            {
+                'centroids': self._centroids,
+                'vectors': self._vectors,
+                'ids': self._ids.astype(np.int64),
+                'offsets': self._offsets.astype(np.int64),
+            },
+            {'kind': _KIND, 'nprobe': str(self.nprobe)},
+        )
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes and settings."""
+        return (f'<{type(self).__name__} size={len(self)}'
+                f' dimension={self.dimension}'
+                f' nlist={self.nlist} nprobe={self.nprobe}>')
+
+    def __len__(self):
+        """Number of rows in the index."""
+        return self._vectors.shape[0]
+
+    @property
+    def dimension(self):
+        """Number of components in each row."""
+        return self._vectors.shape[1]
+
+    @property
+    def nlist(self):
+        """Number of lists the rows are clustered into."""
+        return self._centroids.shape[0]
+
+    @property
+    def nprobe(self):
+        """Default number of lists searched for each query."""
+        return self._nprobe
+
+    @nprobe.setter
+    def nprobe(self, value):
+        if value < 1:
+            raise ValueError(f'nprobe must be positive, got {value!r}')
+        self._nprobe = value
+
+    def search(self, queries, k, *, nprobe=None):
+        """
+        Find approximately the ``k`` rows with the highest dot products with
+        each query.
+
+        This takes and returns the same forms as ``embed.search.topk``. If the
+        probed lists have fewer than ``k`` rows in all, results are padded
+        with the index ``-1`` and the score ``-inf``.
+        """
+        queries, single = _topk.as_queries(queries, self.dimension, k)
+        positions, scores = self._search(queries, k, nprobe)
+        indices = np.where(positions == _topk.MISSING, _topk.MISSING,
+                           self._ids[positions])
+        if single:
+            return indices[0], scores[0]
+        return indices, scores
+
+    def recall(self, queries, k, *, nprobe=None):
+        """
+        Measure the recall of ``search`` for queries, against exact search.
+
+        This is the mean fraction of each query's exact ``k`` nearest rows
+        that ``search`` finds, as given by ``embed.search.recall``.
+        """
+        queries, _ = _topk.as_queries(queries, self.dimension, k)
+        found, _ = self._search(queries, k, nprobe)
+        exact, _ = search.topk(self._vectors, queries, k)
+        return search.recall(found, exact)
+
+    def _search(self, queries, k, nprobe):
+        """Search for a matrix of queries, giving positions in the lists."""
+        if nprobe is None:
+            nprobe = self.nprobe
+        elif nprobe < 1:
+            raise ValueError(f'nprobe must be positive, got {nprobe!r}')
+        k = min(k, len(self))
+
+        probes, _ = search.topk(self._centroids, queries,
+                                min(nprobe, self.nlist))
+        best = _topk.empty(queries.shape[0], k)
+        for number, members in _group_by_list(probes):
+            self._scan(number, queries, members, best, k)
+        return _topk.finish(best)
+
+    def _scan(self, number, queries, members, best, k):
+        """Score a list for the queries probing it, and update their best."""
+        begin, end = self._offsets[number], self._offsets[number + 1]
+        if begin == end:
+            return
+
+        scores = queries[members] @ self._vectors[begin:end].T
+        columns = _topk.select(scores, k)
+        candidates = (columns + begin,
+                      np.take_along_axis(scores, columns, axis=1))
+        best_positions, best_scores = best
+        (best_positions[members], best_scores[members]) = _topk.merge(
+            (best_positions[members], best_scores[members]), candidates, k,
+        )
+
+
+def _group_by_list(probes):
+    """
+    Group queries by the lists they probe, so each list is scored once.
+
+    ``probes`` has a row of list numbers per query. This yields each probed
+    list number with the numbers of the queries probing it.
+    """
+    lists = probes.ravel()
+    order = np.argsort(lists, kind='stable')
+    bounds = np.flatnonzero(np.diff(lists[order])) + 1
+    for group in np.split(order, bounds):
+        yield lists[group[0]], group // probes.shape[1]
+
+
+def _take_rows(corpus, ids):
+    """
+    Copy rows of a matrix into a new matrix, in the order of ``ids``.
+
+    This gives the same result as ``corpus[ids]``, but copies a block of rows
+    at a time, so it needs memory for one block beyond the copy it gives.
+    """
+    vectors = np.empty((len(ids), corpus.shape[1]), dtype=np.float32)
+    for start in range(0, len(ids), _COPY_BLOCK_SIZE):
+        stop = start + _COPY_BLOCK_SIZE
+        vectors[start:stop] = corpus[ids[start:stop]]
+    return vectors
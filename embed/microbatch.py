@@ -0,0 +1,213 @@
+"""
+Coalescing of concurrent single-text embedding requests into batches.
+
+When many threads each embed one text, each call is a separate round trip to
+the API. ``MicroBatcher`` instead queues the texts, waits briefly for more to
+arrive, and embeds them together in one ``embed_many`` call. Each caller gets
+its own row back, through a future. This trades a few milliseconds of queuing
+for fewer requests, higher throughput, and fewer rate-limit errors under load.
+"""
+
+__all__ = ['MicroBatcher']
+
+import concurrent.futures
+import datetime
+import logging
+import queue
+import threading
+import time
+
+import embed
+
+_STOP = object()
+"""Sentinel put in a batcher's queue to tell its dispatcher thread to stop."""
+
+_logger = logging.getLogger(__name__)
+"""Logger for messages from this submodule (``embed.microbatch``)."""
+
+
+class MicroBatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    Dispatcher that embeds texts from concurrent callers in shared batches.
+
+    A dispatcher thread takes the first queued text, then waits up to
+    ``max_latency`` for others, and embeds up to ``max_batch_size`` of them
+    with ``func``. Up to ``max_workers`` batches are in flight at once. While
+    they are, new texts queue up for the next batch, so batches grow with
+    load. The default of 1 gives the largest batches, but caps throughput at
+    one request at a time. ``func`` defaults to ``embed.embed_many``.
+    To coalesce disk-cached calls, pass a function that caches each text
+    separately, like ``functools.partial(cached.embed_many, per_text=True)``.
+
+    Use ``embed_one`` in place of the single-text function, or ``submit`` to
+    get a ``concurrent.futures.Future``. Close the batcher when done, or use it
+    as a context manager. Texts submitted before closing are still embedded.
+    """
+
+    def __init__(self, func=None, *, max_batch_size=256,
+                 max_latency=datetime.timedelta(milliseconds=5),
+                 max_workers=1):
+        """Create a batcher and start its dispatcher thread."""
+        if max_batch_size < 1:
+            raise ValueError(
+                f'max_batch_size must be positive, got {max_batch_size!r}')
+        if max_latency < datetime.timedelta(0):
+            raise ValueError(
+                f'max_latency must not be negative, got {max_latency!r}')
+        if max_workers < 1:
+            raise ValueError(
+                f'max_workers must be positive, got {max_workers!r}')
+
+        self._func = func
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency.total_seconds()
+        self._max_workers = max_workers
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()  # Held to check or set _closed.
+        self._closed = False
+        self._slots = threading.Semaphore(max_workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='MicroBatcher',
+        )
+        self._thread = threading.Thread(target=self._run,
+                                        name='MicroBatcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (f'{type(self).__name__}({self._func!r}, '
+                f'max_batch_size={self._max_batch_size!r}, '
+                f'max_latency={self.max_latency!r}, '
+                f'max_workers={self._max_workers!r})')
+
+    def __enter__(self):
+        """Use the batcher in a ``with`` statement."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the batcher, after embedding texts already submitted."""
+        self.close()
+
+    @property
+    def max_batch_size(self):
+        """Maximum number of texts embedded in one call."""
+        return self._max_batch_size
+
+    @property
+    def max_latency(self):
+        """Longest time a batch waits for more texts after its first one."""
+        return datetime.timedelta(seconds=self._max_latency)
+
+    @property
+    def max_workers(self):
+        """Maximum number of batches being embedded at once."""
+        return self._max_workers
+
+    def submit(self, text):
+        """Queue a text to be embedded. Return a future of its embedding."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('MicroBatcher is closed')
+            self._queue.put((text, future))
+        return future
+
+    def embed_one(self, text):
+        """Embed a single piece of text, batched with any concurrent ones."""
+        return self.submit(text).result()
+
+    def close(self):
+        """Stop accepting texts. Wait for those submitted to be embedded."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        """Collect batches and start embedding them until told to stop."""
+        batch = []
+        try:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                self._slots.acquire()  # pylint: disable=consider-using-with
+                deadline = time.monotonic() + self._max_latency
+
+                while len(batch) < self._max_batch_size:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        item = (self._queue.get(timeout=timeout)
+                                if timeout > 0
+                                else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                self._executor.submit(self._dispatch, batch)
+                batch = []
+        finally:
+            self._executor.shutdown()
+            self._abandon(batch)
+
+    def _dispatch(self, batch):
+        """Embed a batch, giving each caller that still wants it its row."""
+        try:
+            batch = [(text, future) for text, future in batch
+                     if future.set_running_or_notify_cancel()]
+            if batch:
+                self._embed(batch)
+        finally:
+            self._slots.release()
+
+    def _embed(self, batch):
+        """Embed a batch of running futures' texts, and finish the futures."""
+        texts = [text for text, _ in batch]
+        func = embed.embed_many if self._func is None else self._func
+        _logger.debug('dispatching batch of %d text(s)', len(texts))
+        try:
+            embeddings = func(texts)
+            if len(embeddings) != len(texts):
+                raise ValueError(f'got {len(embeddings)} embeddings'
+                                 f' for {len(texts)} texts')
+        # pylint: disable-next=broad-exception-caught
+        except BaseException as error:
+            for _, future in batch:
+                future.set_exception(error)
+            if not isinstance(error, Exception):
+                raise
+        else:
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def _abandon(self, batch):
+        """
+        Fail texts that will not be embedded, because the dispatcher stopped.
+
+        When the batcher is closed normally, there are none. This ensures no
+        caller waits forever if the dispatcher thread stops for another reason.
+        """
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for item in batch:
+            if item is _STOP:
+                continue
+            _, future = item
+            if future.set_running_or_notify_cancel():
+                future.set_exception(
+                    RuntimeError('MicroBatcher stopped before embedding'))
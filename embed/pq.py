@@ -0,0 +1,270 @@
+"""
+Product quantization, for compressed storage and approximate search.
+
+A float32 embedding from text-embedding-ada-002 takes 6 KiB. Product
+quantization splits each vector into ``subvectors`` equal parts, and, for
+each part, learns a codebook of up to 256 centroids by k-means. A vector is
+then stored as one byte per part: the number of the nearest centroid to that
+part. With 96 parts, the default, an ada-002 embedding takes 96 bytes, a 64x
+reduction; with 192, it takes 192 bytes, a 32x reduction.
+
+Dot products of a query with stored vectors are estimated by asymmetric
+distance computation (ADC): the query is not quantized. Instead, a lookup
+table of the dot products of each part of the query with each centroid for
+that part is computed once, and the estimated dot product with a stored
+vector is the sum of the entries its codes pick out. Estimates are rough, so
+``PQIndex.search`` can rerank: it takes more candidates than it needs by
+estimated score, then rescores them exactly against the float32 rows, which
+may be a memory-mapped cache, so that only the candidates' rows are read.
+"""
+
+__all__ = [
+    'DEFAULT_SUBVECTORS',
+    'DEFAULT_BLOCK_SIZE',
+    'ProductQuantizer',
+    'PQIndex',
+]
+
+import numpy as np
+
+from embed import _kmeans, _reranking, _tensorfile, _topk
+
+DEFAULT_SUBVECTORS = 96
+"""Default number of parts, each stored as a byte, vectors are split into."""
+
+DEFAULT_BLOCK_SIZE = _reranking.DEFAULT_BLOCK_SIZE
+"""Default number of stored vectors encoded or scored at a time."""
+
+_CENTROIDS = 256
+"""Most centroids in each codebook, so each code fits in a byte."""
+
+_QUERY_BLOCK_SIZE = 64
+"""Number of queries whose estimated scores are computed at a time."""
+
+_TRAINING_SIZE = 65536
+"""Default most rows ``ProductQuantizer.train`` samples for k-means."""
+
+_KIND = 'pq'
+"""Kind of index recorded in the metadata of saved files."""
+
+
+class ProductQuantizer:
+    """
+    Codebooks for encoding vectors as bytes, one per part of each vector.
+
+    Quantizers are made by ``train``, or by ``PQIndex.load``.
+    """
+
+    def __init__(self, codebooks):
+        """
+        Create a quantizer from codebooks. Usually ``train`` is used.
+
+        ``codebooks`` has shape ``(subvectors, centroids, width)``, where
+        ``width`` is the number of components in each part.
+        """
+        self._codebooks = codebooks
+
+    @classmethod
+    def train(cls, data, *, subvectors=DEFAULT_SUBVECTORS,
+              training_size=_TRAINING_SIZE,
+              iterations=_kmeans.DEFAULT_ITERATIONS, seed=None):
+        """
+        Learn codebooks for the rows of a matrix of embeddings.
+
+        The dimension must be a multiple of ``subvectors``. k-means is run on
+        a random sample of at most ``training_size`` rows, seeded by ``seed``.
+        """
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[0] == 0:
+            raise ValueError(
+                f'data must be a nonempty matrix, got shape {data.shape}')
+        if subvectors < 1 or data.shape[1] % subvectors:
+            raise ValueError(f'subvectors must divide the dimension'
+                             f' {data.shape[1]}, got {subvectors!r}')
+
+        rng = np.random.default_rng(seed)
+        if training_size < data.shape[0]:
+            sample = np.sort(rng.choice(data.shape[0], size=training_size,
+                                        replace=False))
+            data = data[sample]
+        count = min(_CENTROIDS, data.shape[0])
+
+        parts = data.reshape(data.shape[0], subvectors, -1)
+        return cls(np.stack([
+            _kmeans.kmeans(np.ascontiguousarray(parts[:, part]), count,
+                           iterations=iterations, seed=rng)
+            for part in range(subvectors)
+        ]))
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes."""
+        return (f'<{type(self).__name__} dimension={self.dimension}'
+                f' subvectors={self.subvectors}>')
+
+    @property
+    def codebooks(self):
+        """Centroids, of shape ``(subvectors, centroids, width)``."""
+        return self._codebooks
+
+    @property
+    def subvectors(self):
+        """Number of parts, each encoded as a byte, vectors are split into."""
+        return self._codebooks.shape[0]
+
+    @property
+    def dimension(self):
+        """Number of components in each vector."""
+        return self._codebooks.shape[0] * self._codebooks.shape[2]
+
+    def encode(self, vectors, *, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Encode a vector or the rows of a matrix as bytes.
+
+        This returns a ``uint8`` vector, or matrix with a row per row, of the
+        numbers of the nearest centroids to each part. Rows are read a block
+        at a time, so ``vectors`` can be a large memory-mapped matrix.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1:] != (self.dimension,) or vectors.ndim > 2:
+            raise ValueError(f'vectors of shape {vectors.shape} do not match'
+                             f' dimension {self.dimension}')
+        rows = np.atleast_2d(vectors)
+
+        codes = np.empty((rows.shape[0], self.subvectors), dtype=np.uint8)
+        for start in range(0, rows.shape[0], block_size):
+            parts = np.array(rows[start:start + block_size]).reshape(
+                (-1, self.subvectors, self._codebooks.shape[2]))
+            for part, codebook in enumerate(self._codebooks):
+                labels, _ = _kmeans.assign(parts[:, part], codebook)
+                codes[start:start + block_size, part] = labels
+
+        return codes[0] if vectors.ndim == 1 else codes
+
+    def decode(self, codes):
+        """Approximately reconstruct vectors from their codes."""
+        codes = np.asarray(codes)
+        parts = self._codebooks[np.arange(self.subvectors), codes]
+        return parts.reshape(codes.shape[:-1] + (self.dimension,))
+
+    def lookup_table(self, queries):
+        """
+        Compute ADC lookup tables for a vector or matrix of queries.
+
+        Entry ``[part, code]`` of a query's table is the dot product of that
+        part of the query with that centroid, so the estimated dot product
+        with a stored vector is the sum of the entries its codes select.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        parts = queries.reshape(queries.shape[:-1] + (self.subvectors, -1))
+        return np.einsum('...pw,pcw->...pc', parts, self._codebooks)
+
+
+class PQIndex(_reranking.RerankingIndex):
+    """
+    Product-quantized codes of the rows of a corpus of embeddings.
+
+    Indexes are made by ``build`` or ``load``. Searches return row indices.
+    Without reranking, their scores are dot products estimated by ADC.
+    """
+
+    def __init__(self, quantizer, codes_by_part):
+        """
+        Create an index of codes. Usually ``build`` or ``load`` is used.
+
+        ``codes_by_part`` is the transpose of ``codes``: it has a row per
+        part, so each part's codes are contiguous, for fast lookups.
+        """
+        self._quantizer = quantizer
+        self._codes_by_part = codes_by_part
+
+    @classmethod
+    def build(cls, corpus, *, subvectors=DEFAULT_SUBVECTORS,
+              training_size=_TRAINING_SIZE,
+              iterations=_kmeans.DEFAULT_ITERATIONS, seed=None):
+        """
+        Train a quantizer on a matrix of embeddings and encode all its rows.
+
+        Arguments are as for ``ProductQuantizer.train``.
+        """
+        quantizer = ProductQuantizer.train(
+            corpus, subvectors=subvectors, training_size=training_size,
+            iterations=iterations, seed=seed,
+        )
+        codes = quantizer.encode(corpus)
+        return cls(quantizer, np.ascontiguousarray(codes.T))
+
+    @classmethod
+    def load(cls, path, *, mmap=False):
+        """
+        Load an index saved by ``save``.
+
+        If ``mmap`` is true, the codes are memory-mapped, not read.
+        """
+        arrays, metadata = _tensorfile.load(path, mmap=mmap)
+        if metadata.get('kind') != _KIND:
+            raise ValueError(f'{path} is not a saved PQ index')
+        return cls(ProductQuantizer(arrays['codebooks']),
+                   arrays['codes_by_part'])
+
+    def save(self, path):
+        """Save the index to a safetensors file."""
+        _tensorfile.save(
+            path,
+            {
+                'codebooks': self._quantizer.codebooks,
+                'codes_by_part': self._codes_by_part,
+            },
+            {'kind': _KIND},
+        )
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes."""
+        return (f'<{type(self).__name__} size={len(self)}'
+                f' dimension={self.dimension}'
+                f' subvectors={self._quantizer.subvectors}>')
+
+    def __len__(self):
+        """Number of rows in the index."""
+        return self._codes_by_part.shape[1]
+
+    @property
+    def dimension(self):
+        """Number of components in each row."""
+        return self._quantizer.dimension
+
+    @property
+    def quantizer(self):
+        """The ``ProductQuantizer`` the codes are from."""
+        return self._quantizer
+
+    @property
+    def codes(self):
+        """Codes of the rows, with a ``uint8`` row per row."""
+        return self._codes_by_part.T
+
+    def _scan(self, queries, k, block_size):
+        """Find top-``k`` rows by estimated score, in order."""
+        k = min(k, len(self))
+        tables = self._quantizer.lookup_table(queries)
+        best_indices, best_scores = _topk.empty(queries.shape[0], k)
+
+        for start in range(0, len(self), block_size):
+            codes = self._codes_by_part[:, start:start + block_size]
+            for first in range(0, queries.shape[0], _QUERY_BLOCK_SIZE):
+                chunk = slice(first, first + _QUERY_BLOCK_SIZE)
+                scores = _estimate_scores(tables[chunk], codes)
+                best_indices[chunk], best_scores[chunk] = _topk.merge_block(
+                    (best_indices[chunk], best_scores[chunk]), scores, start,
+                    k,
+                )
+
+        return _topk.finish((best_indices, best_scores))
+
+
+def _estimate_scores(tables, codes_by_part):
+    """Sum lookup table entries for codes, giving a row of scores per table."""
+    scores = np.zeros((tables.shape[0], codes_by_part.shape[1]),
+                      dtype=np.float32)
+    for part, codes in enumerate(codes_by_part):
+        scores += tables[:, part].take(codes, axis=1)
+    return scores
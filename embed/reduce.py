@@ -0,0 +1,256 @@
+"""
+Dimensionality reduction of embeddings, for less memory traffic in searches.
+
+A search scans every component of every row it scores, so rows of 256
+components instead of 1536 take about 6x less memory bandwidth per query. A
+``Reducer`` maps embeddings to fewer components, in one of two ways:
+
+- ``Reducer.pca`` finds the directions along which a sample of embeddings
+  varies most, their principal components, and projects onto the first
+  ``dimension`` of them. The data are not centered first, so these are the
+  directions that best preserve dot products.
+
+- ``Reducer.truncation`` keeps the first ``dimension`` components. This only
+  works well for models trained so that prefixes of their embeddings are
+  themselves embeddings, such as OpenAI's text-embedding-3 models. For
+  text-embedding-ada-002, use PCA.
+
+Reduced vectors are normalized to length 1 again, so their dot products are
+cosine similarities, and they can be searched with ``embed.search`` or any of
+the indexes. Reduction loses information: ``Reducer.recall`` and
+``Reducer.similarity_error`` measure how much, and ``tradeoff`` measures it
+for several dimensions at once, to choose one.
+"""
+
+__all__ = ['DEFAULT_BLOCK_SIZE', 'Reducer', 'tradeoff']
+
+import numpy as np
+
+from embed import _tensorfile, search
+
+DEFAULT_BLOCK_SIZE = 65536
+"""Default number of rows reduced, or used in training, at a time."""
+
+_TRAINING_SIZE = 65536
+"""Default most rows ``Reducer.pca`` samples to find components."""
+
+_KIND = 'reduction'
+"""Kind of reducer recorded in the metadata of saved files."""
+
+
+class Reducer:
+    """
+    A linear map from embeddings to fewer components, with renormalization.
+
+    Reducers are made by ``pca``, ``truncation``, or ``load``.
+    """
+
+    def __init__(self, input_dimension, dimension, components=None):
+        """
+        Create a reducer. Usually ``pca``, ``truncation``, or ``load`` is used.
+
+        ``components`` is a matrix with a row per reduced component, whose
+        dot products with an embedding give its reduced components. If it is
+        ``None``, the reducer truncates instead.
+        """
+        self._input_dimension = input_dimension
+        self._dimension = dimension
+        self._components = components
+
+    @classmethod
+    def pca(cls, data, dimension, *, training_size=_TRAINING_SIZE,
+            block_size=DEFAULT_BLOCK_SIZE, seed=None):
+        """
+        Find the first ``dimension`` principal components of embeddings.
+
+        ``data`` is a matrix of embeddings, which may be large and
+        memory-mapped. A random sample of at most ``training_size`` of its
+        rows, seeded by ``seed``, is used.
+        """
+        if np.ndim(data) != 2 or np.shape(data)[0] == 0:
+            raise ValueError(
+                f'data must be a nonempty matrix, got shape {np.shape(data)}')
+        _check_dimension(dimension, np.shape(data)[1])
+
+        rows = np.arange(np.shape(data)[0])
+        if training_size < rows.size:
+            rows = np.sort(np.random.default_rng(seed).choice(
+                rows, size=training_size, replace=False))
+
+        moments = np.zeros((np.shape(data)[1],) * 2)
+        for start in range(0, rows.size, block_size):
+            block = np.asarray(data[rows[start:start + block_size]],
+                               dtype=np.float64)
+            moments += block.T @ block
+
+        _, vectors = np.linalg.eigh(moments)  # In ascending order.
+        components = vectors[:, :-dimension - 1:-1].T
+        return cls(np.shape(data)[1], dimension,
+                   np.ascontiguousarray(components, dtype=np.float32))
+
+    @classmethod
+    def truncation(cls, input_dimension, dimension):
+        """Make a reducer that keeps the first ``dimension`` components."""
+        _check_dimension(dimension, input_dimension)
+        return cls(input_dimension, dimension)
+
+    @classmethod
+    def load(cls, path):
+        """Load a reducer saved by ``save``."""
+        arrays, metadata = _tensorfile.load(path)
+        if metadata.get('kind') != _KIND:
+            raise ValueError(f'{path} is not a saved reducer')
+        return cls(int(metadata['input_dimension']),
+                   int(metadata['dimension']), arrays.get('components'))
+
+    def save(self, path):
+        """Save the reducer to a safetensors file."""
+        metadata = {
+            'kind': _KIND,
+            'input_dimension': str(self.input_dimension),
+            'dimension': str(self.dimension),
+        }
+        if self._components is None:
+            _tensorfile.save(path, {}, metadata)
+        else:
+            _tensorfile.save(path, {'components': self._components}, metadata)
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes."""
+        method = 'truncation' if self._components is None else 'pca'
+        return (f'<{type(self).__name__} {method}'
+                f' {self.input_dimension} -> {self.dimension}>')
+
+    @property
+    def input_dimension(self):
+        """Number of components in each embedding that is reduced."""
+        return self._input_dimension
+
+    @property
+    def dimension(self):
+        """Number of components in each reduced embedding."""
+        return self._dimension
+
+    @property
+    def components(self):
+        """Matrix of directions projected onto, or ``None`` for truncation."""
+        return self._components
+
+    def reduce(self, vectors, *, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Reduce a vector or the rows of a matrix, normalizing them to length 1.
+
+        Rows are read a block at a time, so ``vectors`` can be a large
+        memory-mapped matrix. Rows that reduce to zero stay zero.
+        """
+        shape = np.shape(vectors)
+        if shape[-1:] != (self.input_dimension,) or len(shape) > 2:
+            raise ValueError(f'vectors of shape {shape} do not match'
+                             f' dimension {self.input_dimension}')
+        if len(shape) == 1:
+            return self._reduce_block(np.asarray(vectors)[np.newaxis])[0]
+
+        reduced = np.empty((shape[0], self.dimension),
+                           dtype=np.float32)
+        for start in range(0, reduced.shape[0], block_size):
+            reduced[start:start + block_size] = self._reduce_block(
+                vectors[start:start + block_size])
+        return reduced
+
+    def recall(self, corpus, queries, k):
+        """
+        Measure the recall of exact search on reduced embeddings.
+
+        This is the mean fraction of each query's exact ``k`` nearest rows,
+        in ``corpus``, that are also the ``k`` nearest when both are reduced,
+        as given by ``embed.search.recall``.
+        """
+        found, _ = search.topk(self.reduce(corpus), self.reduce(queries), k)
+        exact, _ = search.topk(corpus, queries, k)
+        return search.recall(found, exact)
+
+    def similarity_error(self, corpus, queries, *,
+                         block_size=DEFAULT_BLOCK_SIZE):
+        """
+        Measure how much reduction changes the similarities of embeddings.
+
+        This returns the mean and the largest absolute difference between the
+        dot product of each query with each row of ``corpus`` and that of
+        their reductions.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        reduced_queries = self.reduce(queries)
+        total = 0.0
+        largest = 0.0
+
+        for start in range(0, np.shape(corpus)[0], block_size):
+            rows = np.asarray(corpus[start:start + block_size],
+                              dtype=np.float32)
+            errors = np.abs(rows @ queries.T
+                            - self.reduce(rows) @ reduced_queries.T)
+            total += errors.sum(dtype=np.float64)
+            largest = max(largest, float(errors.max(initial=0)))
+
+        count = np.shape(corpus)[0] * queries.shape[0]
+        return (float(total / count) if count else 0.0), largest
+
+    def prefix(self, dimension):
+        """
+        Make a reducer that gives the first ``dimension`` of these outputs.
+
+        The first principal components don't depend on how many are found,
+        so this gives the same components as a new ``pca`` would, but faster.
+        """
+        _check_dimension(dimension, self.dimension)
+        components = self._components
+        if components is not None:
+            components = components[:dimension]
+        return type(self)(self._input_dimension, dimension, components)
+
+    def _reduce_block(self, vectors):
+        """Reduce and normalize the rows of a matrix held in memory."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._components is None:
+            reduced = vectors[:, :self.dimension].copy()
+        else:
+            reduced = vectors @ self._components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        reduced /= norms
+        return reduced
+
+
+# pylint: disable-next=too-many-arguments
+def tradeoff(corpus, queries, k, dimensions, *, truncate=False,
+             training_size=_TRAINING_SIZE, seed=None):
+    """
+    Measure the recall and similarity error of reducing to each dimension.
+
+    This returns a list with a tuple ``(dimension, recall, mean_error,
+    largest_error)`` for each of ``dimensions``, as given by
+    ``Reducer.recall`` and ``Reducer.similarity_error``. If ``truncate`` is
+    true, reducers are made by ``Reducer.truncation``; otherwise, by
+    ``Reducer.pca``, fit once, since the first principal components are the
+    same for every dimension.
+    """
+    input_dimension = np.shape(corpus)[1]
+    if truncate:
+        full = Reducer.truncation(input_dimension, max(dimensions))
+    else:
+        full = Reducer.pca(corpus, max(dimensions),
+                           training_size=training_size, seed=seed)
+
+    results = []
+    for dimension in dimensions:
+        reducer = full.prefix(dimension)
+        mean_error, largest_error = reducer.similarity_error(corpus, queries)
+        results.append((dimension, reducer.recall(corpus, queries, k),
+                        mean_error, largest_error))
+    return results
+
+
+def _check_dimension(dimension, largest):
+    """Check that a reduced dimension is from 1 to ``largest``."""
+    if not 1 <= dimension <= largest:
+        raise ValueError(
+            f'dimension must be from 1 to {largest}, got {dimension!r}')
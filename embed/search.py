@@ -0,0 +1,112 @@
+"""
+Exact nearest-neighbor search over matrices of embeddings.
+
+OpenAI embeddings are normalized to length 1, so the dot product of two of
+them is their cosine similarity, and the most similar rows of a corpus matrix
+to a query vector are those with the highest dot products. ``topk`` finds
+them exactly, for one query or many at once.
+
+Scores are computed a block at a time, as one matrix product per block of
+queries and block of corpus rows, so the work is done by BLAS but the full
+matrix of scores is never held in memory. Each block's best ``k`` scores are
+found with ``np.argpartition``, which takes linear time, and merged into the
+best found so far. Only the final ``k`` per query are sorted.
+
+The corpus can be any float32 matrix, including a memory-mapped one, such as
+the cached results of ``embed.cached.embed_many`` with ``mmap=True``.
+"""
+
+__all__ = ['DEFAULT_BLOCK_SIZE', 'topk', 'recall']
+
+import numpy as np
+
+from embed import _topk
+
+DEFAULT_BLOCK_SIZE = 2048
+"""
+Default number of queries, and of corpus rows, ``topk`` scores at a time.
+
+Each block of scores has up to ``DEFAULT_BLOCK_SIZE ** 2`` float32 entries,
+which is 16 MiB with the default of 2048. Larger blocks use more memory but
+may make slightly better use of BLAS.
+"""
+
+
+def topk(corpus, queries, k, *, block_size=None):
+    """
+    Find the ``k`` rows of ``corpus`` with the highest dot products with each
+    query.
+
+    ``queries`` is a vector, for one query, or a matrix with one query per
+    row. This returns ``(indices, scores)``: the indices into ``corpus`` of
+    the best matches, and their dot products, in order from best to worst.
+    For a single query, each is a vector of length ``k``. For a matrix of
+    queries, each is a matrix with one row per query. If ``corpus`` has fewer
+    than ``k`` rows, all of them are returned. Among equal scores, which rows
+    are returned is unspecified.
+
+    ``block_size`` defaults to ``DEFAULT_BLOCK_SIZE``.
+    """
+    corpus = np.asarray(corpus, dtype=np.float32)
+    if corpus.ndim != 2:
+        raise ValueError(f'corpus must be a matrix, got shape {corpus.shape}')
+    queries, single = _topk.as_queries(queries, corpus.shape[1], k)
+    if block_size is None:
+        block_size = DEFAULT_BLOCK_SIZE
+    elif block_size < 1:
+        raise ValueError(f'block_size must be positive, got {block_size!r}')
+
+    indices, scores = _topk_blocked(corpus, queries, k, block_size)
+    if single:
+        return indices[0], scores[0]
+    return indices, scores
+
+
+def recall(found, exact):
+    """
+    Compute the fraction of exact nearest neighbors that a search found.
+
+    ``found`` and ``exact`` are indices of neighbors, as given by ``topk`` or
+    by an approximate search: vectors for one query, or matrices with one row
+    per query. This returns the mean, over queries, of the fraction of each
+    query's indices in ``exact`` that also appear in ``found``.
+    """
+    found = np.atleast_2d(found)
+    exact = np.atleast_2d(exact)
+    if found.shape[0] != exact.shape[0]:
+        raise ValueError(f'found has {found.shape[0]} queries,'
+                         f' but exact has {exact.shape[0]}')
+    if exact.shape[1] == 0:
+        return 1.0
+
+    hits = (exact[:, :, np.newaxis] == found[:, np.newaxis, :]).any(axis=2)
+    return float(hits.mean())
+
+
+def _topk_blocked(corpus, queries, k, block_size):
+    """Find top-``k`` rows of ``corpus`` for a matrix of ``queries``."""
+    k = min(k, corpus.shape[0])
+    indices = np.empty((queries.shape[0], k), dtype=np.intp)
+    scores = np.empty((queries.shape[0], k), dtype=np.float32)
+
+    for start in range(0, queries.shape[0], block_size):
+        stop = start + block_size
+        indices[start:stop], scores[start:stop] = _topk_block(
+            corpus, queries[start:stop], k, block_size,
+        )
+
+    return indices, scores
+
+
+def _topk_block(corpus, queries, k, block_size):
+    """Find top-``k`` rows of ``corpus``, in order, for a block of queries."""
+    best = _topk.empty(queries.shape[0], 0)
+
+    for start in range(0, corpus.shape[0], block_size):
+        scores = queries @ corpus[start:start + block_size].T
+        columns = _topk.select(scores, k)
+        candidates = (columns + start,
+                      np.take_along_axis(scores, columns, axis=1))
+        best = _topk.merge(best, candidates, k)
+
+    return _topk.finish(best)
@@ -0,0 +1,207 @@
+"""
+Exact nearest-neighbor search split across worker processes.
+
+``embed.search.topk`` runs in one process, where BLAS may leave cores idle,
+especially for small batches of queries. A ``ShardedSearcher`` splits the
+rows of a corpus into one shard per worker process, sends each search's
+queries to every worker, and merges each shard's top ``k`` into the overall
+top ``k``. Results are the same as from ``embed.search.topk``.
+
+Workers don't receive copies of the corpus. If it is memory-mapped from a
+file, such as the cached results of ``embed.cached.embed_many`` with
+``mmap=True``, each worker maps its shard's range of the same file.
+Otherwise, the corpus is written once to a temporary file that the workers
+map. Either way, its rows are in memory once, in the OS page cache. Each
+shard always goes to the same worker, which maps only that shard, so its
+pages stay in that worker's page tables and its CPU's caches.
+
+Each worker's BLAS library may also use multiple threads. To give each worker
+a core, limit BLAS to one thread, such as by setting ``OMP_NUM_THREADS=1``
+(or ``OPENBLAS_NUM_THREADS=1`` or ``MKL_NUM_THREADS=1``) before starting.
+"""
+
+__all__ = ['ShardedSearcher']
+
+import concurrent.futures
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+from embed import _topk, search
+
+_DTYPE = np.dtype('<f4')
+"""Type of the elements of the corpus, as mapped by workers."""
+
+_COPY_BLOCK_SIZE = 65536
+"""Number of rows written at a time when a corpus is copied to a file."""
+
+_worker_state = {}
+"""
+In a worker process, its memory-mapped shard, under the key ``shard``, and the
+index in the whole corpus of the shard's first row, under the key ``start``.
+"""
+
+
+class ShardedSearcher:
+    """
+    Worker processes that search shards of a corpus of embeddings.
+
+    This is a context manager. Leaving the ``with`` block, or calling
+    ``close``, stops the workers and removes any temporary file. If neither
+    is done, that happens when the searcher is garbage collected, or at exit.
+    """
+
+    def __init__(self, corpus, *, max_workers=None, block_size=None):
+        """
+        Start workers to search the rows of a float32 matrix of embeddings.
+
+        ``max_workers`` is the number of shards and worker processes. It
+        defaults to the number of CPUs. ``block_size`` is passed to each
+        worker's ``embed.search.topk``.
+        """
+        if np.ndim(corpus) != 2:
+            raise ValueError(
+                f'corpus must be a matrix, got shape {np.shape(corpus)}')
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        elif max_workers < 1:
+            raise ValueError(
+                f'max_workers must be positive, got {max_workers!r}')
+
+        self._shape = np.shape(corpus)
+        self._block_size = block_size
+        self._temporary_dir = None
+
+        source = _mapped_file(corpus)
+        if source is None:
+            self._temporary_dir = Path(tempfile.mkdtemp(prefix='embed-'))
+            source = _write_file(corpus, self._temporary_dir / 'corpus')
+
+        bounds = np.linspace(0, self._shape[0],
+                             min(max_workers, max(self._shape[0], 1)) + 1)
+        self._starts = bounds.round().astype(int)
+        self._executors = [
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_attach,
+                initargs=(*source, self._shape[1], start, stop),
+            )
+            for start, stop in zip(self._starts[:-1], self._starts[1:])
+        ]
+        self._finalizer = weakref.finalize(self, _clean_up, self._executors,
+                                           self._temporary_dir)
+
+    def __enter__(self):
+        """Use the searcher in a ``with`` block, closing it at the end."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the searcher when leaving the ``with`` block."""
+        self.close()
+
+    def __repr__(self):
+        """Representation for debugging, showing sizes."""
+        return (f'<{type(self).__name__} size={len(self)}'
+                f' dimension={self.dimension} shards={self.shards}>')
+
+    def __len__(self):
+        """Number of rows in the corpus."""
+        return self._shape[0]
+
+    @property
+    def dimension(self):
+        """Number of components in each row."""
+        return self._shape[1]
+
+    @property
+    def shards(self):
+        """Number of shards, each searched by its own worker."""
+        return len(self._starts) - 1
+
+    def close(self):
+        """Stop the workers and remove any temporary copy of the corpus."""
+        self._finalizer()
+
+    def search(self, queries, k):
+        """
+        Find the ``k`` rows with the highest dot products with each query.
+
+        This takes and returns the same forms as ``embed.search.topk``.
+        """
+        queries, single = _topk.as_queries(queries, self.dimension, k)
+        futures = [
+            executor.submit(_search_shard, queries, k, self._block_size)
+            for executor in self._executors
+        ]
+
+        best = _topk.empty(queries.shape[0], 0)
+        for future in futures:
+            best = _topk.merge(best, future.result(), min(k, len(self)))
+        indices, scores = _topk.finish(best)
+
+        if single:
+            return indices[0], scores[0]
+        return indices, scores
+
+
+def _mapped_file(array):
+    """
+    Find the file a matrix is memory-mapped from, and where it starts.
+
+    This returns ``(path, offset)``, or ``None`` if the matrix isn't a
+    contiguous float32 view of an ``np.memmap``.
+    """
+    if not isinstance(array, np.ndarray) or array.dtype != _DTYPE:
+        return None
+    if not array.flags.c_contiguous:
+        return None
+
+    mapped = array
+    while isinstance(mapped.base, np.ndarray):  # Find the one that maps.
+        mapped = mapped.base
+    if not isinstance(mapped, np.memmap) or mapped.filename is None:
+        return None
+
+    offset = mapped.offset + (array.ctypes.data - mapped.ctypes.data)
+    return mapped.filename, offset
+
+
+def _write_file(corpus, path):
+    """Write a matrix to a file of float32 rows. Give ``(path, offset)``."""
+    with open(path, mode='wb') as file:
+        for start in range(0, np.shape(corpus)[0], _COPY_BLOCK_SIZE):
+            block = corpus[start:start + _COPY_BLOCK_SIZE]
+            file.write(np.ascontiguousarray(block, dtype=_DTYPE).data)
+    return path, 0
+
+
+def _clean_up(executors, temporary_dir):
+    """Stop workers, and remove the temporary directory, if there is one."""
+    for executor in executors:
+        executor.shutdown()
+    if temporary_dir is not None:
+        shutil.rmtree(temporary_dir)
+
+
+def _attach(path, offset, dimension, start, stop):
+    """Memory-map rows ``start:stop`` of the corpus in a worker process."""
+    shape = (stop - start, dimension)
+    if shape[0] == 0:  # Empty ranges can't be mapped.
+        shard = np.empty(shape, dtype=_DTYPE)
+    else:
+        shard = np.memmap(path, dtype=_DTYPE, mode='r',
+                          offset=offset + start * dimension * _DTYPE.itemsize,
+                          shape=shape)
+    _worker_state['shard'] = shard
+    _worker_state['start'] = start
+
+
+def _search_shard(queries, k, block_size):
+    """Find top-``k`` rows in a worker's shard, indexed in the whole corpus."""
+    indices, scores = search.topk(_worker_state['shard'], queries, k,
+                                  block_size=block_size)
+    return indices + _worker_state['start'], scores
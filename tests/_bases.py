@@ -10,6 +10,7 @@ import numpy as np
 from parameterized import parameterized
 
 import embed
+from embed import _tensorfile, search
 from tests import _helpers
 
 
@@ -78,6 +79,91 @@ class TestDiskCachedBase(TestEmbedBase):
         """File type (in file-extension form) to save and load embeddings."""
 
 
+class TestRerankingIndexBase(TestBase, ABC):
+    """Tests shared by compressed indexes that can rerank exactly."""
+
+    def setUp(self):
+        """Make a corpus, queries, and an index of the corpus."""
+        super().setUp()
+        self.corpus, self.queries = self.make_rows()
+        self.index = self.build(self.corpus)
+
+    @property
+    @abstractmethod
+    def index_class(self):
+        """Class of the index being tested, to load saved indexes."""
+
+    @abstractmethod
+    def make_rows(self):
+        """Make a matrix of embeddings to index, and one of queries."""
+
+    @abstractmethod
+    def build(self, corpus):
+        """Build an index of a matrix of embeddings."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_rerank_raises_recall(self):
+        plain = self.index.recall(self.queries, 10, corpus=self.corpus)
+        reranked = self.index.recall(self.queries, 10, corpus=self.corpus,
+                                     rerank=100)
+        self.assertGreater(reranked, plain)
+
+    def test_rerank_gives_exact_scores(self):
+        indices, scores = self.index.search(self.queries, 10, rerank=50,
+                                            corpus=self.corpus)
+        expected = np.einsum('qd,qkd->qk', self.queries, self.corpus[indices])
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+    def test_rerank_of_all_rows_is_exact_search(self):
+        indices, _ = self.index.search(self.queries, 10,
+                                       rerank=len(self.corpus),
+                                       corpus=self.corpus)
+        exact, _ = search.topk(self.corpus, self.queries, 10)
+        np.testing.assert_array_equal(indices, exact)
+
+    def test_rerank_requires_corpus(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries, 10, rerank=50)
+
+    def test_vector_query_gives_vectors(self):
+        indices, scores = self.index.search(self.queries[0], 5, rerank=20,
+                                            corpus=self.corpus)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (5,))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (5,))
+
+    def test_mismatched_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries[:, :8], 10)
+
+    @parameterized.expand([
+        ('read', False),
+        ('mapped', True),
+    ])
+    def test_loaded_index_gives_same_results(self, _name, mmap):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            loaded = self.index_class.load(path, mmap=mmap)
+            with self.subTest('codes'):
+                np.testing.assert_array_equal(loaded.codes, self.index.codes)
+            with self.subTest('results'):
+                np.testing.assert_array_equal(
+                    loaded.search(self.queries, 10)[0],
+                    self.index.search(self.queries, 10)[0],
+                )
+            del loaded  # Close the file, so it can be deleted on Windows.
+
+    def test_load_rejects_other_files(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            with self.assertRaises(ValueError):
+                self.index_class.load(path)
+
+
 class TestEmbedOneBase(TestEmbedBase):
     """
     Tests of core ``embed.embed_one*`` functionality.
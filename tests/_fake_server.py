@@ -0,0 +1,192 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, for tests.
+
+This serves fake embeddings (from ``_helpers.fake_embed_one``) over HTTP on
+the loopback interface, in a background thread. It accepts the same requests
+as ``https://api.openai.com/v1/embeddings`` and answers in the same format,
+including when base64 encoding is requested, so it works both with code that
+uses ``requests`` or ``aiohttp`` directly and with the ``openai`` library.
+"""
+
+__all__ = ['FakeServer']
+
+import base64
+import http
+import http.server
+import sys
+import threading
+import time
+
+import orjson
+
+from tests import _helpers
+
+
+class FakeServer:  # pylint: disable=too-many-instance-attributes
+    """
+    Fake embeddings server. Use it as a context manager to run and stop it.
+
+    Each request's decoded JSON body and headers are recorded in ``requests``,
+    the most requests ever handled at once is kept in ``peak_concurrency``, and
+    the number of connections accepted is kept in ``connection_count``.
+    Errors can be scripted with ``fail_next``. Extra headers to send with
+    every response, such as ``x-ratelimit-*`` headers, can be put in
+    ``headers``.
+    """
+
+    def __init__(self, *, delay=0.0, headers=None):
+        """Create a server that waits ``delay`` seconds before responding."""
+        self.delay = delay
+        self.headers = dict(headers or {})
+        self.requests = []
+        self.peak_concurrency = 0
+        self.connection_count = 0
+        self._running = 0
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        """Start serving on an ephemeral port in a background thread."""
+        self._server = _Server(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.01},
+                                        name='FakeServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @property
+    def api_base(self):
+        """Base URL, like ``https://api.openai.com/v1`` but for this server."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    @property
+    def url(self):
+        """URL of the fake embeddings endpoint."""
+        return f'{self.api_base}/embeddings'
+
+    @property
+    def inputs(self):
+        """The ``input`` of each request received, in order."""
+        with self._lock:
+            return [body['input'] for body, _ in self.requests]
+
+    def fail_next(self, status, *, headers=None, count=1):
+        """Respond to the next ``count`` requests with an error status."""
+        with self._lock:
+            self._failures.extend([(status, headers or {})] * count)
+
+    def _make_handler(self):
+        """Make a request handler class that reports to this server object."""
+        fake_server = self
+
+        # pylint: disable=protected-access  # The handler is part of this.
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Handler for requests to the fake embeddings endpoint."""
+
+            protocol_version = 'HTTP/1.1'  # Support keep-alive.
+            disable_nagle_algorithm = True  # Don't delay kept-alive replies.
+
+            def setup(self):
+                """Record a new connection."""
+                super().setup()
+                fake_server._connect()
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Respond to a POST request with fake embeddings."""
+                length = int(self.headers['Content-Length'])
+                body = orjson.loads(self.rfile.read(length))
+                status, headers = fake_server._begin(body, self.headers)
+                try:
+                    time.sleep(fake_server.delay)
+                finally:
+                    fake_server._end()
+
+                if status == http.HTTPStatus.OK:
+                    payload = _make_payload(body)
+                else:
+                    payload = orjson.dumps({'error': {'message': 'fake'}})
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            # pylint: disable-next=redefined-builtin
+            def log_message(self, format, *args):
+                """Don't log each request to standard error."""
+
+        return Handler
+
+    def _connect(self):
+        """Record that a connection was accepted."""
+        with self._lock:
+            self.connection_count += 1
+
+    def _begin(self, body, headers):
+        """Record a request. Return the status and extra headers to send."""
+        with self._lock:
+            self.requests.append((body, dict(headers)))
+            self._running += 1
+            self.peak_concurrency = max(self.peak_concurrency, self._running)
+            if self._failures:
+                status, headers = self._failures.pop(0)
+                return status, {**self.headers, **headers}
+            return http.HTTPStatus.OK, dict(self.headers)
+
+    def _end(self):
+        """Record that a request is no longer being handled."""
+        with self._lock:
+            self._running -= 1
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    """HTTP server that is quiet about clients disconnecting early."""
+
+    def handle_error(self, request, client_address):
+        """Report an error, unless a client gave up on its response."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _make_payload(body):
+    """
+    Make the serialized JSON response to a request for embeddings.
+
+    The model is not always in the body, since ``embeddings_utils`` functions
+    give it as an engine, which the OpenAI library puts in the URL path.
+    """
+    texts = body['input']
+    if isinstance(texts, str):
+        texts = [texts]
+    tokens = sum(len(text.split()) for text in texts)
+
+    embeddings = _helpers.fake_embed_many(texts)
+    if body.get('encoding_format') == 'base64':
+        encoded = [base64.b64encode(row.tobytes()).decode('ascii')
+                   for row in embeddings]
+    else:
+        encoded = embeddings.tolist()
+
+    return orjson.dumps({
+        'object': 'list',
+        'data': [
+            {'object': 'embedding', 'index': index, 'embedding': embedding}
+            for index, embedding in enumerate(encoded)
+        ],
+        'model': body.get('model', 'text-embedding-ada-002'),
+        'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+    })
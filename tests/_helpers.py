@@ -4,6 +4,9 @@ __all__ = [
     'getenv_bool',
     'configure_logging',
     'cache_embeddings_in_memory',
+    'fake_embed_one',
+    'fake_embed_many',
+    'clustered_unit_rows',
 ]
 
 import atexit
@@ -15,6 +18,8 @@ import re
 import unittest.mock
 
 import attrs
+import blake3
+import numpy as np
 
 import embed
 
@@ -149,3 +154,38 @@ functions to equip them with in-memory caching, and a cleanup step that
 unpatches them. The caches live as long as the test runner process, so cached
 embeddings are thus reused across tests.
 """
+
+
+def fake_embed_one(text):
+    """
+    Make a deterministic normalized fake embedding of a text, without the API.
+
+    Equal texts always get equal embeddings, and different texts almost surely
+    get different ones. This is for tests of code that arranges, caches, or
+    dispatches embedding calls, rather than of the embeddings themselves.
+    """
+    seed = int.from_bytes(blake3.blake3(text.encode('utf-8')).digest()[:8],
+                          byteorder='little')
+    vector = np.random.default_rng(seed).standard_normal(embed.DIMENSION)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def fake_embed_many(texts):
+    """Make deterministic fake embeddings. See ``fake_embed_one``."""
+    if not texts:
+        return np.empty((0, embed.DIMENSION), dtype=np.float32)
+    return np.stack([fake_embed_one(text) for text in texts])
+
+
+def clustered_unit_rows(count, dimension=16, *, clusters=20, seed=0):
+    """
+    Make a matrix of float32 rows of length 1, near random cluster centers.
+
+    Like embeddings of real texts, which are used for testing nearest-neighbor
+    indexes, these are unevenly spread, so searches can exploit structure.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension))
+    rows = (centers[rng.integers(clusters, size=count)]
+            + 0.3 * rng.standard_normal((count, dimension))).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+Tests of the asynchronous embedding functions in ``embed.aio``.
+
+These run against ``_fake_server.FakeServer``, a local stand-in for the OpenAI
+embeddings endpoint, so they make no API calls and need no API key.
+"""
+
+import asyncio
+import http
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import aiohttp
+import numpy as np
+import openai
+from parameterized import parameterized
+
+import embed
+from embed import _memory, aio, cached
+from tests import _fake_server, _helpers
+
+_ONE_NAMES = ['embed_one', 'embed_one_eu', 'embed_one_req']
+"""Names of the asynchronous single-text embedding functions."""
+
+_MANY_NAMES = ['embed_many', 'embed_many_eu', 'embed_many_req']
+"""Names of the asynchronous multiple-text embedding functions."""
+
+_TEXTS = ['The cat runs.', 'El gato corre.', 'The dog walks.', 'hola']
+"""Texts to embed in tests of multiple-text embedding functions."""
+
+
+class _TestAioBase(unittest.IsolatedAsyncioTestCase):
+    """Base class for tests of ``embed.aio``, run against a fake server."""
+
+    server_delay = 0.0
+    """How long the fake server waits before responding to each request."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Make sure logging is configured as requested in the environment."""
+        super().setUpClass()
+        _helpers.configure_logging()
+
+    def setUp(self):
+        """Run a fake server and direct all requests to it."""
+        super().setUp()
+
+        self.server = _fake_server.FakeServer(delay=self.server_delay)
+        self.server.__enter__()  # pylint: disable=unnecessary-dunder-call
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+        # pylint: disable=protected-access
+        for patcher in (
+            patch.object(embed, '_EMBEDDINGS_URL', self.server.url),
+            patch.object(embed._keys, 'api_key', 'sk-fake'),
+            patch.object(openai, 'api_base', self.server.api_base),
+            patch.object(openai, 'api_key', 'sk-fake'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestAio(_TestAioBase):
+    """Tests for the ``embed.aio`` functions that don't cache to disk."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_ONE_NAMES)
+    async def test_one_gives_server_embedding(self, name):
+        result = await getattr(aio, name)('The cat runs.')
+        np.testing.assert_array_equal(result,
+                                      _helpers.fake_embed_one('The cat runs.'))
+
+    @parameterized.expand(_ONE_NAMES)
+    async def test_one_returns_float32_vector(self, name):
+        result = await getattr(aio, name)('The cat runs.')
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (embed.DIMENSION,))
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_many_gives_server_embeddings(self, name):
+        result = await getattr(aio, name)(_TEXTS)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(_TEXTS))
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_many_is_split_into_requests(self, name):
+        await getattr(aio, name)(_TEXTS, max_batch_size=3)
+        self.assertEqual(self.server.inputs, [_TEXTS[:3], _TEXTS[3:]])
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_split_result_is_in_input_order(self, name):
+        result = await getattr(aio, name)(_TEXTS, max_batch_size=1,
+                                          max_concurrency=4)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(_TEXTS))
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_empty_input_sends_nothing(self, name):
+        result = await getattr(aio, name)([])
+        with self.subTest('requests'):
+            self.assertEqual(self.server.requests, [])
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_many_sends_duplicates_once(self, name):
+        texts = _TEXTS + _TEXTS[::-1]
+        result = await getattr(aio, name)(texts)
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, [_TEXTS])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(texts))
+
+    async def test_req_sends_api_key(self):
+        await aio.embed_one_req('hola')
+        _, headers = self.server.requests[0]
+        self.assertEqual(headers['Authorization'], 'Bearer sk-fake')
+
+    async def test_req_backs_off_on_rate_limit(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS)
+        result = await aio.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola', 'hola'])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    async def test_req_raises_on_other_error(self):
+        self.server.fail_next(http.HTTPStatus.BAD_REQUEST)
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await aio.embed_one_req('hola')
+
+    @parameterized.expand(['float', 'base64'])
+    async def test_req_decodes_encoding_format(self, encoding_format):
+        result = await aio.embed_many_req(_TEXTS, max_batch_size=3,
+                                          encoding_format=encoding_format)
+        with self.subTest('requested'):
+            self.assertEqual(
+                [body['encoding_format'] for body, _ in self.server.requests],
+                [encoding_format, encoding_format],
+            )
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(_TEXTS))
+
+    async def test_nonpositive_max_concurrency_is_rejected(self):
+        with self.assertRaises(ValueError):
+            await aio.embed_many_req(['a'], max_concurrency=0)
+
+
+class TestAioConcurrency(_TestAioBase):
+    """Tests that ``embed.aio`` functions keep many requests in flight."""
+
+    server_delay = 0.1
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_sequential_by_default(self, name):
+        await getattr(aio, name)(_TEXTS, max_batch_size=1)
+        self.assertEqual(self.server.peak_concurrency, 1)
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_concurrency_reaches_but_stays_within_limit(self, name):
+        texts = [f'text {number}' for number in range(12)]
+        await getattr(aio, name)(texts, max_batch_size=1, max_concurrency=4)
+        self.assertEqual(self.server.peak_concurrency, 4)
+
+    @parameterized.expand(_ONE_NAMES)
+    async def test_separate_calls_overlap(self, name):
+        func = getattr(aio, name)
+        texts = [f'text {number}' for number in range(8)]
+        async with aio.session():
+            results = await asyncio.gather(*(func(text) for text in texts))
+        with self.subTest('concurrency'):
+            self.assertEqual(self.server.peak_concurrency, len(texts))
+        with self.subTest('results'):
+            np.testing.assert_array_equal(np.stack(results),
+                                          _helpers.fake_embed_many(texts))
+
+
+class TestAioCached(_TestAioBase):
+    """Tests for the ``embed.aio.cached`` functions."""
+
+    def setUp(self):
+        """Create a temporary directory. Isolate memory and packed stores."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        temporary_directory = TemporaryDirectory()
+        self.dir_path = Path(temporary_directory.name)
+        self.addCleanup(temporary_directory.cleanup)
+
+        # pylint: disable=protected-access
+        for patcher in (
+            patch.object(cached, 'memory_cache', _memory.MemoryCache()),
+            patch.dict(cached._packed_stores),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_ONE_NAMES)
+    async def test_one_hit_sends_nothing(self, name):
+        func = getattr(aio.cached, name)
+        first = await func('hola', data_dir=self.dir_path)
+        second = await func('hola', data_dir=self.dir_path)
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 1)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(first, second)
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_many_hit_sends_nothing(self, name):
+        func = getattr(aio.cached, name)
+        await func(_TEXTS, data_dir=self.dir_path)
+        result = await func(_TEXTS, data_dir=self.dir_path)
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 1)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(_TEXTS))
+
+    @parameterized.expand(['json', 'safetensors', 'packed'])
+    async def test_shares_cache_with_sync_version(self, file_type):
+        await aio.cached.embed_one_req('hola', data_dir=self.dir_path,
+                                       file_type=file_type)
+        result = cached.embed_one_req('hola', data_dir=self.dir_path,
+                                      file_type=file_type)
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 1)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(_MANY_NAMES)
+    async def test_per_text_sends_only_misses(self, name):
+        func = getattr(aio.cached, name)
+        await func(_TEXTS[:2], data_dir=self.dir_path, per_text=True)
+        result = await func(_TEXTS, data_dir=self.dir_path, per_text=True)
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, [_TEXTS[:2], _TEXTS[2:]])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(_TEXTS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""Tests of all-pairs similarity search with ``embed.allpairs``."""
+
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import allpairs
+from tests import _bases, _helpers
+
+_SETTINGS = [
+    ('one_tile', {}),
+    ('many_tiles', {'memory_limit': 20_000, 'max_workers': 1}),
+    ('many_tiles_threaded', {'memory_limit': 20_000, 'max_workers': 3}),
+]
+"""Names and keyword arguments of the tilings to test."""
+
+
+class TestAllPairs(_bases.TestBase):
+    """Tests for the ``embed.allpairs`` functions."""
+
+    def setUp(self):
+        """Make embeddings and their full matrix of dot products."""
+        super().setUp()
+        self.embeddings = _helpers.clustered_unit_rows(300)
+        self.table = self.embeddings @ self.embeddings.T
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_SETTINGS)
+    def test_topk_gives_best_other_rows(self, _name, kwargs):
+        indices, scores = allpairs.topk(self.embeddings, 5, **kwargs)
+        others = self.table.copy()
+        np.fill_diagonal(others, -np.inf)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(
+                indices, np.argsort(-others, axis=1, kind='stable')[:, :5])
+        with self.subTest('scores'):
+            np.testing.assert_allclose(
+                scores, -np.sort(-others, axis=1)[:, :5], rtol=1e-5)
+
+    def test_topk_never_gives_row_itself(self):
+        indices, _ = allpairs.topk(self.embeddings, 10, memory_limit=20_000)
+        self.assertFalse((indices == np.arange(300)[:, np.newaxis]).any())
+
+    def test_topk_above_count_gives_all_other_rows(self):
+        indices, _ = allpairs.topk(self.embeddings[:4], 10)
+        np.testing.assert_array_equal(np.sort(indices, axis=1),
+                                      [[1, 2, 3], [0, 2, 3],
+                                       [0, 1, 3], [0, 1, 2]])
+
+    def test_topk_of_one_row_is_empty(self):
+        indices, scores = allpairs.topk(self.embeddings[:1], 3)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (1, 0))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (1, 0))
+
+    @parameterized.expand(_SETTINGS)
+    def test_above_gives_each_pair_once_in_order(self, _name, kwargs):
+        rows, columns, scores = allpairs.above(self.embeddings, 0.5, **kwargs)
+        expected_rows, expected_columns = np.nonzero(
+            np.triu(self.table >= 0.5, k=1))
+        with self.subTest('rows'):
+            np.testing.assert_array_equal(rows, expected_rows)
+        with self.subTest('columns'):
+            np.testing.assert_array_equal(columns, expected_columns)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(
+                scores, self.table[expected_rows, expected_columns],
+                rtol=1e-5)
+
+    def test_above_of_no_rows_is_empty(self):
+        rows, columns, scores = allpairs.above(self.embeddings[:0], 0.5)
+        self.assertEqual((rows.size, columns.size, scores.size), (0, 0, 0))
+
+    @parameterized.expand(_SETTINGS)
+    def test_sparse_has_pairs_above_threshold(self, _name, kwargs):
+        matrix = allpairs.sparse(self.embeddings, 0.5, **kwargs)
+        expected = np.where(self.table >= 0.5, self.table, 0)
+        np.fill_diagonal(expected, 0)
+        with self.subTest('shape'):
+            self.assertEqual(matrix.shape, (300, 300))
+        with self.subTest('values'):
+            np.testing.assert_allclose(matrix.toarray(), expected, rtol=1e-5)
+
+    def test_sparse_is_symmetric(self):
+        matrix = allpairs.sparse(self.embeddings, 0.5, memory_limit=20_000)
+        self.assertEqual((matrix != matrix.T).nnz, 0)
+
+    @parameterized.expand([
+        ('memory_limit', {'memory_limit': 0}),
+        ('max_workers', {'max_workers': 0}),
+    ])
+    def test_invalid_setting_is_rejected(self, _name, kwargs):
+        with self.assertRaises(ValueError):
+            allpairs.topk(self.embeddings, 5, **kwargs)
+
+    def test_vector_is_rejected(self):
+        with self.assertRaises(ValueError):
+            allpairs.above(self.embeddings[0], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""
+Tests of splitting ``embed_many*`` inputs into multiple requests.
+
+The functions that embed a single batch are patched with a fake embedder, so
+these test only how texts are split and how the results are stitched together.
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import _batching
+from tests import _bases, _helpers
+
+_NAMES = ['embed_many', 'embed_many_eu', 'embed_many_req']
+"""Names of the non-disk-caching functions that split inputs."""
+
+
+def _fake_embed_batch(texts, **_kwargs):
+    """Fake batch embedder. Ignores options, like ``encoding_format``."""
+    return _helpers.fake_embed_many(texts)
+
+
+class TestEstimateTokens(_bases.TestBase):
+    """Tests for the ``estimate_tokens`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_empty_text_is_zero_tokens(self):
+        self.assertEqual(_batching.estimate_tokens(''), 0)
+
+    def test_estimate_is_at_least_quarter_of_bytes(self):
+        text = 'The quick brown fox jumps over the lazy dog.'
+        self.assertGreaterEqual(_batching.estimate_tokens(text), len(text) / 4)
+
+    def test_non_ascii_counts_bytes(self):
+        self.assertEqual(_batching.estimate_tokens('猫が走る'), 4)
+
+
+class TestSplit(_bases.TestBase):
+    """Tests for the ``split`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_empty_input_gives_no_batches(self):
+        self.assertEqual(_batching.split([], 10, 100), [])
+
+    def test_splits_by_count(self):
+        texts = [str(number) for number in range(7)]
+        batches = _batching.split(texts, 3, 1000)
+        self.assertEqual(batches, [texts[0:3], texts[3:6], texts[6:7]])
+
+    def test_splits_by_tokens(self):
+        texts = ['abc' * 10] * 5  # 10 estimated tokens each.
+        batches = _batching.split(texts, 100, 25)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+    def test_oversized_text_is_alone(self):
+        texts = ['a', 'b' * 300, 'c']
+        batches = _batching.split(texts, 100, 50)
+        self.assertEqual(batches, [['a'], ['b' * 300], ['c']])
+
+    def test_batches_cover_input_in_order(self):
+        texts = [f'text {number}' * (number % 5) for number in range(100)]
+        batches = _batching.split(texts, 7, 40)
+        self.assertEqual(sum(batches, []), texts)
+
+    def test_nonpositive_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            _batching.split(['a'], 0, 100)
+
+
+class TestDedupe(_bases.TestBase):
+    """Tests for the ``dedupe`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_distinct_texts_are_returned_as_is(self):
+        texts = ['a', 'b', 'c']
+        unique, inverse = _batching.dedupe(texts)
+        with self.subTest('unique'):
+            self.assertIs(unique, texts)
+        with self.subTest('inverse'):
+            self.assertIsNone(inverse)
+
+    def test_duplicates_are_removed_in_first_seen_order(self):
+        unique, _ = _batching.dedupe(['b', 'a', 'b', 'c', 'a'])
+        self.assertEqual(unique, ['b', 'a', 'c'])
+
+    def test_inverse_maps_back_to_input(self):
+        texts = ['b', 'a', 'b', 'c', 'a']
+        unique, inverse = _batching.dedupe(texts)
+        self.assertEqual([unique[index] for index in inverse], texts)
+
+
+class TestEmbedManySplitting(_bases.TestBase):
+    """Tests for splitting in the non-disk-caching ``embed_many*``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_NAMES)
+    def test_small_input_is_one_request(self, name):
+        with self._patch_batch(name) as mock:
+            getattr(embed, name)(['a', 'b', 'c'])
+        with self.subTest('calls'):
+            mock.assert_called_once()
+        with self.subTest('texts'):
+            self.assertEqual(mock.call_args.args[0], ['a', 'b', 'c'])
+
+    @parameterized.expand(_NAMES)
+    def test_large_input_is_split(self, name):
+        texts = [f'text {number}' for number in range(10)]
+        with self._patch_batch(name) as mock:
+            getattr(embed, name)(texts, max_batch_size=4)
+        self.assertEqual(
+            [call.args[0] for call in mock.call_args_list],
+            [texts[0:4], texts[4:8], texts[8:10]],
+        )
+
+    @parameterized.expand(_NAMES)
+    def test_split_result_is_in_input_order(self, name):
+        texts = [f'text {number}' for number in range(10)]
+        with self._patch_batch(name):
+            result = getattr(embed, name)(texts, max_batch_tokens=5)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    @parameterized.expand(_NAMES)
+    def test_split_result_is_float32_matrix(self, name):
+        with self._patch_batch(name):
+            result = getattr(embed, name)(['a', 'b', 'c'], max_batch_size=2)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (3, embed.DIMENSION))
+
+    @parameterized.expand(_NAMES)
+    def test_uses_default_max_batch_size(self, name):
+        with patch.object(embed, 'DEFAULT_MAX_BATCH_SIZE', 2):
+            with self._patch_batch(name) as mock:
+                getattr(embed, name)(['a', 'b', 'c'])
+        self.assertEqual(mock.call_count, 2)
+
+    @parameterized.expand(_NAMES)
+    def test_empty_input_sends_nothing(self, name):
+        with self._patch_batch(name) as mock:
+            result = getattr(embed, name)([])
+        with self.subTest('calls'):
+            mock.assert_not_called()
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    @staticmethod
+    def _patch_batch(name):
+        """Patch the function that a ``embed_many*`` uses to embed batches."""
+        return patch.object(embed, f'_{name}_batch',
+                            side_effect=_fake_embed_batch)
+
+
+class TestEmbedManyDedup(_bases.TestBase):
+    """Tests for sending duplicate texts once in non-disk-caching calls."""
+
+    def setUp(self):
+        """Patch ``dedup_stats`` with a new stats object."""
+        super().setUp()
+        self._stats = self.enterContext(
+            patch.object(embed, 'dedup_stats', _batching.DedupStats()),
+        )
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_NAMES)
+    def test_duplicates_are_sent_once(self, name):
+        with self._patch_batch(name) as mock:
+            getattr(embed, name)(['a', 'b', 'a', 'c', 'b'])
+        self.assertEqual(mock.call_args.args[0], ['a', 'b', 'c'])
+
+    @parameterized.expand(_NAMES)
+    def test_duplicates_are_sent_once_across_batches(self, name):
+        texts = [f'text {number % 4}' for number in range(20)]
+        with self._patch_batch(name) as mock:
+            getattr(embed, name)(texts, max_batch_size=3)
+        sent = [text for call in mock.call_args_list for text in call.args[0]]
+        self.assertEqual(sent, texts[:4])
+
+    @parameterized.expand(_NAMES)
+    def test_result_has_row_for_each_input(self, name):
+        texts = ['a', 'b', 'a', 'c', 'b', 'a']
+        with self._patch_batch(name):
+            result = getattr(embed, name)(texts, max_batch_size=2)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    @parameterized.expand(_NAMES)
+    def test_result_rows_for_duplicates_are_independent(self, name):
+        with self._patch_batch(name):
+            result = getattr(embed, name)(['a', 'a'])
+        result[0, 0] += 1
+        self.assertNotEqual(result[0, 0], result[1, 0])
+
+    @parameterized.expand(_NAMES)
+    def test_stats_count_texts_and_collapsed(self, name):
+        with self._patch_batch(name):
+            getattr(embed, name)(['a', 'b', 'a', 'a'])
+            getattr(embed, name)(['a', 'c'])
+        self.assertEqual((self._stats.texts, self._stats.collapsed), (6, 2))
+
+    def test_stats_clear(self):
+        with self._patch_batch('embed_many'):
+            embed.embed_many(['a', 'a'])
+        self._stats.clear()
+        self.assertEqual((self._stats.texts, self._stats.collapsed), (0, 0))
+
+    @staticmethod
+    def _patch_batch(name):
+        """Patch the function that a ``embed_many*`` uses to embed batches."""
+        return patch.object(embed, f'_{name}_batch',
+                            side_effect=_fake_embed_batch)
+
+
+class _ConcurrencyRecorder:
+    """Fake batch embedder that records how many calls overlapped."""
+
+    def __init__(self, delay=0.05):
+        """Create a recorder whose calls each take ``delay`` seconds."""
+        self._delay = delay
+        self._lock = threading.Lock()
+        self._running = 0
+        self.peak = 0
+
+    def __call__(self, texts, **_kwargs):
+        """Embed texts with the fake embedder, after a delay."""
+        with self._lock:
+            self._running += 1
+            self.peak = max(self.peak, self._running)
+        try:
+            time.sleep(self._delay)
+            return _helpers.fake_embed_many(texts)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+class TestEmbedManyConcurrency(_bases.TestBase):
+    """Tests for concurrent dispatch in non-disk-caching ``embed_many*``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_NAMES)
+    def test_sequential_by_default(self, name):
+        recorder = _ConcurrencyRecorder(delay=0.01)
+        with patch.object(embed, f'_{name}_batch', side_effect=recorder):
+            getattr(embed, name)(['a', 'b', 'c', 'd'], max_batch_size=1)
+        self.assertEqual(recorder.peak, 1)
+
+    @parameterized.expand(_NAMES)
+    def test_concurrency_reaches_but_stays_within_limit(self, name):
+        recorder = _ConcurrencyRecorder()
+        texts = [f'text {number}' for number in range(12)]
+        with patch.object(embed, f'_{name}_batch', side_effect=recorder):
+            getattr(embed, name)(texts, max_batch_size=1, max_workers=4)
+        self.assertEqual(recorder.peak, 4)
+
+    @parameterized.expand(_NAMES)
+    def test_concurrent_result_is_in_input_order(self, name):
+        texts = [f'text {number}' for number in range(12)]
+        with patch.object(embed, f'_{name}_batch',
+                          side_effect=_ConcurrencyRecorder(delay=0.001)):
+            result = getattr(embed, name)(texts, max_batch_size=5,
+                                          max_workers=3)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    @parameterized.expand(_NAMES)
+    def test_uses_default_max_workers(self, name):
+        recorder = _ConcurrencyRecorder()
+        with patch.object(embed, 'DEFAULT_MAX_WORKERS', 2):
+            with patch.object(embed, f'_{name}_batch', side_effect=recorder):
+                getattr(embed, name)(['a', 'b', 'c', 'd'], max_batch_size=1)
+        self.assertEqual(recorder.peak, 2)
+
+    @parameterized.expand(_NAMES)
+    def test_error_in_batch_is_raised(self, name):
+        def fail_on_b(texts, **_kwargs):
+            if 'b' in texts:
+                raise RuntimeError('fake failure')
+            return _helpers.fake_embed_many(texts)
+
+        with patch.object(embed, f'_{name}_batch', side_effect=fail_on_b):
+            with self.assertRaisesRegex(RuntimeError, r'\Afake failure\Z'):
+                getattr(embed, name)(['a', 'b', 'c'], max_batch_size=1,
+                                     max_workers=2)
+
+    def test_nonpositive_max_workers_is_rejected(self):
+        with self.assertRaises(ValueError):
+            embed.embed_many(['a'], max_workers=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""Tests of binary quantization with ``embed.binary``."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from embed import binary, search
+from embed.binary import BinaryIndex
+from tests import _bases, _helpers
+
+
+class TestEncode(_bases.TestBase):
+    """Tests for ``encode``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_bits_are_signs_high_first(self):
+        vector = [0.5, -0.1, 0.0, 0.2, -0.3, -0.4, 0.1, 0.9, -0.2]
+        np.testing.assert_array_equal(binary.encode(vector),
+                                      [0b10010011, 0b00000000])
+
+    def test_rows_are_encoded_separately(self):
+        rows = _helpers.clustered_unit_rows(3)
+        np.testing.assert_array_equal(
+            binary.encode(rows),
+            np.stack([binary.encode(row) for row in rows]),
+        )
+
+    def test_codes_are_a_bit_per_component(self):
+        codes = binary.encode(np.ones((5, 1536), dtype=np.float32))
+        with self.subTest('shape'):
+            self.assertEqual(codes.shape, (5, 192))
+        with self.subTest('dtype'):
+            self.assertEqual(codes.dtype, np.uint8)
+
+
+class TestBinaryIndex(_bases.TestRerankingIndexBase):
+    """Tests for ``BinaryIndex``."""
+
+    @property
+    def index_class(self):
+        """``BinaryIndex``, the class being tested."""
+        return BinaryIndex
+
+    def make_rows(self):
+        """Make a clustered corpus, and queries near some of its rows."""
+        corpus = _helpers.clustered_unit_rows(1000, 64)
+        noise = np.random.default_rng(1).standard_normal((50, 64))
+        queries = corpus[::20] + 0.1 * noise.astype(np.float32)
+        return corpus, queries / np.linalg.norm(queries, axis=1,
+                                                keepdims=True)
+
+    def build(self, corpus):
+        """Build an index with the default block size."""
+        return BinaryIndex.build(corpus)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_codes_are_encoded_rows(self):
+        np.testing.assert_array_equal(self.index.codes,
+                                      binary.encode(self.corpus))
+
+    def test_codes_with_partial_word_are_encoded_rows(self):
+        index = BinaryIndex.build(self.corpus[:, :20])
+        np.testing.assert_array_equal(index.codes,
+                                      binary.encode(self.corpus[:, :20]))
+
+    def test_blocks_do_not_change_codes(self):
+        index = BinaryIndex.build(self.corpus, block_size=3)
+        np.testing.assert_array_equal(index.codes, self.index.codes)
+
+    def test_scores_are_sign_agreement(self):
+        indices, scores = self.index.search(self.queries, 10, block_size=64)
+        differing = np.unpackbits(
+            binary.encode(self.queries)[:, np.newaxis]
+            ^ binary.encode(self.corpus)[indices],
+            axis=2,
+        ).sum(axis=2)
+        np.testing.assert_allclose(scores, 1 - differing / 32, rtol=1e-6)
+
+    def test_scan_finds_fewest_differing_bits(self):
+        _, scores = self.index.search(self.queries, 10, block_size=64)
+        signs = np.where(self.corpus > 0, 1, -1)
+        query_signs = np.where(self.queries > 0, 1, -1)
+        _, exact_scores = search.topk(signs / 64, query_signs, 10)
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-6)
+
+    def test_batch_scores_match_single_queries(self):
+        queries = np.concatenate([self.queries] * 3)  # Several query chunks.
+        _, scores = self.index.search(queries, 10, block_size=300)
+        single = [self.index.search(query, 10)[1] for query in queries]
+        np.testing.assert_array_equal(scores, np.stack(single))
+
+    def test_recall_without_rerank_is_moderate(self):
+        self.assertGreater(self.index.recall(self.queries, 10,
+                                             corpus=self.corpus), 0.25)
+
+    def test_rerank_recall_is_high(self):
+        self.assertGreater(self.index.recall(self.queries, 10,
+                                             corpus=self.corpus, rerank=100),
+                           0.9)
+
+    def test_k_above_size_gives_all_rows(self):
+        index = BinaryIndex.build(self.corpus[:5])
+        indices, _ = index.search(self.queries[0], 10)
+        self.assertEqual(sorted(indices), list(range(5)))
+
+    def test_loaded_index_keeps_dimension(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            self.assertEqual(BinaryIndex.load(path).dimension, 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
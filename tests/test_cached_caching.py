@@ -9,6 +9,7 @@ otherwise like the same-named functions residing directly in ``embed``.
 
 from abc import abstractmethod
 import json
+from pathlib import Path
 import unittest
 from unittest.mock import ANY, Mock, patch
 
@@ -128,10 +129,17 @@ class _TestDiskCachedCachingBase(_bases.TestDiskCachedBase):
         listener.assert_any_call(str(self._path), 'r', ANY)
 
     def test_save_confirmed_by_audit_event(self):
-        with subaudit.listening('open', Mock()) as listener:
-            self._call_caching_embedder()
-
-        listener.assert_any_call(str(self._path), 'w', ANY)
+        with subaudit.listening('open', Mock()) as open_listener:
+            with subaudit.listening('os.rename', Mock()) as rename_listener:
+                self._call_caching_embedder()
+
+        # The file is written under a temporary name, then renamed into place.
+        rename_listener.assert_called_once_with(ANY, str(self._path), -1, -1)
+        temporary_path = rename_listener.call_args.args[0]
+        with self.subTest('same directory'):
+            self.assertEqual(Path(temporary_path).parent, self.dir_path)
+        with self.subTest('written'):
+            open_listener.assert_any_call(temporary_path, 'w', ANY)
 
     def test_saved_embedding_exists(self):
         self._call_caching_embedder()
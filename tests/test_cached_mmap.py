@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Tests of memory-mapped cache hits in ``embed.cached.embed*`` functions.
+
+These patch the non-caching embedding functions with a fake embedder, so they
+test only how cached embeddings are loaded.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import cached
+from tests import _bases, _helpers
+
+
+class TestMemoryMappedLoads(_bases.TestBase):
+    """Tests for ``mmap=True`` in the ``embed.cached.embed*`` functions."""
+
+    def setUp(self):
+        """Create a temporary directory and patch in fake embedders."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        # Don't keep packed stores open after their directories are deleted.
+        # pylint: disable-next=protected-access
+        self.enterContext(patch.dict(cached._packed_stores))
+
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_one',
+            side_effect=_helpers.fake_embed_one,
+            __name__='embed_one',
+        ))
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=_helpers.fake_embed_many,
+            __name__='embed_many',
+        ))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['safetensors', 'packed'])
+    def test_hit_is_read_only_view(self, file_type):
+        self._call_many(['hola', 'hello'], file_type)
+        result = self._call_many(['hola', 'hello'], file_type)
+        with self.subTest('read-only'):
+            self.assertFalse(result.flags.writeable)
+        with self.subTest('not owned'):
+            self.assertFalse(result.flags.owndata)
+
+    @parameterized.expand(['safetensors', 'packed'])
+    def test_hit_matrix_equals_saved(self, file_type):
+        texts = ['hola', 'hello']
+        self._call_many(texts, file_type)
+        result = self._call_many(texts, file_type)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('values'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(texts))
+
+    @parameterized.expand(['safetensors', 'packed'])
+    def test_hit_vector_equals_saved(self, file_type):
+        for _ in range(2):
+            result = cached.embed_one('hola', data_dir=self.dir_path,
+                                      file_type=file_type, mmap=True)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    @parameterized.expand(['safetensors', 'packed'])
+    def test_per_text_hit_equals_saved(self, file_type):
+        texts = ['hola', 'hello', 'hola']
+        for _ in range(2):
+            result = self._call_many(texts, file_type, per_text=True)
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    def test_empty_safetensors_hit_is_empty(self):
+        self._call_many([], 'safetensors')
+        result = self._call_many([], 'safetensors')
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    def test_json_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self._call_many(['hola'], 'json')
+
+    def _call_many(self, texts, file_type, **kwargs):
+        """Call the disk caching ``embed_many`` with ``mmap=True``."""
+        return cached.embed_many(texts, data_dir=self.dir_path,
+                                 file_type=file_type, mmap=True, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
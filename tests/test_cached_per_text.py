@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Tests of per-text disk caching in ``embed.cached.embed_many*`` functions.
+
+These patch the non-caching ``embed_many*`` functions with a fake embedder, so
+they test only how texts are looked up, sent, saved, and reassembled.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import cached
+from tests import _bases, _helpers
+
+_CASES = [
+    (f'{name}_{file_type}', name, file_type)
+    for name in ('embed_many', 'embed_many_eu', 'embed_many_req')
+    for file_type in ('json', 'safetensors', 'packed')
+]
+"""Names and file types of each function and format combination to test."""
+
+
+class TestPerTextCaching(_bases.TestBase):
+    """Tests for ``per_text=True`` in the ``embed.cached.embed_many*``."""
+
+    def setUp(self):
+        """Create a temporary directory."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        # Don't keep packed stores open after their directories are deleted.
+        # pylint: disable-next=protected-access
+        self.enterContext(patch.dict(cached._packed_stores))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(_CASES)
+    def test_first_call_sends_all_texts(self, _label, name, file_type):
+        with self._patch_fake(name) as mock:
+            self._call(name, ['a', 'b'], file_type)
+
+        mock.assert_called_once_with(['a', 'b'])
+
+    @parameterized.expand(_CASES)
+    def test_overlapping_call_sends_only_misses(self, _label, name, file_type):
+        with self._patch_fake(name) as mock:
+            self._call(name, ['a', 'b'], file_type)
+            mock.reset_mock()
+            self._call(name, ['b', 'a', 'c'], file_type)
+
+        mock.assert_called_once_with(['c'])
+
+    @parameterized.expand(_CASES)
+    def test_all_cached_sends_nothing(self, _label, name, file_type):
+        with self._patch_fake(name) as mock:
+            self._call(name, ['a', 'b'], file_type)
+            mock.reset_mock()
+            self._call(name, ['b', 'a'], file_type)
+
+        mock.assert_not_called()
+
+    @parameterized.expand(_CASES)
+    def test_duplicates_are_sent_once(self, _label, name, file_type):
+        with self._patch_fake(name) as mock:
+            self._call(name, ['a', 'b', 'a', 'a'], file_type)
+
+        mock.assert_called_once_with(['a', 'b'])
+
+    @parameterized.expand(_CASES)
+    def test_result_is_in_input_order(self, _label, name, file_type):
+        texts = ['b', 'a', 'c', 'a']
+        with self._patch_fake(name):
+            self._call(name, ['a', 'b'], file_type)
+            result = self._call(name, texts, file_type)
+
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(texts))
+
+    @parameterized.expand(_CASES)
+    def test_result_is_float32_matrix(self, _label, name, file_type):
+        with self._patch_fake(name):
+            self._call(name, ['a'], file_type)
+            result = self._call(name, ['a', 'b'], file_type)
+
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (2, embed.DIMENSION))
+
+    @parameterized.expand(_CASES)
+    def test_empty_input_gives_empty_matrix(self, _label, name, file_type):
+        with self._patch_fake(name) as mock:
+            result = self._call(name, [], file_type)
+
+        with self.subTest('not called'):
+            mock.assert_not_called()
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    @parameterized.expand(['json', 'safetensors', 'packed'])
+    def test_shares_entries_with_embed_one(self, file_type):
+        with patch(f'{embed.__name__}.embed_one',
+                   side_effect=_helpers.fake_embed_one,
+                   __name__='embed_one'):
+            cached.embed_one('hola', data_dir=self.dir_path,
+                             file_type=file_type)
+
+        with self._patch_fake('embed_many') as mock:
+            self._call('embed_many', ['hola'], file_type)
+
+        mock.assert_not_called()
+
+    def _patch_fake(self, name):
+        """Patch an ``embed.embed_many*`` function with a fake embedder."""
+        return patch(
+            target=f'{embed.__name__}.{name}',
+            side_effect=_helpers.fake_embed_many,
+            __name__=name,
+        )
+
+    def _call(self, name, texts, file_type):
+        """Call a disk caching ``embed_many*`` function in per-text mode."""
+        func = getattr(cached, name)
+        return func(texts, data_dir=self.dir_path, file_type=file_type,
+                    per_text=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+Tests of the rounding ``float16`` and ``int8`` file types in ``embed.cached``.
+
+These patch the non-caching embedding functions with a fake embedder, so they
+test only how embeddings are rounded, saved, and loaded.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import cached
+from tests import _bases, _helpers
+
+_TEXTS = [f'text {number}' for number in range(20)]
+"""Texts whose embeddings are cached in the tests."""
+
+
+class TestRoundingFileTypes(_bases.TestBase):
+    """Tests for ``file_type='float16'`` and ``file_type='int8'``."""
+
+    def setUp(self):
+        """Create a temporary directory and patch in fake embedders."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_one',
+            side_effect=_helpers.fake_embed_one,
+            __name__='embed_one',
+        ))
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=_helpers.fake_embed_many,
+            __name__='embed_many',
+        ))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_hit_equals_miss(self, file_type):
+        miss = self._call_many(_TEXTS, file_type)
+        hit = self._call_many(_TEXTS, file_type)
+        np.testing.assert_array_equal(hit, miss)
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_hit_is_float32_matrix(self, file_type):
+        self._call_many(_TEXTS, file_type)
+        result = self._call_many(_TEXTS, file_type)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (20, embed.DIMENSION))
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_hit_vector_is_float32_vector(self, file_type):
+        for _ in range(2):
+            result = cached.embed_one('hola', data_dir=self.dir_path,
+                                      file_type=file_type)
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('shape'):
+            self.assertEqual(result.shape, (embed.DIMENSION,))
+
+    def test_float16_dot_products_are_within_bound(self):
+        bound = 2**-11 + 2**-25 * np.sqrt(embed.DIMENSION)
+        self.assertLess(self._largest_dot_product_error('float16'), bound)
+
+    def test_int8_dot_products_are_within_bound(self):
+        exact = _helpers.fake_embed_many(_TEXTS)
+        scales = np.abs(exact).max(axis=1) / 127
+        bound = (scales / 2 * np.sqrt(embed.DIMENSION)).min()
+        self.assertLess(self._largest_dot_product_error('int8'), bound)
+
+    @parameterized.expand([
+        ('float16', 'float16', 2),
+        ('int8', 'int8', 4),
+    ])
+    def test_file_is_smaller(self, _name, file_type, ratio):
+        self._call_many(_TEXTS, file_type)
+        self._call_many(_TEXTS, 'safetensors')
+        rounded_size, = (path.stat().st_size
+                         for path in self.dir_path.glob(f'*.{file_type}'))
+        exact_size, = (path.stat().st_size
+                       for path in self.dir_path.glob('*.safetensors'))
+        self.assertLess(rounded_size, exact_size / ratio * 1.1)
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_zero_vector_is_exact(self, file_type):
+        zeros = np.zeros((1, embed.DIMENSION), dtype=np.float32)
+        with patch(f'{embed.__name__}.embed_many', return_value=zeros,
+                   __name__='embed_many'):
+            result = self._call_many(['zero'], file_type)
+        np.testing.assert_array_equal(result, zeros)
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_empty_hit_is_empty(self, file_type):
+        self._call_many([], file_type)
+        result = self._call_many([], file_type)
+        self.assertEqual(result.shape, (0, embed.DIMENSION))
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_per_text_hit_equals_miss(self, file_type):
+        texts = ['hola', 'hello', 'hola']
+        miss = self._call_many(texts, file_type, per_text=True)
+        hit = self._call_many(texts, file_type, per_text=True)
+        np.testing.assert_array_equal(hit, miss)
+
+    @parameterized.expand(['float16', 'int8'])
+    def test_mmap_is_rejected(self, file_type):
+        with self.assertRaises(ValueError):
+            self._call_many(['hola'], file_type, mmap=True)
+
+    def _largest_dot_product_error(self, file_type):
+        """Find the largest error in dot products of loaded embeddings."""
+        self._call_many(_TEXTS, file_type)
+        loaded = self._call_many(_TEXTS, file_type)
+        exact = _helpers.fake_embed_many(_TEXTS)
+        queries = _helpers.fake_embed_many([f'query {n}' for n in range(20)])
+        return np.abs(loaded @ queries.T - exact @ queries.T).max()
+
+    def _call_many(self, texts, file_type, **kwargs):
+        """Call the disk caching ``embed_many``."""
+        return cached.embed_many(texts, data_dir=self.dir_path,
+                                 file_type=file_type, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+Tests of adaptive concurrency limiting, by ``embed.concurrency_controller``.
+
+This tests ``embed._concurrency.ConcurrencyController`` directly, as well as
+its use by the ``requests``-based functions, against a fake server.
+"""
+
+import asyncio
+import http
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import embed
+from embed import _concurrency
+from tests import _bases, _fake_server
+
+
+def _complete(controller, count, *, throttle=False):
+    """Take and free slots one at a time, ``count`` times."""
+    for _ in range(count):
+        with controller.slot() as slot:
+            if throttle:
+                slot.throttle()
+
+
+class TestConcurrencyController(_bases.TestBase):
+    """Tests for ``ConcurrencyController``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_disabled_by_default(self):
+        controller = _concurrency.ConcurrencyController()
+        self.assertFalse(controller.enabled)
+
+    def test_disabled_does_not_limit(self):
+        controller = _concurrency.ConcurrencyController()
+        with controller.slot(), controller.slot(), controller.slot():
+            self.assertEqual(controller.in_flight, 3)
+
+    def test_disabled_does_not_change_limit(self):
+        controller = _concurrency.ConcurrencyController()
+        _complete(controller, 5)
+        self.assertEqual(controller.concurrency, 1)
+
+    def test_starts_at_min_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True,
+                                                        min_limit=3)
+        self.assertEqual(controller.concurrency, 3)
+
+    def test_enabled_limits_in_flight(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        entered = threading.Event()
+
+        def take_slot():
+            with controller.slot():
+                entered.set()
+
+        with controller.slot():
+            thread = threading.Thread(target=take_slot)
+            thread.start()
+            with self.subTest('waits'):
+                self.assertFalse(entered.wait(timeout=0.1))
+        thread.join()
+        with self.subTest('proceeds'):
+            self.assertTrue(entered.is_set())
+
+    def test_raises_by_one_per_success_at_first(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 5)
+        self.assertEqual(controller.concurrency, 6)
+
+    def test_stays_within_max_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True,
+                                                        max_limit=4)
+        _complete(controller, 10)
+        self.assertEqual(controller.concurrency, 4)
+
+    def test_throttle_halves_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 7)
+        _complete(controller, 1, throttle=True)
+        self.assertEqual(controller.concurrency, 4)
+
+    def test_throttle_does_not_go_below_min_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True,
+                                                        min_limit=2)
+        _complete(controller, 3, throttle=True)
+        self.assertEqual(controller.concurrency, 2)
+
+    def test_after_cut_raises_additively(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 7)
+        _complete(controller, 1, throttle=True)  # Limit 4.
+        _complete(controller, 3)
+        self.assertEqual(controller.concurrency, 4)
+
+    def test_requests_started_before_cut_do_not_cut_again(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 7)
+        with controller.slot() as first, controller.slot() as second:
+            first.throttle()
+            second.throttle()
+        self.assertEqual(controller.concurrency, 4)
+
+    def test_throttled_exception_cuts_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 7)
+        with self.assertRaises(RuntimeError):
+            with controller.slot() as slot:
+                slot.throttle()
+                raise RuntimeError('fake throttling')
+        self.assertEqual(controller.concurrency, 4)
+
+    def test_other_exception_frees_slot_without_changing_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        with self.assertRaises(RuntimeError):
+            with controller.slot():
+                raise RuntimeError('fake failure')
+        with self.subTest('in_flight'):
+            self.assertEqual(controller.in_flight, 0)
+        with self.subTest('concurrency'):
+            self.assertEqual(controller.concurrency, 1)
+
+    def test_rising_latency_cuts_limit(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        _complete(controller, 9)  # Limit 10, fast.
+        for _ in range(10):
+            with controller.slot():
+                time.sleep(0.02)
+        self.assertLess(controller.concurrency, 10)
+
+    def test_latency_is_averaged(self):
+        controller = _concurrency.ConcurrencyController()
+        with controller.slot():
+            time.sleep(0.05)
+        self.assertGreaterEqual(controller.latency, 0.05)
+
+    def test_latency_is_none_before_any_request(self):
+        controller = _concurrency.ConcurrencyController()
+        self.assertIsNone(controller.latency)
+
+    def test_throughput_counts_recent_completions(self):
+        controller = _concurrency.ConcurrencyController()
+        _complete(controller, 20)
+        # pylint: disable-next=protected-access
+        window = _concurrency._THROUGHPUT_WINDOW
+        self.assertEqual(controller.throughput, 20 / window)
+
+    def test_invalid_limits_are_rejected(self):
+        with self.subTest('min_limit'):
+            with self.assertRaises(ValueError):
+                _concurrency.ConcurrencyController(min_limit=0)
+        with self.subTest('max_limit'):
+            with self.assertRaises(ValueError):
+                _concurrency.ConcurrencyController(min_limit=4, max_limit=2)
+
+
+class TestConcurrencyControllerAsync(unittest.IsolatedAsyncioTestCase):
+    """Tests for ``ConcurrencyController.slot_async``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    async def test_waits_for_slot_without_blocking_loop(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        order = []
+
+        async def use_slot(name):
+            async with controller.slot_async():
+                order.append(f'{name} start')
+                await asyncio.sleep(0.02)
+                order.append(f'{name} end')
+
+        await asyncio.gather(use_slot('a'), use_slot('b'))
+        self.assertEqual(order, ['a start', 'a end', 'b start', 'b end'])
+
+    async def test_canceled_waiter_does_not_hold_slot(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        async with controller.slot_async():
+            waiter = asyncio.create_task(self._enter(controller))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        self.assertEqual(controller.in_flight, 0)
+
+    async def test_thread_release_wakes_coroutine(self):
+        controller = _concurrency.ConcurrencyController(enabled=True)
+        released = threading.Event()
+
+        def hold_slot():
+            with controller.slot():
+                released.wait()
+
+        thread = threading.Thread(target=hold_slot)
+        thread.start()
+        while controller.in_flight == 0:
+            await asyncio.sleep(0.001)
+        waiter = asyncio.create_task(self._enter(controller))
+        released.set()
+        await asyncio.wait_for(waiter, timeout=5)
+        thread.join()
+        self.assertEqual(controller.in_flight, 0)
+
+    @staticmethod
+    async def _enter(controller):
+        """Take and free a slot."""
+        async with controller.slot_async():
+            pass
+
+
+class TestConcurrencyControllerRequests(_bases.TestBase):
+    """Tests for ``embed.concurrency_controller`` in ``embed_*_req``."""
+
+    def setUp(self):
+        """Run a fake server. Patch the controller, enabling it."""
+        super().setUp()
+
+        self.server = self.enterContext(_fake_server.FakeServer(delay=0.02))
+        self.controller = self.enterContext(patch.object(
+            embed, 'concurrency_controller',
+            _concurrency.ConcurrencyController(enabled=True, max_limit=3),
+        ))
+
+        # pylint: disable=protected-access
+        self.enterContext(patch.object(embed, '_EMBEDDINGS_URL',
+                                       self.server.url))
+        self.enterContext(patch.object(embed._keys, 'api_key', 'sk-fake'))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_limits_concurrency_below_max_workers(self):
+        texts = [f'text {number}' for number in range(24)]
+        embed.embed_many_req(texts, max_batch_size=1, max_workers=8)
+        with self.subTest('peak'):
+            self.assertEqual(self.server.peak_concurrency, 3)
+        with self.subTest('concurrency'):
+            self.assertEqual(self.controller.concurrency, 3)
+
+    def test_rate_limit_response_cuts_limit(self):
+        embed.embed_many_req(['a', 'b', 'c', 'd'], max_batch_size=1)
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS)
+        embed.embed_one_req('e')  # Throttled, then retried successfully.
+        self.assertEqual(self.controller.concurrency, 2)  # int(1.5 + 1/1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+Tests of getting embeddings base64-encoded, in ``embed_*_req`` functions.
+
+These run against ``_fake_server.FakeServer``, a local stand-in for the OpenAI
+embeddings endpoint, so they make no API calls and need no API key.
+"""
+
+import base64
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from tests import _bases, _fake_server, _helpers
+
+_TEXTS = ['The cat runs.', 'El gato corre.', 'The dog walks.', 'hola']
+"""Texts to embed in tests of ``embed_many_req``."""
+
+
+class TestEncodingFormat(_bases.TestBase):
+    """Tests for the ``encoding_format`` of ``embed_one_req``/``many_req``."""
+
+    def setUp(self):
+        """Run a fake server and direct requests to it."""
+        super().setUp()
+
+        self.server = self.enterContext(_fake_server.FakeServer())
+
+        # pylint: disable=protected-access
+        self.enterContext(patch.object(embed, '_EMBEDDINGS_URL',
+                                       self.server.url))
+        self.enterContext(patch.object(embed._keys, 'api_key', 'sk-fake'))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['float', 'base64'])
+    def test_one_gives_server_embedding(self, encoding_format):
+        result = embed.embed_one_req('hola', encoding_format=encoding_format)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+
+    @parameterized.expand(['float', 'base64'])
+    def test_many_gives_server_embeddings(self, encoding_format):
+        result = embed.embed_many_req(_TEXTS, encoding_format=encoding_format)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(_TEXTS))
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+
+    def test_split_base64_result_is_in_input_order(self):
+        result = embed.embed_many_req(_TEXTS, max_batch_size=3,
+                                      encoding_format='base64')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_many(_TEXTS))
+
+    @parameterized.expand(['float', 'base64'])
+    def test_format_is_requested(self, encoding_format):
+        embed.embed_many_req(_TEXTS, encoding_format=encoding_format)
+        body, _ = self.server.requests[0]
+        self.assertEqual(body['encoding_format'], encoding_format)
+
+    def test_float_is_default(self):
+        embed.embed_one_req('hola')
+        body, _ = self.server.requests[0]
+        self.assertEqual(body['encoding_format'], 'float')
+
+    def test_uses_default_encoding_format(self):
+        with patch.object(embed, 'DEFAULT_ENCODING_FORMAT', 'base64'):
+            embed.embed_one_req('hola')
+        body, _ = self.server.requests[0]
+        self.assertEqual(body['encoding_format'], 'base64')
+
+    def test_unsupported_format_is_rejected_before_sending(self):
+        with self.subTest('error'):
+            with self.assertRaises(ValueError):
+                embed.embed_many_req(_TEXTS, encoding_format='float16')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.requests, [])
+
+
+class TestDecodeEmbeddings(_bases.TestBase):
+    """Tests for the ``_decode_embeddings`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_base64_rows_are_placed_by_index(self):
+        expected = _helpers.fake_embed_many(['a', 'b', 'c'])
+        data = [
+            {'index': index,
+             'embedding': base64.b64encode(expected[index].tobytes())}
+            for index in [2, 0, 1]
+        ]
+        # pylint: disable-next=protected-access
+        result = embed._decode_embeddings(data, 'base64')
+        np.testing.assert_array_equal(result, expected)
+
+    def test_base64_and_float_decode_equal(self):
+        expected = _helpers.fake_embed_many(['a', 'b'])
+        float_data = [{'index': index, 'embedding': row.tolist()}
+                      for index, row in enumerate(expected)]
+        base64_data = [{'index': index,
+                        'embedding': base64.b64encode(row.tobytes())}
+                       for index, row in enumerate(expected)]
+        # pylint: disable=protected-access
+        np.testing.assert_array_equal(
+            embed._decode_embeddings(float_data, 'float'),
+            embed._decode_embeddings(base64_data, 'base64'),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
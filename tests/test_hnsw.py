@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""Tests of approximate nearest-neighbor search with ``embed.hnsw``."""
+
+import copy
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import _tensorfile, search
+from embed.hnsw import HNSWIndex
+from tests import _bases, _helpers
+
+
+class TestHNSWIndex(_bases.TestBase):
+    """Tests for ``HNSWIndex``."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Make a corpus, queries, and an index, which is slow to build."""
+        super().setUpClass()
+        cls.corpus = _helpers.clustered_unit_rows(1000)
+        cls.queries = _helpers.clustered_unit_rows(50, seed=1)
+        cls.built = HNSWIndex(m=8, ef_construction=64, ef_search=32, seed=0)
+        cls.built.add(cls.corpus)
+
+    def setUp(self):
+        """Copy the index, so tests can add to it."""
+        super().setUp()
+        self.index = copy.deepcopy(self.built)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_recall_is_high(self):
+        self.assertGreater(self.index.recall(self.queries, 10), 0.95)
+
+    def test_large_ef_search_is_exact_on_small_corpus(self):
+        indices, scores = self.index.search(self.queries, 10, ef_search=1000)
+        exact_indices, exact_scores = search.topk(self.corpus, self.queries,
+                                                  10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, exact_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_scores_are_descending(self):
+        _, scores = self.index.search(self.queries, 10)
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_query_in_corpus_finds_itself(self):
+        indices, _ = self.index.search(self.corpus[567], 1)
+        self.assertEqual(indices[0], 567)
+
+    def test_vector_query_gives_vectors(self):
+        indices, scores = self.index.search(self.queries[0], 5)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (5,))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (5,))
+
+    def test_k_above_size_gives_all_rows(self):
+        index = HNSWIndex(seed=0)
+        index.add(self.corpus[:5])
+        indices, _ = index.search(self.queries[0], 10)
+        self.assertEqual(sorted(indices), list(range(5)))
+
+    def test_add_gives_consecutive_indices(self):
+        with self.subTest('matrix'):
+            np.testing.assert_array_equal(self.index.add(self.queries[:3]),
+                                          [1000, 1001, 1002])
+        with self.subTest('vector'):
+            self.assertEqual(self.index.add(self.queries[3]), 1003)
+
+    def test_added_rows_are_found(self):
+        self.index.add(self.queries)
+        indices, _ = self.index.search(self.queries, 1)
+        np.testing.assert_array_equal(indices[:, 0], np.arange(1000, 1050))
+
+    def test_sizes(self):
+        with self.subTest('len'):
+            self.assertEqual(len(self.index), 1000)
+        with self.subTest('dimension'):
+            self.assertEqual(self.index.dimension, 16)
+
+    def test_empty_index_has_no_dimension(self):
+        self.assertIsNone(HNSWIndex().dimension)
+
+    def test_empty_index_cannot_be_searched(self):
+        with self.assertRaises(ValueError):
+            HNSWIndex().search(self.queries, 1)
+
+    def test_mismatched_dimension_is_rejected(self):
+        with self.subTest('add'):
+            with self.assertRaises(ValueError):
+                self.index.add(self.queries[:, :8])
+        with self.subTest('search'):
+            with self.assertRaises(ValueError):
+                self.index.search(self.queries[:, :8], 1)
+
+    @parameterized.expand([
+        ('m', {'m': 1}),
+        ('ef_construction', {'ef_construction': 0}),
+        ('ef_search', {'ef_search': 0}),
+    ])
+    def test_invalid_setting_is_rejected(self, _name, kwargs):
+        with self.assertRaises(ValueError):
+            HNSWIndex(**kwargs)
+
+    @parameterized.expand([
+        ('read', False),
+        ('mapped', True),
+    ])
+    def test_loaded_index_gives_same_results(self, _name, mmap):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            loaded = HNSWIndex.load(path, mmap=mmap)
+            with self.subTest('settings'):
+                self.assertEqual(
+                    (loaded.m, loaded.ef_construction, loaded.ef_search),
+                    (8, 64, 32),
+                )
+            with self.subTest('results'):
+                np.testing.assert_array_equal(
+                    loaded.search(self.queries, 10)[0],
+                    self.index.search(self.queries, 10)[0],
+                )
+            del loaded  # Close the file, so it can be deleted on Windows.
+
+    def test_loaded_index_accepts_inserts(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            loaded = HNSWIndex.load(path, mmap=True)
+            loaded.add(self.queries)
+            indices, _ = loaded.search(self.queries, 1)
+            del loaded  # Close the file, so it can be deleted on Windows.
+        np.testing.assert_array_equal(indices[:, 0], np.arange(1000, 1050))
+
+    def test_load_rejects_other_files(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            with self.assertRaises(ValueError):
+                HNSWIndex.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Tests of the pooled ``requests`` session used by ``embed_*_req`` functions.
+
+These run against ``_fake_server.FakeServer``, a local stand-in for the OpenAI
+embeddings endpoint, so they make no API calls and need no API key.
+"""
+
+import datetime
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+import requests
+
+import embed
+from embed import _http
+from tests import _bases, _fake_server, _helpers
+
+
+def _seconds(seconds):
+    """Make a ``timedelta`` of the given number of seconds."""
+    return datetime.timedelta(seconds=seconds)
+
+
+class TestPooledSession(_bases.TestBase):
+    """Tests for ``PooledSession``, and its use in ``embed_*_req``."""
+
+    def setUp(self):
+        """Run a fake server. Direct requests to it, in a fresh session."""
+        super().setUp()
+
+        self.server = self.enterContext(_fake_server.FakeServer())
+
+        self.session = _http.PooledSession(pool_size=4,
+                                           connect_timeout=_seconds(5),
+                                           read_timeout=_seconds(5))
+        self.addCleanup(self.session.close)
+
+        # pylint: disable=protected-access
+        self.enterContext(patch.object(embed, '_EMBEDDINGS_URL',
+                                       self.server.url))
+        self.enterContext(patch.object(embed._keys, 'api_key', 'sk-fake'))
+        self.enterContext(patch.object(embed, 'requests_session',
+                                       self.session))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_result_is_server_embedding(self):
+        result = embed.embed_one_req('hola')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    def test_sequential_calls_reuse_connection(self):
+        for text in ['a', 'b', 'c', 'd']:
+            embed.embed_one_req(text)
+        self.assertEqual(self.server.connection_count, 1)
+
+    def test_concurrent_calls_stay_within_pool(self):
+        self.server.delay = 0.05
+        texts = [f'text {number}' for number in range(16)]
+        for _ in range(3):
+            embed.embed_many_req(texts, max_batch_size=1, max_workers=4)
+        self.assertEqual(self.server.connection_count, 4)
+
+    def test_changing_pool_size_reconnects(self):
+        embed.embed_one_req('a')
+        self.session.pool_size = 2
+        embed.embed_one_req('b')
+        self.assertEqual(self.server.connection_count, 2)
+
+    def test_close_reconnects_on_next_use(self):
+        embed.embed_one_req('a')
+        self.session.close()
+        embed.embed_one_req('b')
+        self.assertEqual(self.server.connection_count, 2)
+
+    def test_read_timeout_is_used(self):
+        self.server.delay = 0.5
+        self.session.read_timeout = _seconds(0.05)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            embed.embed_one_req('hola')
+
+    def test_nonpositive_pool_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.session.pool_size = 0
+
+    @parameterized.expand(['connect_timeout', 'read_timeout'])
+    def test_nonpositive_timeout_is_rejected(self, name):
+        with self.assertRaises(ValueError):
+            setattr(self.session, name, _seconds(0))
+
+    @parameterized.expand(['connect_timeout', 'read_timeout'])
+    def test_non_timedelta_timeout_is_rejected(self, name):
+        with self.assertRaises(TypeError):
+            setattr(self.session, name, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
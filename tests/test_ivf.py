@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""Tests of approximate nearest-neighbor search with ``embed.ivf``."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import _tensorfile, ivf, search
+from embed.ivf import IVFIndex
+from tests import _bases, _helpers
+
+
+class TestIVFIndex(_bases.TestBase):
+    """Tests for ``IVFIndex``."""
+
+    def setUp(self):
+        """Make a corpus, queries, and an index."""
+        super().setUp()
+        self.corpus = _helpers.clustered_unit_rows(2000)
+        self.queries = _helpers.clustered_unit_rows(50, seed=1)
+        self.index = IVFIndex.build(self.corpus, nlist=16, nprobe=4, seed=0)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_probing_all_lists_is_exact(self):
+        indices, scores = self.index.search(self.queries, 10, nprobe=16)
+        exact_indices, exact_scores = search.topk(self.corpus, self.queries,
+                                                  10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, exact_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_rows_copied_in_partial_blocks_match_ids(self):
+        with patch.object(ivf, '_COPY_BLOCK_SIZE', 7):
+            index = IVFIndex.build(self.corpus, nlist=16, nprobe=4, seed=0)
+        indices, scores = index.search(self.queries, 10, nprobe=16)
+        exact_indices, exact_scores = search.topk(self.corpus, self.queries,
+                                                  10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, exact_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_recall_is_high_with_default_nprobe(self):
+        self.assertGreater(self.index.recall(self.queries, 10), 0.8)
+
+    def test_recall_does_not_fall_as_nprobe_rises(self):
+        recalls = [self.index.recall(self.queries, 10, nprobe=nprobe)
+                   for nprobe in (1, 2, 4, 8, 16)]
+        with self.subTest('nondecreasing'):
+            self.assertEqual(recalls, sorted(recalls))
+        with self.subTest('exact'):
+            self.assertEqual(recalls[-1], 1.0)
+
+    def test_recall_matches_search_against_corpus(self):
+        indices, _ = self.index.search(self.queries, 10)
+        exact, _ = search.topk(self.corpus, self.queries, 10)
+        self.assertEqual(self.index.recall(self.queries, 10),
+                         search.recall(indices, exact))
+
+    def test_query_in_corpus_finds_itself(self):
+        indices, _ = self.index.search(self.corpus[1234], 1)
+        self.assertEqual(indices[0], 1234)
+
+    def test_vector_query_gives_vectors(self):
+        indices, scores = self.index.search(self.queries[0], 5)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (5,))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (5,))
+
+    def test_too_few_candidates_are_padded(self):
+        index = IVFIndex.build(self.corpus[:40], nlist=8, nprobe=1, seed=0)
+        indices, scores = index.search(self.queries[0], 30)
+        with self.subTest('indices'):
+            self.assertEqual(indices[-1], -1)
+        with self.subTest('scores'):
+            self.assertEqual(scores[-1], -np.inf)
+
+    def test_every_row_is_in_one_list(self):
+        indices, _ = self.index.search(self.queries[:1], len(self.corpus),
+                                       nprobe=16)
+        self.assertEqual(sorted(indices[0]), list(range(len(self.corpus))))
+
+    def test_default_nlist_grows_with_corpus(self):
+        index = IVFIndex.build(self.corpus, iterations=1, seed=0)
+        self.assertEqual(index.nlist, 179)  # round(4 * sqrt(2000))
+
+    def test_sizes(self):
+        with self.subTest('len'):
+            self.assertEqual(len(self.index), 2000)
+        with self.subTest('dimension'):
+            self.assertEqual(self.index.dimension, 16)
+        with self.subTest('nlist'):
+            self.assertEqual(self.index.nlist, 16)
+
+    def test_nonpositive_nprobe_is_rejected(self):
+        with self.subTest('setter'):
+            with self.assertRaises(ValueError):
+                self.index.nprobe = 0
+        with self.subTest('search'):
+            with self.assertRaises(ValueError):
+                self.index.search(self.queries, 10, nprobe=0)
+
+    def test_mismatched_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.index.search(self.queries[:, :8], 10)
+
+    @parameterized.expand([
+        ('read', False),
+        ('mapped', True),
+    ])
+    def test_loaded_index_gives_same_results(self, _name, mmap):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'index.safetensors')
+            self.index.save(path)
+            loaded = IVFIndex.load(path, mmap=mmap)
+            with self.subTest('nprobe'):
+                self.assertEqual(loaded.nprobe, 4)
+            with self.subTest('results'):
+                np.testing.assert_array_equal(
+                    loaded.search(self.queries, 10)[0],
+                    self.index.search(self.queries, 10)[0],
+                )
+            del loaded  # Close the file, so it can be deleted on Windows.
+
+    def test_load_rejects_other_files(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            with self.assertRaises(ValueError):
+                IVFIndex.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
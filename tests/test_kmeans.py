@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Tests of k-means clustering in ``embed._kmeans``."""
+
+import unittest
+
+import numpy as np
+
+from embed import _kmeans
+from tests import _bases
+
+
+def _blobs(*, seed=0):
+    """Make 300 points in three tight, well-separated groups of 100."""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[10, 0, 0], [0, 10, 0], [0, 0, 10]], dtype=np.float32)
+    noise = 0.1 * rng.standard_normal((300, 3)).astype(np.float32)
+    return np.repeat(centers, 100, axis=0) + noise
+
+
+class TestKMeans(_bases.TestBase):
+    """Tests for ``kmeans`` and ``assign``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_finds_separated_clusters(self):
+        data = _blobs()
+        labels, _ = _kmeans.assign(data, _kmeans.kmeans(data, 3, seed=0))
+        groups = {frozenset(np.flatnonzero(labels == label))
+                  for label in range(3)}
+        expected = {frozenset(range(start, start + 100))
+                    for start in (0, 100, 200)}
+        self.assertEqual(groups, expected)
+
+    def test_centroids_are_means(self):
+        data = _blobs()
+        centroids = _kmeans.kmeans(data, 3, seed=0)
+        labels, _ = _kmeans.assign(data, centroids)
+        for label in range(3):
+            with self.subTest(label=label):
+                np.testing.assert_allclose(
+                    centroids[label], data[labels == label].mean(axis=0),
+                    rtol=1e-5,
+                )
+
+    def test_spherical_centroids_have_length_1(self):
+        centroids = _kmeans.kmeans(_blobs(), 3, spherical=True, seed=0)
+        np.testing.assert_allclose(np.linalg.norm(centroids, axis=1), 1.0,
+                                   rtol=1e-6)
+
+    def test_no_cluster_is_left_empty(self):
+        data = np.repeat(_blobs()[::100], [297, 2, 1], axis=0)
+        labels, _ = _kmeans.assign(data, _kmeans.kmeans(data, 3, seed=0))
+        self.assertEqual(len(set(labels)), 3)
+
+    def test_assign_gives_squared_distances(self):
+        data = _blobs()
+        centroids = _kmeans.kmeans(data, 3, seed=0)
+        labels, distances = _kmeans.assign(data, centroids)
+        exact = ((data - centroids[labels]) ** 2).sum(axis=1)
+        np.testing.assert_allclose(distances, exact, rtol=1e-3, atol=1e-2)
+
+    def test_empty_cluster_is_reseeded_at_farthest_point(self):
+        data = np.array([[1, 0], [0, 5], [-10, 0]], dtype=np.float32)
+        centroids = np.array([[0, 0], [100, 100]], dtype=np.float32)
+        labels, distances = _kmeans.assign(data, centroids)
+        # pylint: disable-next=protected-access
+        updated = _kmeans._update(data, labels, distances, 2, False)
+        np.testing.assert_array_equal(updated[1], data[2])
+
+    def test_invalid_count_is_rejected(self):
+        for count in (0, 301):
+            with self.subTest(count=count):
+                with self.assertRaises(ValueError):
+                    _kmeans.kmeans(_blobs(), count)
+
+
+if __name__ == '__main__':
+    unittest.main()
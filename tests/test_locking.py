@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+Tests of cross-process locking and atomic saving in the disk cache.
+
+This tests ``embed._locking.FileLocks`` directly, as well as its use in
+``embed.cached`` and ``embed._packed``, with worker processes sharing a data
+directory. The workers use a fake embedder, so no API calls are made.
+"""
+
+import multiprocessing
+from pathlib import Path
+import sys
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import _locking, _packed, cached
+from tests import _bases, _helpers
+
+_PROCESS_COUNT = 4
+"""Number of worker processes that share a data directory in the tests."""
+
+_CONTEXT = multiprocessing.get_context(
+    'fork' if sys.platform == 'linux' else 'spawn',
+)
+"""
+Multiprocessing context for the workers.
+
+Forking is much faster, since spawned workers must import ``embed`` again. But
+forking is only safe to rely on, for this, on Linux.
+"""
+
+
+def _hold_lock(lock_path, offset, held, release):
+    """In a worker, hold a lock until told to release it."""
+    with _locking.FileLocks(lock_path).hold([offset]):
+        held.set()
+        release.wait()
+
+
+def _embed_in_worker(data_dir, file_type, texts, per_text, log_path):
+    """In a worker, call ``cached.embed_many`` with a slow, logging fake."""
+    def fake_embed_many(texts):
+        with open(log_path, mode='a', encoding='utf-8') as log:
+            log.write(''.join(f'{text}\n' for text in texts))
+        time.sleep(0.2)
+        return _helpers.fake_embed_many(texts)
+
+    with patch.object(embed, 'embed_many', side_effect=fake_embed_many,
+                      __name__='embed_many'):
+        result = cached.embed_many(texts, data_dir=data_dir,
+                                   file_type=file_type, per_text=per_text)
+    return result.tolist()
+
+
+def _put_in_worker(directory, first_key, count):
+    """In a worker, append entries to a packed store."""
+    store = _packed.PackedStore(directory, dimension=8)
+    for key in range(first_key, first_key + count):
+        store.put(key.to_bytes(32, 'big'), np.full(8, key, dtype=np.float32))
+
+
+class _TestLockingBase(_bases.TestBase):
+    """Test fixture providing a temporary directory."""
+
+    def setUp(self):
+        """Create a temporary directory."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+
+class TestFileLocks(_TestLockingBase):
+    """Tests for ``FileLocks``, with locks held by another process."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_waits_for_other_process(self):
+        lock_path = self.dir_path / 'test.lock'
+        self._hold_elsewhere(lock_path, 42, seconds=0.5)
+        start = time.monotonic()
+        with _locking.FileLocks(lock_path).hold([42]):
+            elapsed = time.monotonic() - start
+        self.assertGreater(elapsed, 0.25)
+
+    def test_does_not_wait_for_other_offsets(self):
+        lock_path = self.dir_path / 'test.lock'
+        self._hold_elsewhere(lock_path, 42, seconds=5)
+        start = time.monotonic()
+        with _locking.FileLocks(lock_path).hold([41, 43]):
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 2.5)
+
+    def test_waits_for_other_thread(self):
+        lock_path = self.dir_path / 'test.lock'
+        held = threading.Event()
+        release = threading.Event()
+        thread = threading.Thread(target=_hold_lock,
+                                  args=(lock_path, 42, held, release))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        if not held.wait(timeout=60):
+            self.fail('thread did not take the lock')
+
+        timer = threading.Timer(0.5, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.monotonic()
+        with _locking.FileLocks(lock_path).hold([42]):
+            elapsed = time.monotonic() - start
+        self.assertGreater(elapsed, 0.25)
+
+    def test_dropping_other_object_for_file_keeps_lock(self):
+        lock_path = self.dir_path / 'test.lock'
+        held = _CONTEXT.Event()
+        release = _CONTEXT.Event()
+        release.set()
+        process = _CONTEXT.Process(target=_hold_lock,
+                                   args=(lock_path, 42, held, release))
+
+        with _locking.FileLocks(lock_path).hold([42]):
+            other = _locking.FileLocks(lock_path)
+            with other.hold([43]):
+                pass
+            del other
+            process.start()
+            self.addCleanup(process.join)
+            with self.subTest('held'):
+                self.assertFalse(held.wait(timeout=0.5))
+
+        with self.subTest('released'):
+            self.assertTrue(held.wait(timeout=60))
+
+    def _hold_elsewhere(self, lock_path, offset, seconds):
+        """Have a worker process take a lock, and release it in ``seconds``."""
+        held = _CONTEXT.Event()
+        release = _CONTEXT.Event()
+        process = _CONTEXT.Process(target=_hold_lock,
+                                   args=(lock_path, offset, held, release))
+        process.start()
+        self.addCleanup(process.join)
+        self.addCleanup(release.set)
+
+        if not held.wait(timeout=60):
+            self.fail('worker process did not take the lock')
+
+        timer = threading.Timer(seconds, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+
+class TestCrossProcessCaching(_TestLockingBase):
+    """Tests of ``embed.cached`` in processes sharing a data directory."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['json', 'safetensors', 'packed'])
+    def test_concurrent_misses_call_once(self, file_type):
+        texts = ['hola', 'hello']
+        results = self._run_workers(file_type, [texts] * _PROCESS_COUNT)
+        with self.subTest('sent'):
+            self.assertEqual(self._sent(), texts)
+        with self.subTest('results'):
+            for result in results:
+                np.testing.assert_array_equal(
+                    result,
+                    _helpers.fake_embed_many(texts),
+                )
+
+    @parameterized.expand(['json', 'safetensors', 'packed'])
+    def test_per_text_overlapping_misses_are_sent_once(self, file_type):
+        batches = [['a', 'b', 'c'], ['b', 'c', 'd'], ['c', 'd', 'a'], ['e']]
+        results = self._run_workers(file_type, batches, per_text=True)
+        with self.subTest('sent'):
+            self.assertCountEqual(self._sent(), ['a', 'b', 'c', 'd', 'e'])
+        for texts, result in zip(batches, results):
+            with self.subTest(texts=texts):
+                np.testing.assert_array_equal(
+                    result,
+                    _helpers.fake_embed_many(texts),
+                )
+
+    def _run_workers(self, file_type, batches, per_text=False):
+        """Embed each batch in a separate worker process, all at once."""
+        arguments = [
+            (self.dir_path, file_type, texts, per_text, self._log_path)
+            for texts in batches
+        ]
+        with _CONTEXT.Pool(len(batches)) as pool:
+            return pool.starmap(_embed_in_worker, arguments)
+
+    @property
+    def _log_path(self):
+        """Path of the log of texts that workers sent to the fake embedder."""
+        return self.dir_path / 'sent.log'
+
+    def _sent(self):
+        """Read the texts workers sent to the fake embedder."""
+        return self._log_path.read_text(encoding='utf-8').splitlines()
+
+
+class TestAtomicSave(_TestLockingBase):
+    """Tests that cache files are written in full, then renamed into place."""
+
+    def setUp(self):
+        """Create a temporary directory, and patch the embedder."""
+        super().setUp()
+
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_one',
+            side_effect=_helpers.fake_embed_one,
+            __name__='embed_one',
+        ))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['json', 'safetensors'])
+    def test_leaves_only_lock_and_entry(self, file_type):
+        cached.embed_one('hola', data_dir=self.dir_path, file_type=file_type)
+        # pylint: disable-next=protected-access
+        basename = cached._compute_input_hash('hola')
+        names = sorted(path.name for path in self.dir_path.iterdir())
+        self.assertEqual(names, ['.lock', f'{basename}.{file_type}'])
+
+    @parameterized.expand(['json', 'safetensors'])
+    def test_failed_save_leaves_no_files(self, file_type):
+        with patch.object(cached.os, 'replace',
+                          side_effect=OSError('fake failure')):
+            with self.assertRaises(OSError):
+                cached.embed_one('hola', data_dir=self.dir_path,
+                                 file_type=file_type)
+        names = [path.name for path in self.dir_path.iterdir()]
+        self.assertEqual(names, ['.lock'])
+
+
+class TestPackedCrossProcess(_TestLockingBase):
+    """Tests of ``PackedStore`` with processes appending at once."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_concurrent_appends_are_all_kept(self):
+        count = 20
+        arguments = [(self.dir_path, number * count, count)
+                     for number in range(_PROCESS_COUNT)]
+        with _CONTEXT.Pool(_PROCESS_COUNT) as pool:
+            pool.starmap(_put_in_worker, arguments)
+
+        store = _packed.PackedStore(self.dir_path, dimension=8)
+        self.addCleanup(store.close)
+        for key in range(_PROCESS_COUNT * count):
+            with self.subTest(key=key):
+                np.testing.assert_array_equal(
+                    store.get(key.to_bytes(32, 'big')),
+                    np.full(8, key, dtype=np.float32),
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
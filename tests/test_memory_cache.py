@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""
+Tests of the bounded in-memory tier in front of the ``embed.cached`` cache.
+
+This tests ``embed._memory.MemoryCache`` directly, as well as its use as
+``embed.cached.memory_cache``.
+"""
+
+import concurrent.futures
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import _memory, cached
+from tests import _bases, _helpers
+
+
+def _array(nbytes, fill=0):
+    """Make a float32 array of the given size in bytes."""
+    return np.full(nbytes // 4, fill, dtype=np.float32)
+
+
+class TestMemoryCache(_bases.TestBase):
+    """Tests for ``MemoryCache``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_miss_gives_none(self):
+        cache = _memory.MemoryCache(max_bytes=1024)
+        self.assertIsNone(cache.get('a'))
+
+    def test_hit_gives_equal_array(self):
+        cache = _memory.MemoryCache(max_bytes=1024)
+        cache.put('a', _array(64, fill=3))
+        np.testing.assert_array_equal(cache.get('a'), _array(64, fill=3))
+
+    def test_cached_array_is_read_only(self):
+        cache = _memory.MemoryCache(max_bytes=1024)
+        cache.put('a', _array(64))
+        self.assertFalse(cache.get('a').flags.writeable)
+
+    def test_caller_array_does_not_alias_cached_array(self):
+        cache = _memory.MemoryCache(max_bytes=1024)
+        original = _array(64)
+        cache.put('a', original)
+        original[0] = 42
+        self.assertEqual(cache.get('a')[0], 0)
+
+    def test_counts_hits_and_misses(self):
+        cache = _memory.MemoryCache(max_bytes=1024)
+        cache.get('a')
+        cache.put('a', _array(64))
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_evicts_least_recently_used_to_stay_in_budget(self):
+        cache = _memory.MemoryCache(max_bytes=256)
+        cache.put('a', _array(128))
+        cache.put('b', _array(128))
+        cache.get('a')  # Now 'b' is least recently used.
+        cache.put('c', _array(128))
+        with self.subTest('a'):
+            self.assertIsNotNone(cache.get('a'))
+        with self.subTest('b'):
+            self.assertIsNone(cache.get('b'))
+        with self.subTest('c'):
+            self.assertIsNotNone(cache.get('c'))
+        with self.subTest('current_bytes'):
+            self.assertEqual(cache.current_bytes, 256)
+
+    def test_array_larger_than_budget_is_not_stored(self):
+        cache = _memory.MemoryCache(max_bytes=64)
+        original = _array(128)
+        result = cache.put('a', original)
+        with self.subTest('returned'):
+            self.assertIs(result, original)
+        with self.subTest('stored'):
+            self.assertIsNone(cache.get('a'))
+
+    def test_lowering_budget_evicts(self):
+        cache = _memory.MemoryCache(max_bytes=256)
+        cache.put('a', _array(128))
+        cache.put('b', _array(128))
+        cache.max_bytes = 128
+        with self.subTest('len'):
+            self.assertEqual(len(cache), 1)
+        with self.subTest('current_bytes'):
+            self.assertEqual(cache.current_bytes, 128)
+
+    def test_negative_budget_is_rejected(self):
+        cache = _memory.MemoryCache()
+        with self.assertRaises(ValueError):
+            cache.max_bytes = -1
+
+    def test_disabled_by_default(self):
+        cache = _memory.MemoryCache()
+        cache.put('a', _array(64))
+        with self.subTest('stored'):
+            self.assertIsNone(cache.get('a'))
+        with self.subTest('counted'):
+            self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_concurrent_use_keeps_size_consistent(self):
+        cache = _memory.MemoryCache(max_bytes=64 * 100)
+
+        def work(number):
+            for key in range(number, number + 200):
+                if cache.get(key % 300) is None:
+                    cache.put(key % 300, _array(64, fill=key))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(16)))
+
+        with self.subTest('current_bytes'):
+            self.assertEqual(cache.current_bytes, len(cache) * 64)
+        with self.subTest('budget'):
+            self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+
+class TestCachedMemoryTier(_bases.TestBase):
+    """Tests for ``embed.cached.memory_cache`` in front of the disk cache."""
+
+    def setUp(self):
+        """Create a temporary directory. Patch embedders and memory cache."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        self._cache = self.enterContext(patch.object(
+            cached, 'memory_cache', _memory.MemoryCache(max_bytes=1 << 20),
+        ))
+        self._embed_many = self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=_helpers.fake_embed_many,
+            __name__='embed_many',
+        ))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_hit_does_not_read_disk(self):
+        self._call(['hola', 'hello'])
+        with patch.object(Path, 'read_bytes') as read_bytes:
+            self._call(['hola', 'hello'])
+        read_bytes.assert_not_called()
+
+    def test_hit_equals_computed(self):
+        texts = ['hola', 'hello']
+        self._call(texts)
+        np.testing.assert_array_equal(self._call(texts),
+                                      _helpers.fake_embed_many(texts))
+
+    def test_disk_hit_fills_memory_tier(self):
+        self._call(['hola'])
+        self._cache.clear()
+        self._call(['hola'])
+        self._call(['hola'])
+        self.assertEqual((self._cache.hits, self._cache.misses), (1, 1))
+
+    def test_per_text_uses_memory_tier(self):
+        self._call(['hola', 'hello'], per_text=True)
+        with patch.object(Path, 'read_bytes') as read_bytes:
+            result = self._call(['hello', 'hola'], per_text=True)
+        with self.subTest('read'):
+            read_bytes.assert_not_called()
+        with self.subTest('result'):
+            np.testing.assert_array_equal(
+                result,
+                _helpers.fake_embed_many(['hello', 'hola']),
+            )
+
+    def test_same_relative_data_dir_elsewhere_misses(self):
+        for name in 'first', 'second':
+            (self.dir_path / name / 'data').mkdir(parents=True)
+            self._chdir(self.dir_path / name)
+            cached.embed_many(['hola'], data_dir='data', file_type='json')
+        with self.subTest('computed'):
+            self.assertEqual(self._embed_many.call_count, 2)
+        with self.subTest('saved'):
+            self.assertTrue(any((self.dir_path / 'second' / 'data').iterdir()))
+
+    def test_other_spelling_of_data_dir_hits(self):
+        (self.dir_path / 'data').mkdir()
+        self._chdir(self.dir_path)
+        cached.embed_many(['hola'], data_dir='data', file_type='json')
+        cached.embed_many(['hola'], data_dir=self.dir_path / 'data',
+                          file_type='json')
+        with self.subTest('hits'):
+            self.assertEqual(self._cache.hits, 1)
+        with self.subTest('computed'):
+            self.assertEqual(self._embed_many.call_count, 1)
+
+    def _call(self, texts, **kwargs):
+        """Call the disk caching ``embed_many``, caching as JSON."""
+        return cached.embed_many(texts, data_dir=self.dir_path,
+                                 file_type='json', **kwargs)
+
+    def _chdir(self, path):
+        """Change the current directory, and change it back on cleanup."""
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""Tests of coalescing concurrent single-text requests in ``MicroBatcher``."""
+
+import concurrent.futures
+import datetime
+import functools
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import _memory, cached
+from embed.microbatch import MicroBatcher
+from tests import _bases, _helpers
+
+
+class _BatchRecorder:
+    """Fake ``embed_many`` that records the batches it is called on."""
+
+    def __init__(self, delay=0.0):
+        """Create a recorder whose calls each take ``delay`` seconds."""
+        self._delay = delay
+        self._lock = threading.Lock()
+        self.batches = []
+
+    def __call__(self, texts):
+        """Record and embed texts with the fake embedder, after a delay."""
+        with self._lock:
+            self.batches.append(list(texts))
+        time.sleep(self._delay)
+        return _helpers.fake_embed_many(texts)
+
+
+class TestMicroBatcher(_bases.TestBase):
+    """Tests for ``MicroBatcher``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_gives_caller_its_own_embedding(self):
+        with MicroBatcher(_BatchRecorder()) as batcher:
+            result = batcher.embed_one('hola')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    def test_concurrent_calls_are_coalesced(self):
+        recorder = _BatchRecorder(delay=0.05)
+        texts = [f'text {number}' for number in range(40)]
+        with MicroBatcher(recorder) as batcher:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=40) as ex:
+                results = list(ex.map(batcher.embed_one, texts))
+        with self.subTest('calls'):
+            self.assertLess(len(recorder.batches), len(texts) // 4)
+        with self.subTest('results'):
+            np.testing.assert_array_equal(np.stack(results),
+                                          _helpers.fake_embed_many(texts))
+
+    def test_batches_stay_within_max_batch_size(self):
+        recorder = _BatchRecorder()
+        with MicroBatcher(recorder, max_batch_size=3) as batcher:
+            futures = [batcher.submit(str(number)) for number in range(10)]
+        concurrent.futures.wait(futures)
+        with self.subTest('sizes'):
+            self.assertLessEqual(max(map(len, recorder.batches)), 3)
+        with self.subTest('coverage'):
+            self.assertEqual(sum(recorder.batches, []),
+                             [str(number) for number in range(10)])
+
+    def test_lone_call_waits_at_most_about_max_latency(self):
+        latency = datetime.timedelta(milliseconds=20)
+        with MicroBatcher(_BatchRecorder(), max_latency=latency) as batcher:
+            start = time.monotonic()
+            batcher.embed_one('hola')
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 0.5)
+
+    def test_submitted_before_close_are_embedded(self):
+        recorder = _BatchRecorder(delay=0.01)
+        batcher = MicroBatcher(recorder, max_batch_size=2)
+        futures = [batcher.submit(str(number)) for number in range(7)]
+        batcher.close()
+        with self.subTest('done'):
+            self.assertTrue(all(future.done() for future in futures))
+        with self.subTest('sent'):
+            self.assertEqual(len(sum(recorder.batches, [])), 7)
+
+    def test_submit_after_close_is_rejected(self):
+        batcher = MicroBatcher(_BatchRecorder())
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.submit('hola')
+
+    def test_error_reaches_every_caller_in_batch(self):
+        def fail(texts):
+            raise RuntimeError(f'fake failure on {len(texts)}')
+
+        latency = datetime.timedelta(seconds=1)
+        with MicroBatcher(fail, max_batch_size=2,
+                          max_latency=latency) as batcher:
+            futures = [batcher.submit('a'), batcher.submit('b')]
+            for future in futures:
+                with self.subTest(future=future):
+                    with self.assertRaisesRegex(RuntimeError,
+                                                r'\Afake failure on 2\Z'):
+                        future.result()
+
+    def test_too_few_embeddings_fail_every_caller(self):
+        def drop_last(texts):
+            return _helpers.fake_embed_many(texts)[:-1]
+
+        latency = datetime.timedelta(seconds=1)
+        with MicroBatcher(drop_last, max_batch_size=2,
+                          max_latency=latency) as batcher:
+            futures = [batcher.submit('a'), batcher.submit('b')]
+            for future in futures:
+                with self.subTest(future=future):
+                    with self.assertRaises(ValueError):
+                        future.result(timeout=10)
+
+    def test_base_exception_reaches_caller(self):
+        class FakeInterrupt(BaseException):
+            """Exception that ``except Exception`` doesn't catch."""
+
+        def interrupt(texts):
+            raise FakeInterrupt(texts)
+
+        with MicroBatcher(interrupt) as batcher:
+            with self.subTest('raises'):
+                with self.assertRaises(FakeInterrupt):
+                    batcher.submit('a').result(timeout=10)
+            with self.subTest('still works'):
+                with self.assertRaises(FakeInterrupt):
+                    batcher.submit('b').result(timeout=10)
+
+    def test_max_workers_batches_are_in_flight_at_once(self):
+        recorder = _BatchRecorder(delay=0.5)
+        latency = datetime.timedelta(0)
+        with MicroBatcher(recorder, max_batch_size=1, max_latency=latency,
+                          max_workers=3) as batcher:
+            start = time.monotonic()
+            futures = [batcher.submit(str(number)) for number in range(3)]
+            concurrent.futures.wait(futures)
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.0)
+
+    def test_canceled_text_is_not_sent(self):
+        recorder = _BatchRecorder()
+        latency = datetime.timedelta(milliseconds=100)
+        with MicroBatcher(recorder, max_latency=latency) as batcher:
+            first = batcher.submit('a')
+            second = batcher.submit('b')
+            second.cancel()
+            first.result()
+        self.assertEqual(recorder.batches, [['a']])
+
+    def test_uses_embed_many_by_default(self):
+        recorder = _BatchRecorder()
+        with patch.object(embed, 'embed_many', side_effect=recorder):
+            with MicroBatcher() as batcher:
+                batcher.embed_one('hola')
+        self.assertEqual(recorder.batches, [['hola']])
+
+    def test_nonpositive_max_batch_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MicroBatcher(_BatchRecorder(), max_batch_size=0)
+
+    def test_nonpositive_max_workers_is_rejected(self):
+        with self.assertRaises(ValueError):
+            MicroBatcher(_BatchRecorder(), max_workers=0)
+
+
+class TestMicroBatcherCached(_bases.TestBase):
+    """Tests for ``MicroBatcher`` with the disk caching ``embed_many``."""
+
+    def setUp(self):
+        """Create a temporary directory. Patch the embedder and memory tier."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        self.enterContext(patch.object(cached, 'memory_cache',
+                                       _memory.MemoryCache()))
+        self.recorder = _BatchRecorder()
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=self.recorder,
+            __name__='embed_many',
+        ))
+        self.func = functools.partial(cached.embed_many,
+                                      data_dir=self.dir_path,
+                                      file_type='json', per_text=True)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_shares_cache_with_embed_one(self):
+        with MicroBatcher(self.func) as batcher:
+            batcher.embed_one('hola')
+        cached.embed_one('hola', data_dir=self.dir_path, file_type='json')
+        self.assertEqual(self.recorder.batches, [['hola']])
+
+    def test_cached_texts_are_not_sent(self):
+        latency = datetime.timedelta(milliseconds=100)
+        with MicroBatcher(self.func, max_latency=latency) as batcher:
+            batcher.embed_one('hola')
+            futures = [batcher.submit('hola'), batcher.submit('hello')]
+            concurrent.futures.wait(futures)
+        self.assertEqual(self.recorder.batches, [['hola'], ['hello']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+Tests of the packed append-only embedding store.
+
+This tests ``embed._packed.PackedStore`` directly, as well as its use as the
+``packed`` file type for the disk caching functions in ``embed.cached``.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import embed
+from embed import _packed, cached
+from tests import _bases, _helpers
+
+_DIMENSION = 8
+"""Row width for tests that use ``PackedStore`` directly."""
+
+
+def _key(number):
+    """Make a 32-byte key from a small integer."""
+    return number.to_bytes(length=32, byteorder='big')
+
+
+def _rows(count, start=0):
+    """Make distinct rows, each filled with its own number."""
+    values = np.arange(start, start + count, dtype=np.float32)
+    return np.repeat(values[:, np.newaxis], _DIMENSION, axis=1)
+
+
+class _TestPackedBase(_bases.TestBase):
+    """Test fixture providing a temporary directory."""
+
+    def setUp(self):
+        """Create a temporary directory."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+
+class TestPackedStore(_TestPackedBase):
+    """Tests for ``PackedStore``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def setUp(self):
+        super().setUp()
+        self._store = self._open()
+
+    def test_missing_key_gives_none(self):
+        self.assertIsNone(self._store.get(_key(1)))
+
+    def test_matrix_round_trips(self):
+        self._store.put(_key(1), _rows(3))
+        np.testing.assert_array_equal(self._store.get(_key(1)), _rows(3))
+
+    def test_vector_round_trips_as_vector(self):
+        self._store.put(_key(1), _rows(1)[0])
+        result = self._store.get(_key(1))
+        self.assertEqual(result.shape, (_DIMENSION,))
+
+    def test_empty_matrix_round_trips(self):
+        self._store.put(_key(1), np.empty((0, _DIMENSION), dtype=np.float32))
+        self.assertEqual(self._store.get(_key(1)).shape, (0, _DIMENSION))
+
+    def test_entries_do_not_overlap(self):
+        self._store.put(_key(1), _rows(2, start=0))
+        self._store.put(_key(2), _rows(3, start=10))
+        with self.subTest(key=1):
+            np.testing.assert_array_equal(self._store.get(_key(1)),
+                                          _rows(2, start=0))
+        with self.subTest(key=2):
+            np.testing.assert_array_equal(self._store.get(_key(2)),
+                                          _rows(3, start=10))
+
+    def test_result_is_writable_float32(self):
+        self._store.put(_key(1), _rows(2))
+        result = self._store.get(_key(1))
+        with self.subTest('dtype'):
+            self.assertEqual(result.dtype, np.float32)
+        with self.subTest('writeable'):
+            self.assertTrue(result.flags.writeable)
+
+    def test_key_ending_in_zero_byte_is_found(self):
+        key = b'\xff' * 31 + b'\0'
+        self._store.put(key, _rows(1))
+        np.testing.assert_array_equal(self._store.get(key), _rows(1))
+
+    def test_other_instance_sees_entries(self):
+        self._store.put(_key(1), _rows(2))
+        other = self._open()
+        np.testing.assert_array_equal(other.get(_key(1)), _rows(2))
+
+    def test_sees_entries_appended_by_other_instance_later(self):
+        other = self._open()
+        self.assertIsNone(self._store.get(_key(1)))
+        other.put(_key(1), _rows(2))
+        np.testing.assert_array_equal(self._store.get(_key(1)), _rows(2))
+
+    def test_starts_new_segment_when_full(self):
+        with patch.object(_packed, '_SEGMENT_ROWS', 4):
+            for number in range(5):
+                self._store.put(_key(number), _rows(2, start=number * 2))
+
+        with self.subTest('segments'):
+            names = sorted(path.name
+                           for path in self.dir_path.glob('segment-*'))
+            self.assertEqual(names, [
+                'segment-00000.f32',
+                'segment-00001.f32',
+                'segment-00002.f32',
+            ])
+        for number in range(5):
+            with self.subTest(key=number):
+                np.testing.assert_array_equal(self._store.get(_key(number)),
+                                              _rows(2, start=number * 2))
+
+    def test_lookups_work_after_merge(self):
+        with patch.object(_packed, '_MERGE_THRESHOLD', 3):
+            for number in range(10):
+                self._store.put(_key(number), _rows(1, start=number))
+            for number in range(10):
+                with self.subTest(key=number):
+                    np.testing.assert_array_equal(
+                        self._store.get(_key(number)),
+                        _rows(1, start=number),
+                    )
+
+    def test_torn_trailing_row_is_dropped(self):
+        self._store.put(_key(1), _rows(1))
+        with open(self.dir_path / 'segment-00000.f32', mode='ab') as file:
+            file.write(b'\0' * 5)
+        self._store.put(_key(2), _rows(1, start=2))
+        np.testing.assert_array_equal(self._store.get(_key(2)),
+                                      _rows(1, start=2))
+
+    def test_misses_do_not_reread_unchanged_index(self):
+        self._store.put(_key(1), _rows(1))
+        with patch.object(_packed, 'open', create=True,
+                          side_effect=open) as mock:
+            for number in range(2, 12):
+                self._store.get(_key(number))
+        self.assertEqual(mock.call_count, 0)
+
+    def test_miss_rereads_grown_index(self):
+        self._store.get(_key(1))
+        self._open().put(_key(1), _rows(1))
+        self.assertIsNotNone(self._store.get(_key(1)))
+
+    def test_torn_trailing_record_is_dropped_on_open(self):
+        self._store.put(_key(1), _rows(1, start=1))
+        with open(self.dir_path / 'index.bin', mode='ab') as file:
+            file.write(b'\0' * 5)
+        self._open().put(_key(2), _rows(1, start=2))
+        store = self._open()
+        for number in 1, 2:
+            with self.subTest(number=number):
+                np.testing.assert_array_equal(store.get(_key(number)),
+                                              _rows(1, start=number))
+
+    def test_torn_trailing_record_is_dropped_on_append(self):
+        self._store.put(_key(1), _rows(1))
+        with open(self.dir_path / 'index.bin', mode='ab') as file:
+            file.write(b'\0' * 5)
+        self._store.put(_key(2), _rows(1, start=2))
+        np.testing.assert_array_equal(self._open().get(_key(2)),
+                                      _rows(1, start=2))
+
+    def _open(self):
+        """Open a store in the temporary directory. Close it on cleanup."""
+        store = _packed.PackedStore(directory=self.dir_path,
+                                    dimension=_DIMENSION)
+        self.addCleanup(store.close)
+        return store
+
+
+class TestPackedFileType(_TestPackedBase):
+    """Tests for the ``packed`` file type in ``embed.cached``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def setUp(self):
+        super().setUp()
+        # pylint: disable-next=protected-access
+        self.enterContext(patch.dict(cached._packed_stores))
+
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_one',
+            side_effect=_helpers.fake_embed_one,
+            __name__='embed_one',
+        ))
+        self._embed_many = self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=_helpers.fake_embed_many,
+            __name__='embed_many',
+        ))
+
+    def test_embed_one_saves_then_loads(self):
+        # pylint: disable-next=protected-access
+        basename = cached._compute_input_hash('hola')
+        path = self.dir_path / f'{basename}.packed'
+        messages = []
+        for _ in range(2):
+            with self.assertLogs(logger=cached.__name__) as log_context:
+                result = cached.embed_one('hola', data_dir=self.dir_path,
+                                          file_type='packed')
+            messages.extend(log_context.output)
+
+        with self.subTest('messages'):
+            self.assertEqual(messages, [
+                f'INFO:embed.cached:embed_one: saved: {path}',
+                f'INFO:embed.cached:embed_one: loaded: {path}',
+            ])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    def test_embed_many_loads_same_matrix(self):
+        texts = ['hola', 'hello']
+        for _ in range(2):
+            result = cached.embed_many(texts, data_dir=self.dir_path,
+                                       file_type='packed')
+
+        with self.subTest('calls'):
+            self._embed_many.assert_called_once_with(texts)
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_many(texts))
+
+    def test_writes_no_per_entry_files(self):
+        for text in 'a', 'b', 'c':
+            cached.embed_one(text, data_dir=self.dir_path, file_type='packed')
+
+        names = sorted(path.name for path in self.dir_path.iterdir())
+        self.assertEqual(names, ['.lock', 'packed'])  # One lock file, shared.
+
+
+if __name__ == '__main__':
+    unittest.main()
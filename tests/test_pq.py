@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Tests of product quantization with ``embed.pq``."""
+
+import unittest
+
+import numpy as np
+
+from embed import search
+from embed.pq import PQIndex, ProductQuantizer
+from tests import _bases, _helpers
+
+
+class TestProductQuantizer(_bases.TestBase):
+    """Tests for ``ProductQuantizer``."""
+
+    def setUp(self):
+        """Make a corpus and train a quantizer on it."""
+        super().setUp()
+        self.corpus = _helpers.clustered_unit_rows(1000)
+        self.quantizer = ProductQuantizer.train(self.corpus, subvectors=4,
+                                                seed=0)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_codes_are_a_byte_per_part(self):
+        codes = self.quantizer.encode(self.corpus)
+        with self.subTest('shape'):
+            self.assertEqual(codes.shape, (1000, 4))
+        with self.subTest('dtype'):
+            self.assertEqual(codes.dtype, np.uint8)
+
+    def test_vector_is_encoded_as_vector(self):
+        np.testing.assert_array_equal(self.quantizer.encode(self.corpus[7]),
+                                      self.quantizer.encode(self.corpus)[7])
+
+    def test_blocks_do_not_change_codes(self):
+        np.testing.assert_array_equal(
+            self.quantizer.encode(self.corpus, block_size=3),
+            self.quantizer.encode(self.corpus),
+        )
+
+    def test_decoded_rows_are_close(self):
+        decoded = self.quantizer.decode(self.quantizer.encode(self.corpus))
+        errors = np.linalg.norm(decoded - self.corpus, axis=1)
+        self.assertLess(errors.mean(), 0.3)
+
+    def test_lookup_table_gives_dot_products_with_decoded_rows(self):
+        query = _helpers.clustered_unit_rows(1, seed=1)[0]
+        codes = self.quantizer.encode(self.corpus[:10])
+        table = self.quantizer.lookup_table(query)
+        estimates = table[np.arange(4), codes].sum(axis=1)
+        np.testing.assert_allclose(
+            estimates, self.quantizer.decode(codes) @ query, rtol=1e-5,
+        )
+
+    def test_small_training_set_gives_small_codebooks(self):
+        quantizer = ProductQuantizer.train(self.corpus[:100], subvectors=4,
+                                           seed=0)
+        self.assertEqual(quantizer.codebooks.shape, (4, 100, 4))
+
+    def test_subvectors_must_divide_dimension(self):
+        with self.assertRaises(ValueError):
+            ProductQuantizer.train(self.corpus, subvectors=5)
+
+
+class TestPQIndex(_bases.TestRerankingIndexBase):
+    """Tests for ``PQIndex``."""
+
+    @property
+    def index_class(self):
+        """``PQIndex``, the class being tested."""
+        return PQIndex
+
+    def make_rows(self):
+        """Make a clustered corpus and queries."""
+        return (_helpers.clustered_unit_rows(1000),
+                _helpers.clustered_unit_rows(50, seed=1))
+
+    def build(self, corpus):
+        """Build an index with 4 parts, so codes take 4 bytes per row."""
+        return PQIndex.build(corpus, subvectors=4, seed=0)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_codes_take_a_byte_per_part(self):
+        self.assertEqual(self.index.codes.nbytes, 4000)
+
+    def test_estimates_are_exact_for_decoded_rows(self):
+        decoded = self.index.quantizer.decode(self.index.codes)
+        indices, scores = self.index.search(self.queries, 10, block_size=64)
+        exact_indices, exact_scores = search.topk(decoded, self.queries, 10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, exact_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_recall_without_rerank_is_moderate(self):
+        self.assertGreater(self.index.recall(self.queries, 10,
+                                             corpus=self.corpus), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
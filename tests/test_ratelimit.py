@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+Tests of client-side rate limiting, by ``embed.rate_limiter``.
+
+This tests ``embed._ratelimit.RateLimiter`` directly, with limits high enough
+that pacing delays are fractions of a second, as well as its use by the
+``requests``-based functions against ``_fake_server.FakeServer``.
+"""
+
+import asyncio
+import concurrent.futures
+import time
+import unittest
+from unittest.mock import patch
+
+import embed
+from embed import _ratelimit
+from tests import _bases, _fake_server
+
+
+def _elapsed(func, *args):
+    """Call ``func`` on ``args``. Give the number of seconds the call took."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def _exhausted(**limits):
+    """Make a rate limiter with the given limits and no remaining capacity."""
+    limiter = _ratelimit.RateLimiter(**limits)
+    limiter.calibrate({
+        'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-remaining-tokens': '0',
+    })
+    return limiter
+
+
+class TestRequestTokens(_bases.TestBase):
+    """Tests for the ``request_tokens`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_single_text_is_estimated(self):
+        self.assertEqual(_ratelimit.request_tokens('abcdef'), 2)
+
+    def test_texts_estimates_are_summed(self):
+        self.assertEqual(_ratelimit.request_tokens(['abc', 'abcdef']), 3)
+
+
+class TestRateLimiter(_bases.TestBase):
+    """Tests for ``RateLimiter``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_unlimited_by_default(self):
+        limiter = _ratelimit.RateLimiter()
+        elapsed = _elapsed(
+            lambda: [limiter.acquire(10**6) for _ in range(1000)],
+        )
+        self.assertLess(elapsed, 0.5)
+
+    def test_limits_are_none_by_default(self):
+        limiter = _ratelimit.RateLimiter()
+        self.assertEqual(
+            (limiter.requests_per_minute, limiter.tokens_per_minute),
+            (None, None),
+        )
+
+    def test_within_capacity_does_not_wait(self):
+        limiter = _ratelimit.RateLimiter(requests_per_minute=600,
+                                         tokens_per_minute=60_000)
+        elapsed = _elapsed(lambda: [limiter.acquire(100) for _ in range(100)])
+        self.assertLess(elapsed, 0.5)
+
+    def test_paces_requests(self):
+        limiter = _exhausted(requests_per_minute=600)  # 10 per second.
+        elapsed = _elapsed(lambda: [limiter.acquire(1) for _ in range(3)])
+        self.assertGreaterEqual(elapsed, 0.25)
+
+    def test_paces_tokens(self):
+        limiter = _exhausted(tokens_per_minute=6000)  # 100 per second.
+        elapsed = _elapsed(limiter.acquire, 30)
+        self.assertGreaterEqual(elapsed, 0.25)
+
+    def test_settle_gives_back_unused_tokens(self):
+        limiter = _ratelimit.RateLimiter(tokens_per_minute=6000)
+        limiter.acquire(6000)
+        limiter.settle(6000, 100)
+        elapsed = _elapsed(limiter.acquire, 1000)
+        self.assertLess(elapsed, 0.1)
+
+    def test_settle_takes_tokens_used_beyond_estimate(self):
+        limiter = _ratelimit.RateLimiter(tokens_per_minute=6000)
+        limiter.acquire(3000)
+        limiter.settle(3000, 5970)
+        elapsed = _elapsed(limiter.acquire, 50)
+        self.assertGreaterEqual(elapsed, 0.15)
+
+    def test_reported_lower_limit_is_used(self):
+        limiter = _ratelimit.RateLimiter(requests_per_minute=60_000)
+        limiter.calibrate({
+            'x-ratelimit-limit-requests': '600',
+            'x-ratelimit-remaining-requests': '0',
+        })
+        elapsed = _elapsed(lambda: [limiter.acquire(1) for _ in range(3)])
+        self.assertGreaterEqual(elapsed, 0.25)
+
+    def test_reported_higher_remaining_does_not_raise_level(self):
+        limiter = _exhausted(requests_per_minute=600)
+        limiter.calibrate({'x-ratelimit-remaining-requests': '600'})
+        elapsed = _elapsed(limiter.acquire, 1)
+        self.assertGreaterEqual(elapsed, 0.05)
+
+    def test_calibrate_without_limit_does_no_pacing(self):
+        limiter = _exhausted()
+        elapsed = _elapsed(lambda: [limiter.acquire(1) for _ in range(100)])
+        self.assertLess(elapsed, 0.1)
+
+    def test_calibrate_ignores_malformed_headers(self):
+        limiter = _ratelimit.RateLimiter(requests_per_minute=600)
+        limiter.calibrate({'x-ratelimit-remaining-requests': 'lots'})
+        elapsed = _elapsed(limiter.acquire, 1)
+        self.assertLess(elapsed, 0.05)
+
+    def test_threads_share_capacity(self):
+        limiter = _exhausted(requests_per_minute=1200)  # 20 per second.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            elapsed = _elapsed(lambda: list(
+                executor.map(limiter.acquire, [1] * 8),
+            ))
+        self.assertGreaterEqual(elapsed, 0.35)
+
+    def test_acquire_async_paces_without_blocking_loop(self):
+        limiter = _exhausted(requests_per_minute=600)  # 10 per second.
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            await asyncio.gather(*(limiter.acquire_async(1) for _ in range(3)))
+            ticker.cancel()
+            return ticks
+
+        start = time.perf_counter()
+        ticks = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        with self.subTest('paced'):
+            self.assertGreaterEqual(elapsed, 0.25)
+        with self.subTest('not blocking'):
+            self.assertGreater(ticks, 10)
+
+    def test_lowering_limit_lowers_level(self):
+        limiter = _ratelimit.RateLimiter(requests_per_minute=60_000)
+        limiter.requests_per_minute = 600
+        elapsed = _elapsed(lambda: [limiter.acquire(1) for _ in range(602)])
+        self.assertGreaterEqual(elapsed, 0.15)
+
+    def test_nonpositive_limit_is_rejected(self):
+        limiter = _ratelimit.RateLimiter()
+        with self.assertRaises(ValueError):
+            limiter.tokens_per_minute = 0
+
+
+class TestRateLimiterRequests(_bases.TestBase):
+    """Tests for ``embed.rate_limiter`` in the ``embed_*_req`` functions."""
+
+    def setUp(self):
+        """Run a fake server, with rate limit headers. Patch the limiter."""
+        super().setUp()
+
+        self.server = self.enterContext(_fake_server.FakeServer(headers={
+            'x-ratelimit-limit-requests': '600',
+            'x-ratelimit-remaining-requests': '0',
+        }))
+        self.limiter = self.enterContext(
+            patch.object(embed, 'rate_limiter', _ratelimit.RateLimiter()),
+        )
+
+        # pylint: disable=protected-access
+        self.enterContext(patch.object(embed, '_EMBEDDINGS_URL',
+                                       self.server.url))
+        self.enterContext(patch.object(embed._keys, 'api_key', 'sk-fake'))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_no_pacing_by_default(self):
+        elapsed = _elapsed(
+            lambda: [embed.embed_one_req(text) for text in 'abcd'],
+        )
+        self.assertLess(elapsed, 0.25)
+
+    def test_headers_calibrate_pacing(self):
+        self.limiter.requests_per_minute = 60_000
+        elapsed = _elapsed(
+            lambda: [embed.embed_one_req(text) for text in 'abcd'],
+        )
+        self.assertGreaterEqual(elapsed, 0.25)
+
+    def test_usage_settles_tokens(self):
+        texts = ['the cat runs', 'a dog walks fast']
+        with patch.object(self.limiter, 'settle') as settle:
+            embed.embed_many_req(texts)
+        settle.assert_called_once_with(_ratelimit.request_tokens(texts), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""Tests of dimensionality reduction with ``embed.reduce``."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import _tensorfile, reduce
+from embed.reduce import Reducer
+from tests import _bases, _helpers
+
+
+class TestReducer(_bases.TestBase):
+    """Tests for ``Reducer``."""
+
+    def setUp(self):
+        """Make a corpus, queries, and a PCA reducer."""
+        super().setUp()
+        self.corpus = _helpers.clustered_unit_rows(1000, 32)
+        self.queries = _helpers.clustered_unit_rows(50, 32, seed=1)
+        self.reducer = Reducer.pca(self.corpus, 8, seed=0)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_pca_components_are_orthonormal(self):
+        components = self.reducer.components
+        np.testing.assert_allclose(components @ components.T, np.eye(8),
+                                   atol=1e-5)
+
+    def test_pca_components_capture_most_of_each_row(self):
+        projections = self.corpus @ self.reducer.components.T
+        kept = (projections**2).sum(axis=1).mean()
+        self.assertGreater(kept, 0.5)
+
+    def test_pca_of_sample_captures_almost_as_much(self):
+        sampled = Reducer.pca(self.corpus, 8, training_size=300, seed=0)
+        kept = [((self.corpus @ reducer.components.T)**2).sum()
+                for reducer in (sampled, self.reducer)]
+        self.assertGreater(kept[0], 0.95 * kept[1])
+
+    def test_pca_blocks_do_not_change_components(self):
+        blocked = Reducer.pca(self.corpus, 8, block_size=3)
+        np.testing.assert_allclose(np.abs(blocked.components),
+                                   np.abs(self.reducer.components),
+                                   atol=1e-4)
+
+    def test_reduced_rows_have_length_1(self):
+        reduced = self.reducer.reduce(self.corpus)
+        with self.subTest('shape'):
+            self.assertEqual(reduced.shape, (1000, 8))
+        with self.subTest('lengths'):
+            np.testing.assert_allclose(np.linalg.norm(reduced, axis=1), 1,
+                                       rtol=1e-5)
+
+    def test_vector_is_reduced_as_vector(self):
+        np.testing.assert_allclose(self.reducer.reduce(self.corpus[7]),
+                                   self.reducer.reduce(self.corpus)[7],
+                                   rtol=1e-6)
+
+    def test_blocks_do_not_change_reductions(self):
+        np.testing.assert_allclose(
+            self.reducer.reduce(self.corpus, block_size=3),
+            self.reducer.reduce(self.corpus),
+            atol=1e-6,
+        )
+
+    def test_truncation_keeps_prefix_normalized(self):
+        reducer = Reducer.truncation(32, 4)
+        prefix = self.corpus[:, :4]
+        np.testing.assert_allclose(
+            reducer.reduce(self.corpus),
+            prefix / np.linalg.norm(prefix, axis=1, keepdims=True),
+            rtol=1e-6,
+        )
+
+    def test_zero_row_stays_zero(self):
+        np.testing.assert_array_equal(self.reducer.reduce(np.zeros(32)),
+                                      np.zeros(8))
+
+    def test_prefix_equals_smaller_pca(self):
+        np.testing.assert_allclose(
+            np.abs(self.reducer.prefix(3).components),
+            np.abs(Reducer.pca(self.corpus, 3, seed=0).components),
+            atol=1e-5,
+        )
+
+    def test_full_dimension_pca_is_exact(self):
+        reducer = Reducer.pca(self.corpus, 32)
+        with self.subTest('recall'):
+            self.assertEqual(reducer.recall(self.corpus, self.queries, 10),
+                             1.0)
+        with self.subTest('error'):
+            mean_error, largest_error = reducer.similarity_error(
+                self.corpus, self.queries)
+            self.assertLess(largest_error, 1e-5)
+            self.assertLessEqual(mean_error, largest_error)
+
+    def test_pca_beats_truncation(self):
+        truncation = Reducer.truncation(32, 8)
+        with self.subTest('recall'):
+            self.assertGreater(
+                self.reducer.recall(self.corpus, self.queries, 10),
+                truncation.recall(self.corpus, self.queries, 10),
+            )
+        with self.subTest('error'):
+            self.assertLess(
+                self.reducer.similarity_error(self.corpus, self.queries)[0],
+                truncation.similarity_error(self.corpus, self.queries)[0],
+            )
+
+    def test_similarity_error_blocks_do_not_change_it(self):
+        mean_error, largest_error = self.reducer.similarity_error(
+            self.corpus, self.queries, block_size=7)
+        expected_mean, expected_largest = self.reducer.similarity_error(
+            self.corpus, self.queries)
+        with self.subTest('mean'):
+            self.assertAlmostEqual(mean_error, expected_mean, places=6)
+        with self.subTest('largest'):
+            self.assertAlmostEqual(largest_error, expected_largest, places=6)
+
+    @parameterized.expand([
+        ('zero', 0),
+        ('too_large', 33),
+    ])
+    def test_invalid_dimension_is_rejected(self, _name, dimension):
+        with self.subTest('pca'):
+            with self.assertRaises(ValueError):
+                Reducer.pca(self.corpus, dimension)
+        with self.subTest('truncation'):
+            with self.assertRaises(ValueError):
+                Reducer.truncation(32, dimension)
+
+    def test_mismatched_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.reducer.reduce(self.queries[:, :8])
+
+    @parameterized.expand([
+        ('pca', False),
+        ('truncation', True),
+    ])
+    def test_loaded_reducer_gives_same_reductions(self, _name, truncate):
+        if truncate:
+            self.reducer = Reducer.truncation(32, 8)
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'reducer.safetensors')
+            self.reducer.save(path)
+            loaded = Reducer.load(path)
+        np.testing.assert_array_equal(loaded.reduce(self.queries),
+                                      self.reducer.reduce(self.queries))
+
+    def test_load_rejects_other_files(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            with self.assertRaises(ValueError):
+                Reducer.load(path)
+
+
+class TestTradeoff(_bases.TestBase):
+    """Tests for ``tradeoff``."""
+
+    def setUp(self):
+        """Make a corpus and queries."""
+        super().setUp()
+        self.corpus = _helpers.clustered_unit_rows(1000, 32)
+        self.queries = _helpers.clustered_unit_rows(50, 32, seed=1)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('pca', False),
+        ('truncation', True),
+    ])
+    def test_rows_match_reducers(self, _name, truncate):
+        rows = reduce.tradeoff(self.corpus, self.queries, 10, [4, 16],
+                               truncate=truncate)
+        full = (Reducer.truncation(32, 16) if truncate
+                else Reducer.pca(self.corpus, 16))
+        for dimension, recall, mean_error, largest_error in rows:
+            reducer = full.prefix(dimension)
+            with self.subTest(dimension=dimension, stat='recall'):
+                self.assertEqual(
+                    recall, reducer.recall(self.corpus, self.queries, 10))
+            with self.subTest(dimension=dimension, stat='error'):
+                self.assertEqual(
+                    (mean_error, largest_error),
+                    reducer.similarity_error(self.corpus, self.queries))
+
+    def test_more_dimensions_give_less_error(self):
+        rows = reduce.tradeoff(self.corpus, self.queries, 10, [2, 8, 32])
+        errors = [mean_error for _, _, mean_error, _ in rows]
+        self.assertEqual(errors, sorted(errors, reverse=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+"""
+Tests of the retry policy used by all functions that request embeddings.
+
+This tests ``embed._retry`` directly, as well as retries by ``embed_*_req``,
+their ``embed.aio`` versions, and ``embed_one``, against
+``_fake_server.FakeServer``. Waits are shortened, so the tests run quickly.
+"""
+
+import datetime
+import email.utils
+import http
+import time
+import unittest
+from unittest.mock import patch
+
+import aiohttp
+import numpy as np
+import openai
+from parameterized import parameterized
+import requests
+
+import embed
+from embed import _http, _retry, aio
+from tests import _bases, _fake_server, _helpers
+
+_SHORT_WAIT = 0.01
+"""Base wait, in seconds, for tests that retry against the fake server."""
+
+
+def _waits(*sent, count=None, time_limit=None):
+    """Get waits from ``wait_gen``, sending it each of ``sent``."""
+    wait = _retry.wait_gen(time_limit=time_limit)
+    wait.send(None)
+    return [wait.send(value) for value in (sent or [None] * count)]
+
+
+class _Failure:
+    """Stand-in for a failed response or exception, with headers."""
+
+    def __init__(self, **headers):
+        """Create a failure with the given headers."""
+        self.headers = headers
+
+
+class TestRetryAfter(_bases.TestBase):
+    """Tests for the ``retry_after`` helper."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_no_headers_give_none(self):
+        self.assertIsNone(_retry.retry_after({}))
+
+    def test_seconds(self):
+        self.assertEqual(_retry.retry_after({'Retry-After': '7'}), 7)
+
+    def test_milliseconds_take_precedence(self):
+        headers = {'Retry-After': '7', 'retry-after-ms': '1500'}
+        self.assertEqual(_retry.retry_after(headers), 1.5)
+
+    def test_date(self):
+        date = (datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(seconds=30))
+        headers = {'Retry-After': email.utils.format_datetime(date)}
+        self.assertAlmostEqual(_retry.retry_after(headers), 30, delta=2)
+
+    def test_past_date_is_zero(self):
+        headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        self.assertEqual(_retry.retry_after(headers), 0)
+
+    def test_reset_of_exhausted_limit(self):
+        headers = {
+            'x-ratelimit-remaining-requests': '0',
+            'x-ratelimit-reset-requests': '1m6.5s',
+            'x-ratelimit-remaining-tokens': '100',
+            'x-ratelimit-reset-tokens': '20ms',
+        }
+        self.assertEqual(_retry.retry_after(headers), 66.5)
+
+    def test_reset_of_limit_with_capacity_is_ignored(self):
+        headers = {
+            'x-ratelimit-remaining-tokens': '100',
+            'x-ratelimit-reset-tokens': '20ms',
+        }
+        self.assertIsNone(_retry.retry_after(headers))
+
+    def test_malformed_header_is_ignored(self):
+        self.assertIsNone(_retry.retry_after({'Retry-After': 'soon'}))
+
+
+class TestWaitGen(_bases.TestBase):
+    """Tests for the ``wait_gen`` wait generator."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_server_wait_is_never_shortened(self):
+        for wait in _waits(*[_Failure(**{'Retry-After': '3'})] * 100):
+            self.assertGreaterEqual(wait, 3)
+
+    def test_server_wait_within_time_limit_is_kept(self):
+        waits = _waits(_Failure(**{'Retry-After': '3'}), time_limit=10)
+        self.assertGreaterEqual(waits[0], 3)
+
+    def test_server_wait_past_time_limit_gives_up(self):
+        with self.assertRaises(StopIteration):
+            _waits(_Failure(**{'Retry-After': '30'}), time_limit=10)
+
+    def test_server_wait_of_http_error_is_used(self):
+        response = requests.Response()
+        response.headers['Retry-After'] = '3'
+        error = requests.HTTPError(response=response)
+        self.assertGreaterEqual(_waits(error)[0], 3)
+
+    def test_server_wait_has_bounded_jitter(self):
+        waits = _waits(*[_Failure(**{'Retry-After': '3'})] * 100)
+        # pylint: disable-next=protected-access
+        self.assertLessEqual(max(waits), 3 + _retry._BASE_WAIT)
+
+    def test_waits_without_server_wait_are_within_bounds(self):
+        waits = _waits(count=100)
+        # pylint: disable=protected-access
+        with self.subTest('min'):
+            self.assertGreaterEqual(min(waits), _retry._BASE_WAIT)
+        with self.subTest('max'):
+            self.assertLessEqual(max(waits), _retry._MAX_WAIT)
+
+    def test_waits_without_server_wait_are_jittered(self):
+        self.assertGreater(len(set(_waits(count=10))), 1)
+
+    def test_waits_without_server_wait_grow(self):
+        waits = _waits(count=1000)
+        self.assertLess(np.mean(waits[:5]), np.mean(waits[-100:]))
+
+
+def _serve(test_case):
+    """
+    Run a fake server for a test. Direct requests to it and shorten waits.
+
+    This only uses ``addCleanup``, so it works in asynchronous test cases.
+    """
+    server = _fake_server.FakeServer()
+    server.__enter__()  # pylint: disable=unnecessary-dunder-call
+    test_case.addCleanup(server.__exit__, None, None, None)
+
+    # pylint: disable=protected-access
+    for patcher in (
+        patch.object(_retry, '_BASE_WAIT', _SHORT_WAIT),
+        patch.object(_retry, '_MAX_TRIES', 3),
+        patch.object(embed, '_EMBEDDINGS_URL', server.url),
+        patch.object(embed._keys, 'api_key', 'sk-fake'),
+        patch.object(openai, 'api_base', server.api_base),
+        patch.object(openai, 'api_key', 'sk-fake'),
+    ):
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+    return server
+
+
+class TestRetry(_bases.TestBase):
+    """Tests for retrying in ``embed_*_req`` and ``embed_one``."""
+
+    def setUp(self):
+        """Run a fake server."""
+        super().setUp()
+        self.server = _serve(self)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('rate_limit', http.HTTPStatus.TOO_MANY_REQUESTS),
+        ('server_error', http.HTTPStatus.INTERNAL_SERVER_ERROR),
+        ('unavailable', http.HTTPStatus.SERVICE_UNAVAILABLE),
+    ])
+    def test_retries_status(self, _name, status):
+        self.server.fail_next(status)
+        result = embed.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola', 'hola'])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    def test_does_not_retry_client_error(self):
+        self.server.fail_next(http.HTTPStatus.BAD_REQUEST)
+        with self.subTest('raises'):
+            with self.assertRaises(requests.HTTPError):
+                embed.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola'])
+
+    def test_gives_up_after_max_tries(self):
+        self.server.fail_next(http.HTTPStatus.SERVICE_UNAVAILABLE, count=5)
+        with self.subTest('raises'):
+            with self.assertRaises(requests.HTTPError):
+                embed.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 3)
+
+    def test_waits_as_long_as_server_says(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS,
+                              headers={'retry-after-ms': '300'})
+        start = time.perf_counter()
+        embed.embed_one_req('hola')
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+
+    def test_gives_up_if_server_wait_passes_time_limit(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS,
+                              headers={'retry-after-ms': '5000'})
+        start = time.perf_counter()
+        with patch.object(_retry, '_MAX_TIME', 1.0):
+            with self.subTest('raises'):
+                with self.assertRaises(requests.HTTPError):
+                    embed.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola'])
+        with self.subTest('did not wait'):
+            self.assertLess(time.perf_counter() - start, 1.0)
+
+    def test_connection_errors_and_statuses_share_max_tries(self):
+        self.server.fail_next(http.HTTPStatus.SERVICE_UNAVAILABLE, count=5)
+        post = _http.PooledSession.post
+        failures = [requests.ConnectionError('fake failure')]
+
+        def flaky_post(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return post(*args, **kwargs)
+
+        with patch.object(_http.PooledSession, 'post', autospec=True,
+                          side_effect=flaky_post):
+            with self.subTest('raises'):
+                with self.assertRaises(requests.HTTPError):
+                    embed.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 2)
+
+    def test_retries_connection_error(self):
+        post = _http.PooledSession.post
+        failures = [requests.ConnectionError('fake failure')]
+
+        def flaky_post(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return post(*args, **kwargs)
+
+        with patch.object(_http.PooledSession, 'post', autospec=True,
+                          side_effect=flaky_post):
+            result = embed.embed_one_req('hola')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+    def test_openai_path_retries_server_error(self):
+        self.server.fail_next(http.HTTPStatus.SERVICE_UNAVAILABLE)
+        result = embed.embed_one('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola', 'hola'])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    def test_openai_path_does_not_retry_client_error(self):
+        self.server.fail_next(http.HTTPStatus.BAD_REQUEST)
+        with self.subTest('raises'):
+            with self.assertRaises(openai.error.InvalidRequestError):
+                embed.embed_one('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola'])
+
+
+class TestRetryAio(unittest.IsolatedAsyncioTestCase):
+    """Tests for retrying in ``embed.aio``."""
+
+    def setUp(self):
+        """Run a fake server."""
+        super().setUp()
+        self.server = _serve(self)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    async def test_retries_server_error(self):
+        self.server.fail_next(http.HTTPStatus.BAD_GATEWAY)
+        result = await aio.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola', 'hola'])
+        with self.subTest('result'):
+            np.testing.assert_array_equal(result,
+                                          _helpers.fake_embed_one('hola'))
+
+    async def test_does_not_retry_client_error(self):
+        self.server.fail_next(http.HTTPStatus.NOT_FOUND)
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await aio.embed_one_req('hola')
+
+    async def test_gives_up_after_max_tries(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS, count=5)
+        with self.subTest('raises'):
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await aio.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(len(self.server.requests), 3)
+
+    async def test_waits_as_long_as_server_says(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS,
+                              headers={'Retry-After': '1'})
+        start = time.perf_counter()
+        await aio.embed_one_req('hola')
+        self.assertGreaterEqual(time.perf_counter() - start, 1)
+
+    async def test_gives_up_if_server_wait_passes_time_limit(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS,
+                              headers={'retry-after-ms': '5000'})
+        start = time.perf_counter()
+        with patch.object(_retry, '_MAX_TIME', 1.0):
+            with self.subTest('raises'):
+                with self.assertRaises(aiohttp.ClientResponseError):
+                    await aio.embed_one_req('hola')
+        with self.subTest('requests'):
+            self.assertEqual(self.server.inputs, ['hola'])
+        with self.subTest('did not wait'):
+            self.assertLess(time.perf_counter() - start, 1.0)
+
+    async def test_openai_path_retries_rate_limit(self):
+        self.server.fail_next(http.HTTPStatus.TOO_MANY_REQUESTS)
+        result = await aio.embed_one('hola')
+        np.testing.assert_array_equal(result, _helpers.fake_embed_one('hola'))
+
+
+if __name__ == '__main__':
+    unittest.main()
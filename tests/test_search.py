@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Tests of exact nearest-neighbor search in ``embed.search``."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import search
+from tests import _bases
+
+
+def _unit_rows(count, dimension=32, *, seed=0):
+    """Make a matrix of random float32 rows normalized to length 1."""
+    rng = np.random.default_rng(seed)
+    rows = rng.standard_normal((count, dimension)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def _brute_force(corpus, queries, k):
+    """Find top-``k`` indices by sorting the full matrix of scores."""
+    return np.argsort(-(queries @ corpus.T), axis=1, kind='stable')[:, :k]
+
+
+class TestTopK(_bases.TestBase):
+    """Tests for ``search.topk``."""
+
+    def setUp(self):
+        """Make a corpus and queries."""
+        super().setUp()
+        self.corpus = _unit_rows(500)
+        self.queries = _unit_rows(40, seed=1)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('one_block', None),
+        ('many_blocks', 7),
+        ('single_rows', 1),
+    ])
+    def test_matches_brute_force(self, _name, block_size):
+        indices, _ = search.topk(self.corpus, self.queries, 10,
+                                 block_size=block_size)
+        expected = _brute_force(self.corpus, self.queries, 10)
+        np.testing.assert_array_equal(indices, expected)
+
+    def test_scores_are_dot_products(self):
+        indices, scores = search.topk(self.corpus, self.queries, 5,
+                                      block_size=64)
+        expected = np.einsum('qd,qkd->qk', self.queries, self.corpus[indices])
+        np.testing.assert_allclose(scores, expected, rtol=1e-5)
+
+    def test_scores_are_descending(self):
+        _, scores = search.topk(self.corpus, self.queries, 20, block_size=64)
+        self.assertTrue((np.diff(scores, axis=1) <= 0).all())
+
+    def test_matrix_of_queries_gives_matrices(self):
+        indices, scores = search.topk(self.corpus, self.queries, 3)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (40, 3))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (40, 3))
+
+    def test_vector_query_gives_vectors(self):
+        indices, scores = search.topk(self.corpus, self.queries[0], 3)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(
+                indices, _brute_force(self.corpus, self.queries[:1], 3)[0])
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (3,))
+
+    def test_query_in_corpus_finds_itself(self):
+        indices, scores = search.topk(self.corpus, self.corpus[123], 1)
+        with self.subTest('index'):
+            self.assertEqual(indices[0], 123)
+        with self.subTest('score'):
+            self.assertAlmostEqual(scores[0], 1.0, places=5)
+
+    def test_k_above_corpus_size_gives_whole_corpus(self):
+        indices, _ = search.topk(self.corpus[:6], self.queries, 10,
+                                 block_size=4)
+        self.assertEqual(sorted(indices[0]), list(range(6)))
+
+    def test_memory_mapped_corpus(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'corpus.npy')
+            np.save(path, self.corpus)
+            corpus = np.load(path, mmap_mode='r')
+            indices, _ = search.topk(corpus, self.queries, 10, block_size=64)
+            del corpus  # Close the file, so it can be deleted on Windows.
+        expected = _brute_force(self.corpus, self.queries, 10)
+        np.testing.assert_array_equal(indices, expected)
+
+    @parameterized.expand([
+        ('k', {'k': 0}),
+        ('block_size', {'k': 1, 'block_size': 0}),
+    ])
+    def test_nonpositive_is_rejected(self, _name, kwargs):
+        with self.assertRaises(ValueError):
+            search.topk(self.corpus, self.queries, **kwargs)
+
+    def test_mismatched_dimension_is_rejected(self):
+        with self.assertRaises(ValueError):
+            search.topk(self.corpus, self.queries[:, :16], 1)
+
+
+class TestRecall(_bases.TestBase):
+    """Tests for ``search.recall``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_same_neighbors_in_any_order_is_full_recall(self):
+        self.assertEqual(search.recall([[3, 1, 2]], [[1, 2, 3]]), 1.0)
+
+    def test_partial_recall_is_averaged_over_queries(self):
+        found = [[1, 2, 9], [4, 5, 6]]
+        exact = [[1, 2, 3], [4, 5, 6]]
+        self.assertAlmostEqual(search.recall(found, exact), 5 / 6)
+
+    def test_vectors_are_one_query(self):
+        self.assertEqual(search.recall([7, 8], [8, 9]), 0.5)
+
+    def test_mismatched_query_counts_are_rejected(self):
+        with self.assertRaises(ValueError):
+            search.recall([[1], [2]], [[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
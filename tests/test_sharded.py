@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""Tests of multi-process exact search with ``embed.sharded``."""
+
+import gc
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+from embed import _tensorfile, search, sharded
+from embed.sharded import ShardedSearcher
+from tests import _bases, _helpers
+
+
+def _worker_shard():
+    """In a worker, get its process ID and the range of rows it maps."""
+    # pylint: disable-next=protected-access
+    state = sharded._worker_state
+    return os.getpid(), state['start'], state['start'] + len(state['shard'])
+
+
+class TestShardedSearcher(_bases.TestBase):
+    """Tests for ``ShardedSearcher``."""
+
+    def setUp(self):
+        """Make a corpus and queries."""
+        super().setUp()
+        self.corpus = _helpers.clustered_unit_rows(1000)
+        self.queries = _helpers.clustered_unit_rows(50, seed=1)
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand([
+        ('one_shard', 1),
+        ('several_shards', 3),
+    ])
+    def test_results_equal_exact_search(self, _name, max_workers):
+        with ShardedSearcher(self.corpus, max_workers=max_workers) as searcher:
+            indices, scores = searcher.search(self.queries, 10)
+        exact_indices, exact_scores = search.topk(self.corpus, self.queries,
+                                                  10)
+        with self.subTest('indices'):
+            np.testing.assert_array_equal(indices, exact_indices)
+        with self.subTest('scores'):
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_vector_query_gives_vectors(self):
+        with ShardedSearcher(self.corpus, max_workers=2) as searcher:
+            indices, scores = searcher.search(self.queries[0], 5)
+        with self.subTest('indices'):
+            self.assertEqual(indices.shape, (5,))
+        with self.subTest('scores'):
+            self.assertEqual(scores.shape, (5,))
+
+    def test_k_above_size_gives_all_rows(self):
+        with ShardedSearcher(self.corpus[:5], max_workers=3) as searcher:
+            indices, _ = searcher.search(self.queries[0], 10)
+        self.assertEqual(sorted(indices), list(range(5)))
+
+    def test_shards_are_at_most_rows(self):
+        with ShardedSearcher(self.corpus[:2], max_workers=4) as searcher:
+            self.assertEqual(searcher.shards, 2)
+
+    def test_sizes(self):
+        with ShardedSearcher(self.corpus, max_workers=2) as searcher:
+            with self.subTest('len'):
+                self.assertEqual(len(searcher), 1000)
+            with self.subTest('dimension'):
+                self.assertEqual(searcher.dimension, 16)
+            with self.subTest('shards'):
+                self.assertEqual(searcher.shards, 2)
+
+    def test_memory_mapped_corpus_is_not_copied(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            arrays, _ = _tensorfile.load(path, mmap=True)
+            with patch.object(sharded, '_write_file') as mock:
+                with ShardedSearcher(arrays['embeddings'],
+                                     max_workers=2) as searcher:
+                    indices, _ = searcher.search(self.queries, 10)
+            del arrays  # Close the file, so it can be deleted on Windows.
+        with self.subTest('not copied'):
+            mock.assert_not_called()
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                indices, search.topk(self.corpus, self.queries, 10)[0])
+
+    def test_memory_mapped_rows_are_mapped_from_their_start(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings.safetensors')
+            _tensorfile.save(path, {'embeddings': self.corpus}, {})
+            arrays, _ = _tensorfile.load(path, mmap=True)
+            with ShardedSearcher(arrays['embeddings'][500:],
+                                 max_workers=2) as searcher:
+                indices, _ = searcher.search(self.queries, 10)
+            del arrays  # Close the file, so it can be deleted on Windows.
+        np.testing.assert_array_equal(
+            indices, search.topk(self.corpus[500:], self.queries, 10)[0])
+
+    def test_slice_of_memmap_is_mapped_from_its_start(self):
+        with TemporaryDirectory() as dir_name:
+            path = Path(dir_name, 'embeddings')
+            self.corpus.tofile(path)
+            mapped = np.memmap(path, dtype=np.float32, mode='r',
+                               shape=self.corpus.shape)
+            with patch.object(sharded, '_write_file') as mock:
+                with ShardedSearcher(mapped[500:], max_workers=2) as searcher:
+                    indices, _ = searcher.search(self.queries, 10)
+            del mapped  # Close the file, so it can be deleted on Windows.
+        with self.subTest('not copied'):
+            mock.assert_not_called()
+        with self.subTest('results'):
+            np.testing.assert_array_equal(
+                indices, search.topk(self.corpus[500:], self.queries, 10)[0])
+
+    def test_close_removes_temporary_copy(self):
+        searcher = ShardedSearcher(self.corpus, max_workers=2)
+        # pylint: disable-next=protected-access
+        directory = searcher._temporary_dir
+        searcher.close()
+        self.assertFalse(directory.exists())
+
+    def test_garbage_collection_removes_temporary_copy(self):
+        searcher = ShardedSearcher(self.corpus, max_workers=2)
+        # pylint: disable-next=protected-access
+        directory = searcher._temporary_dir
+        del searcher
+        gc.collect()
+        self.assertFalse(directory.exists())
+
+    def test_each_shard_stays_in_its_own_worker(self):
+        with ShardedSearcher(self.corpus, max_workers=3) as searcher:
+            # pylint: disable-next=protected-access
+            executors = searcher._executors
+            first = [executor.submit(_worker_shard).result()
+                     for executor in executors]
+            searcher.search(self.queries, 10)
+            again = [executor.submit(_worker_shard).result()
+                     for executor in executors]
+        with self.subTest('same workers'):
+            self.assertEqual(again, first)
+        with self.subTest('distinct workers'):
+            self.assertEqual(len({pid for pid, _, _ in first}), 3)
+        with self.subTest('ranges'):
+            self.assertEqual([(start, stop) for _, start, stop in first],
+                             [(0, 333), (333, 667), (667, 1000)])
+
+    def test_nonpositive_max_workers_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ShardedSearcher(self.corpus, max_workers=0)
+
+    def test_mismatched_dimension_is_rejected(self):
+        with ShardedSearcher(self.corpus, max_workers=2) as searcher:
+            with self.assertRaises(ValueError):
+                searcher.search(self.queries[:, :8], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+Tests of single-flight coordination of concurrent cache misses.
+
+This tests ``embed._singleflight.SingleFlight`` directly, as well as its use
+in ``embed.cached`` to keep threads from computing the same miss at once.
+"""
+
+import concurrent.futures
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from parameterized import parameterized
+
+import embed
+from embed import _memory, _singleflight, cached
+from tests import _bases, _helpers
+
+_THREAD_COUNT = 8
+"""Number of threads that make the same call at once in the tests."""
+
+
+def _run_together(func, count=_THREAD_COUNT):
+    """Call ``func`` on ``count`` threads at once. Return its results."""
+    barrier = threading.Barrier(count)
+
+    def work():
+        barrier.wait()
+        return func()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(work) for _ in range(count)]
+        return [future.result() for future in futures]
+
+
+class _SlowRecorder:
+    """Fake ``embed_many`` that is slow and records the texts it embeds."""
+
+    def __init__(self, delay=0.1):
+        """Create a recorder whose calls each take ``delay`` seconds."""
+        self._delay = delay
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, texts):
+        """Record and embed texts with the fake embedder, after a delay."""
+        with self._lock:
+            self.calls.append(list(texts))
+        time.sleep(self._delay)
+        return _helpers.fake_embed_many(texts)
+
+
+class TestSingleFlight(_bases.TestBase):
+    """Tests for ``SingleFlight``."""
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    def test_concurrent_runs_call_once(self):
+        flights = _singleflight.SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(None)
+            time.sleep(0.1)
+            return object()
+
+        results = _run_together(lambda: flights.run('key', compute))
+        with self.subTest('calls'):
+            self.assertEqual(len(calls), 1)
+        with self.subTest('results'):
+            self.assertTrue(all(result is results[0] for result in results))
+
+    def test_sequential_runs_each_call(self):
+        flights = _singleflight.SingleFlight()
+        results = [flights.run('key', object) for _ in range(3)]
+        self.assertEqual(len(set(map(id, results))), 3)
+
+    def test_different_keys_do_not_wait(self):
+        flights = _singleflight.SingleFlight()
+        first, first_leads = flights.claim('a')
+        _, second_leads = flights.claim('b')
+        first.succeed(None)
+        self.assertTrue(first_leads and second_leads)
+
+    def test_error_reaches_waiters(self):
+        flights = _singleflight.SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise RuntimeError('fake failure')
+
+        def call():
+            try:
+                flights.run('key', fail)
+            except RuntimeError as error:
+                return str(error)
+            return None
+
+        results = _run_together(call)
+        self.assertEqual(results, ['fake failure'] * _THREAD_COUNT)
+
+    def test_fail_after_succeed_keeps_value(self):
+        flight, _ = _singleflight.SingleFlight().claim('key')
+        flight.succeed('value')
+        flight.fail(RuntimeError('fake failure'))
+        self.assertEqual(flight.wait(), 'value')
+
+    def test_finished_flights_are_removed(self):
+        flights = _singleflight.SingleFlight()
+        _run_together(lambda: flights.run('key', object))
+        self.assertEqual(len(flights), 0)
+
+
+class TestCachedSingleFlight(_bases.TestBase):
+    """Tests that ``embed.cached`` computes concurrent misses only once."""
+
+    def setUp(self):
+        """Create a temporary directory. Patch the embedder and memory tier."""
+        super().setUp()
+
+        # pylint: disable-next=consider-using-with
+        self.dir_path = Path(self.enterContext(TemporaryDirectory()))
+
+        self.enterContext(patch.object(cached, 'memory_cache',
+                                       _memory.MemoryCache()))
+        self.recorder = _SlowRecorder()
+        self.enterContext(patch(
+            target=f'{embed.__name__}.embed_many',
+            side_effect=self.recorder,
+            __name__='embed_many',
+        ))
+
+    # pylint: disable=missing-function-docstring  # Tests' names describe them.
+
+    @parameterized.expand(['json', 'safetensors', 'packed'])
+    def test_concurrent_misses_call_once(self, file_type):
+        # pylint: disable-next=protected-access
+        with patch.dict(cached._packed_stores):
+            results = _run_together(lambda: cached.embed_many(
+                ['hola', 'hello'], data_dir=self.dir_path,
+                file_type=file_type,
+            ))
+        with self.subTest('calls'):
+            self.assertEqual(len(self.recorder.calls), 1)
+        with self.subTest('results'):
+            for result in results:
+                np.testing.assert_array_equal(
+                    result,
+                    _helpers.fake_embed_many(['hola', 'hello']),
+                )
+
+    def test_per_text_overlapping_misses_are_sent_once(self):
+        batches = [['a', 'b', 'c'], ['b', 'c', 'd'], ['c', 'd', 'a']]
+        barrier = threading.Barrier(len(batches))
+
+        def work(texts):
+            barrier.wait()
+            return cached.embed_many(texts, data_dir=self.dir_path,
+                                     file_type='json', per_text=True)
+
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            results = list(executor.map(work, batches))
+
+        with self.subTest('sent'):
+            sent = sum(self.recorder.calls, [])
+            self.assertCountEqual(sent, ['a', 'b', 'c', 'd'])
+        for texts, result in zip(batches, results):
+            with self.subTest(texts=texts):
+                np.testing.assert_array_equal(
+                    result,
+                    _helpers.fake_embed_many(texts),
+                )
+
+    def test_error_reaches_all_concurrent_callers(self):
+        def fail(texts):
+            time.sleep(0.1)
+            raise RuntimeError(f'fake failure on {texts!r}')
+
+        def call():
+            try:
+                cached.embed_many(['hola'], data_dir=self.dir_path,
+                                  file_type='json')
+            except RuntimeError as error:
+                return str(error)
+            return None
+
+        with patch.object(embed, 'embed_many', side_effect=fail,
+                          __name__='embed_many'):
+            results = _run_together(call)
+        self.assertEqual(results,
+                         ["fake failure on ['hola']"] * _THREAD_COUNT)
+
+    def test_batch_failure_keeps_flights_already_succeeded(self):
+        # pylint: disable=protected-access  # Simulates a concurrent cacher.
+        claimed = {}
+        real_lookup = cached._lookup
+        hola_path = cached._build_path('hola', self.dir_path, 'json')
+        hola_lookups = []
+
+        class RecordingFlights(_singleflight.SingleFlight):
+            """Single-flight table that records the flights it gives."""
+
+            def claim(self, key):
+                flight, leader = super().claim(key)
+                claimed[key] = flight
+                return flight, leader
+
+        def lookup(name, path, load):
+            if path != hola_path:
+                return real_lookup(name, path, load)
+            hola_lookups.append(path)
+            if len(hola_lookups) == 1:  # Missing when first looked up.
+                return None
+            return _helpers.fake_embed_one('hola')  # Cached by another.
+
+        with patch.object(cached, '_flights', RecordingFlights()), \
+                patch.object(cached, '_lookup', side_effect=lookup), \
+                patch.object(embed, 'embed_many', __name__='embed_many',
+                             side_effect=RuntimeError('fake failure')):
+            with self.assertRaises(RuntimeError):
+                cached.embed_many(['hola', 'hello'], data_dir=self.dir_path,
+                                  file_type='json', per_text=True)
+
+        np.testing.assert_array_equal(
+            claimed[hola_path.absolute()].wait(),
+            _helpers.fake_embed_one('hola'),
+        )
+
+    def test_miss_after_failure_is_retried(self):
+        with patch.object(embed, 'embed_many', __name__='embed_many',
+                          side_effect=RuntimeError('fake failure')):
+            with self.assertRaises(RuntimeError):
+                cached.embed_many(['hola'], data_dir=self.dir_path,
+                                  file_type='json')
+        result = cached.embed_many(['hola'], data_dir=self.dir_path,
+                                   file_type='json')
+        np.testing.assert_array_equal(result,
+                                      _helpers.fake_embed_many(['hola']))
+
+
+if __name__ == '__main__':
+    unittest.main()